@@ -0,0 +1,386 @@
+"""Admission control for Veo submissions (predictLongRunning).
+
+Requests wait in per-user FIFO queues that are served round-robin, so a
+user with a burst of submissions gets one slot per round instead of
+starving everyone else. A dispatcher thread admits the next request when
+a concurrency slot is free and the global token bucket (sized to the
+project quota) has a token. Upstream 429/503 responses are retried with
+full-jitter exponential backoff; a 429 also pauses the bucket, so the
+whole queue backs off instead of hammering the quota.
+"""
+import asyncio
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_SCHEDULER = os.getenv('ADMISSION_SCHEDULER', '1') == '1'
+# Veo's default quota is 10 predictLongRunning requests per minute per base model.
+# The bucket admits at most burst + rate in any minute, so the defaults (5 + 5) stay
+# within it; raise both only after a quota increase. 0 disables the token bucket
+# (concurrency limit and fair queuing still apply) and every burst hits the quota.
+ADMISSION_RATE_PER_MINUTE = float(os.getenv('ADMISSION_RATE_PER_MINUTE', 5))
+ADMISSION_BURST = int(os.getenv('ADMISSION_BURST', 5))
+ADMISSION_MAX_CONCURRENCY = int(os.getenv('ADMISSION_MAX_CONCURRENCY', 8))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 500))
+ADMISSION_MAX_QUEUE_PER_USER = int(os.getenv('ADMISSION_MAX_QUEUE_PER_USER', 10))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', 30))
+ADMISSION_MAX_RETRIES = int(os.getenv('ADMISSION_MAX_RETRIES', 3))
+ADMISSION_BACKOFF_BASE = float(os.getenv('ADMISSION_BACKOFF_BASE', 1))
+ADMISSION_BACKOFF_MAX = float(os.getenv('ADMISSION_BACKOFF_MAX', 20))
+
+RETRY_STATUSES = (429, 503)
+
+
+class AdmissionRejected(Exception):
+    """The request can't be admitted within the wait budget; try again after `eta_seconds`."""
+
+    def __init__(self, message, position, eta_seconds):
+        super().__init__(message)
+        self.position = position
+        self.eta_seconds = eta_seconds
+
+    @property
+    def retry_after(self):
+        return max(1, math.ceil(self.eta_seconds))
+
+
+class TokenBucket:
+    """`rate` tokens per second up to `burst`. Not thread-safe; the scheduler holds its lock."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def _refill(self):
+        now = self.clock()
+        # Nothing accrues while paused
+        since = max(self.updated, min(now, self.paused_until))
+        self.tokens = min(self.burst, self.tokens + (now - since) * self.rate)
+        self.updated = now
+        return now
+
+    def delay(self):
+        """Seconds until a token can be taken."""
+        now = self._refill()
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """Hand out nothing for `seconds` and start again from an empty bucket."""
+        now = self._refill()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+    def eta(self, position):
+        """Seconds until the `position`-th token (1-based) is available."""
+        now = self._refill()
+        paused = max(0.0, self.paused_until - now)
+        return paused + max(0.0, position - self.tokens) / self.rate
+
+
+class _Ticket:
+    def __init__(self, user, loop=None):
+        self.user = user
+        self.granted = False
+        # An async waiter gets a future on its event loop instead of parking a thread
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def grant(self):
+        """Called by the dispatcher with the scheduler lock held."""
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+            return
+        try:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        except RuntimeError:
+            # The loop is closed; nobody is waiting any more
+            pass
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+def client_key(app_user_id=None, forwarded_for='', remote_addr=None):
+    """Fair-queue key: the app user when known, otherwise the client address."""
+    if app_user_id:
+        return f'user:{app_user_id}'
+    forwarded = (forwarded_for or '').split(',')[0].strip()
+    return f'ip:{forwarded or remote_addr}'
+
+
+def backoff_delay(attempt, base=ADMISSION_BACKOFF_BASE, cap=ADMISSION_BACKOFF_MAX, retry_after=None):
+    """Full-jitter exponential backoff, never shorter than an upstream Retry-After."""
+    delay = random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+    if retry_after:
+        try:
+            delay = max(delay, min(cap, float(retry_after)))
+        except ValueError:
+            pass
+    return delay
+
+
+class AdmissionScheduler:
+    """Fair, quota-aware gate in front of predictLongRunning.
+
+    run(user, send) queues the caller, blocks until it is admitted, calls
+    `send()` (which must return a requests-style response) and retries it
+    on 429/503. run_async() does the same on an event loop without holding
+    a thread while queued. Callers whose estimated wait exceeds `max_wait`,
+    or who arrive at a full queue, get AdmissionRejected right away.
+    """
+
+    def __init__(self, rate_per_minute=ADMISSION_RATE_PER_MINUTE, burst=ADMISSION_BURST,
+                 max_concurrency=ADMISSION_MAX_CONCURRENCY, max_queue=ADMISSION_MAX_QUEUE,
+                 max_queue_per_user=ADMISSION_MAX_QUEUE_PER_USER, max_wait=ADMISSION_MAX_WAIT,
+                 max_retries=ADMISSION_MAX_RETRIES, backoff_base=ADMISSION_BACKOFF_BASE,
+                 backoff_max=ADMISSION_BACKOFF_MAX):
+        self.bucket = TokenBucket(rate_per_minute / 60, burst) if rate_per_minute > 0 else None
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._active = 0
+        self._service_seconds = 1.0
+        self._thread = None
+        self._counters = {'admitted': 0, 'rejected_full': 0, 'rejected_timeout': 0, 'retries': 0,
+                          'upstream_throttled': 0}
+
+    def run(self, user, send):
+        """Return (response, queue_info) for `send()` once admitted."""
+        started = time.monotonic()
+        info = None
+        attempt = 0
+        while True:
+            ticket, position, eta = self._enqueue(user, retry=attempt > 0)
+            if info is None:
+                info = {'position': position, 'eta_seconds': round(eta, 1)}
+            self._wait(ticket, position, eta)
+
+            sent_at = time.monotonic()
+            try:
+                response = send()
+            finally:
+                self._release(time.monotonic() - sent_at)
+
+            delay = self._retry_delay(response, attempt + 1)
+            if delay is None:
+                return response, self._finished(info, started, sent_at, attempt)
+            attempt += 1
+            time.sleep(delay)
+
+    async def run_async(self, user, send):
+        """run() for the event loop: `send` is a coroutine function, and waiting doesn't take a thread."""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        info = None
+        attempt = 0
+        while True:
+            ticket, position, eta = self._enqueue(user, retry=attempt > 0, loop=loop)
+            if info is None:
+                info = {'position': position, 'eta_seconds': round(eta, 1)}
+            await self._wait_async(ticket, position, eta)
+
+            sent_at = time.monotonic()
+            try:
+                response = await send()
+            finally:
+                self._release(time.monotonic() - sent_at)
+
+            delay = self._retry_delay(response, attempt + 1)
+            if delay is None:
+                return response, self._finished(info, started, sent_at, attempt)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, response, attempt):
+        """Backoff before retry number `attempt`, or None if `response` is final."""
+        if response.status_code not in RETRY_STATUSES or attempt > self.max_retries:
+            return None
+        delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, response.headers.get('Retry-After'))
+        with self._cond:
+            self._counters['retries'] += 1
+            if response.status_code == 429:
+                self._counters['upstream_throttled'] += 1
+                if self.bucket is not None:
+                    # The quota is shared, so everyone waits, not just this request
+                    self.bucket.pause(delay)
+        logger.warning(f"Upstream returned {response.status_code}; retry {attempt} in {delay:.1f}s")
+        return delay
+
+    @staticmethod
+    def _finished(info, started, sent_at, retries):
+        info['waited_ms'] = round((sent_at - started) * 1000, 1)
+        info['retries'] = retries
+        return info
+
+    def _enqueue(self, user, retry=False, loop=None):
+        with self._cond:
+            queue = self._queues.get(user)
+            if not retry:
+                queued_for_user = len(queue) if queue is not None else 0
+                if self._queued >= self.max_queue or queued_for_user >= self.max_queue_per_user:
+                    self._counters['rejected_full'] += 1
+                    position = self._position_of(user, queued_for_user)
+                    raise AdmissionRejected('Generation queue is full', position, self._eta(position))
+
+            ticket = _Ticket(user, loop)
+            if queue is None:
+                queue = self._queues[user] = deque()
+                if retry:
+                    self._queues.move_to_end(user, last=False)
+            if retry:
+                # A retried request keeps its turn instead of going to the back
+                queue.appendleft(ticket)
+            else:
+                queue.append(ticket)
+            self._queued += 1
+            position = self._position_of(user, queue.index(ticket))
+            eta = self._eta(position)
+
+            if not retry and eta > self.max_wait:
+                self._remove(ticket)
+                self._counters['rejected_full'] += 1
+                raise AdmissionRejected('Generation queue is full', position, eta)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, name='admission', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return ticket, position, eta
+
+    def _wait(self, ticket, position, eta):
+        if ticket.event.wait(max(self.max_wait, eta) + self.backoff_max):
+            return
+        with self._cond:
+            if ticket.granted:
+                return
+            self._remove(ticket)
+            self._counters['rejected_timeout'] += 1
+        raise AdmissionRejected('Timed out waiting in the generation queue', position, eta)
+
+    async def _wait_async(self, ticket, position, eta):
+        try:
+            await asyncio.wait_for(ticket.future, max(self.max_wait, eta) + self.backoff_max)
+            return
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # The client went away: give up the place in the queue, or the slot if it was just granted
+            with self._cond:
+                if ticket.granted:
+                    self._release()
+                else:
+                    self._remove(ticket)
+            raise
+        with self._cond:
+            if ticket.granted:
+                return
+            self._remove(ticket)
+            self._counters['rejected_timeout'] += 1
+        raise AdmissionRejected('Timed out waiting in the generation queue', position, eta)
+
+    def _release(self, service_seconds=None):
+        with self._cond:
+            self._active -= 1
+            if service_seconds is not None:
+                # Moving average of how long a submission holds its slot, for ETAs
+                self._service_seconds += 0.2 * (service_seconds - self._service_seconds)
+            self._cond.notify_all()
+
+    def _remove(self, ticket):
+        queue = self._queues.get(ticket.user)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            self._queued -= 1
+            if not queue:
+                del self._queues[ticket.user]
+
+    def _position_of(self, user, index):
+        """1-based place in the round-robin order of the `index`-th ticket in `user`'s queue."""
+        ahead = 0
+        for other, queue in self._queues.items():
+            if other == user:
+                ahead += min(len(queue), index)
+            else:
+                # Users earlier in the rotation also get a turn in our round
+                ahead += min(len(queue), index + (1 if self._before(other, user) else 0))
+        return ahead + 1
+
+    def _before(self, other, user):
+        for name in self._queues:
+            if name == other:
+                return True
+            if name == user:
+                return False
+        return True
+
+    def _eta(self, position):
+        free_slots = self.max_concurrency - self._active
+        eta = max(0, position - free_slots) * self._service_seconds / self.max_concurrency
+        if self.bucket is not None:
+            eta = max(eta, self.bucket.eta(position))
+        return eta
+
+    def _dispatch(self):
+        with self._cond:
+            while True:
+                if not self._queued or self._active >= self.max_concurrency:
+                    self._cond.wait()
+                    continue
+                if self.bucket is not None:
+                    delay = self.bucket.delay()
+                    if delay > 0:
+                        self._cond.wait(delay)
+                        continue
+                    self.bucket.take()
+
+                user, queue = next(iter(self._queues.items()))
+                ticket = queue.popleft()
+                self._queued -= 1
+                if queue:
+                    self._queues.move_to_end(user)
+                else:
+                    del self._queues[user]
+
+                self._active += 1
+                self._counters['admitted'] += 1
+                ticket.grant()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats['queued'] = self._queued
+            stats['queued_users'] = len(self._queues)
+            stats['active'] = self._active
+            stats['avg_service_ms'] = round(self._service_seconds * 1000, 1)
+            if self.bucket is not None:
+                stats['tokens'] = round(min(self.bucket.burst, self.bucket.tokens), 2)
+        return stats
@@ -0,0 +1,41 @@
+"""add operations table
+
+Revision ID: 3f7d2a9c6b81
+Revises: 9e4b2c8a1d57
+Create Date: 2026-10-18 14:26:51.093417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f7d2a9c6b81'
+down_revision: Union[str, None] = '9e4b2c8a1d57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('operations',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('app_user_id', sa.UUID(), nullable=False),
+    sa.Column('model', sa.String(), nullable=False),
+    sa.Column('params_hash', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('result_uri', sa.String(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_index('ix_operations_app_user_id_created_at', 'operations', ['app_user_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_operations_app_user_id_created_at', table_name='operations')
+    op.drop_table('operations')
@@ -0,0 +1,39 @@
+"""add credit_holds table
+
+Revision ID: 5c1e9a7d3f20
+Revises: 24b4b7430045
+Create Date: 2026-10-18 09:12:40.518223
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1e9a7d3f20'
+down_revision: Union[str, None] = '24b4b7430045'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('credit_holds',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('app_user_id', sa.UUID(), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('operation_name', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_credit_holds_app_user_id'), 'credit_holds', ['app_user_id'], unique=False)
+    op.create_index(op.f('ix_credit_holds_operation_name'), 'credit_holds', ['operation_name'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_credit_holds_operation_name'), table_name='credit_holds')
+    op.drop_index(op.f('ix_credit_holds_app_user_id'), table_name='credit_holds')
+    op.drop_table('credit_holds')
@@ -0,0 +1,37 @@
+"""add webhook_events.credits_granted
+
+Revision ID: 7a2d4e6f8b13
+Revises: 3f7d2a9c6b81
+Create Date: 2026-10-18 16:02:37.418265
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a2d4e6f8b13'
+down_revision: Union[str, None] = '3f7d2a9c6b81'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('webhook_events', sa.Column('credits_granted', sa.Integer(), server_default='0', nullable=False))
+    # Existing renewals were granted under these rules, but only when the user
+    # already existed as the event was stored; the handler granted nothing
+    # otherwise. Those stay at 0 so a replay can still grant them.
+    op.execute(
+        "UPDATE webhook_events SET credits_granted = CASE product_id "
+        "WHEN 'com.vemix.weekly' THEN 10 WHEN 'com.vemix.yearly' THEN 60 ELSE 0 END "
+        "WHERE event_type = 'RENEWAL' AND EXISTS ("
+        "SELECT 1 FROM users WHERE users.id::text = lower(webhook_events.app_user_id) "
+        "AND (users.created_at IS NULL OR webhook_events.created_at IS NULL "
+        "OR users.created_at <= webhook_events.created_at))"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('webhook_events', 'credits_granted')
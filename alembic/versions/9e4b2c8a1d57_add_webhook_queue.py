@@ -0,0 +1,35 @@
+"""add webhook_queue table
+
+Revision ID: 9e4b2c8a1d57
+Revises: 5c1e9a7d3f20
+Create Date: 2026-10-18 10:03:17.204981
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4b2c8a1d57'
+down_revision: Union[str, None] = '5c1e9a7d3f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('webhook_queue',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('received_at', sa.DateTime(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_webhook_queue_received_at'), 'webhook_queue', ['received_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_webhook_queue_received_at'), table_name='webhook_queue')
+    op.drop_table('webhook_queue')
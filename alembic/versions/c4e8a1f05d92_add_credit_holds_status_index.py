@@ -0,0 +1,26 @@
+"""add credit_holds (status, created_at) index
+
+Revision ID: c4e8a1f05d92
+Revises: 7a2d4e6f8b13
+Create Date: 2026-10-18 18:41:09.552103
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e8a1f05d92'
+down_revision: Union[str, None] = '7a2d4e6f8b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_credit_holds_status_created_at', 'credit_holds', ['status', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_credit_holds_status_created_at', table_name='credit_holds')
@@ -0,0 +1,27 @@
+"""allow operations without a user
+
+Revision ID: e2b6d8f4a917
+Revises: c4e8a1f05d92
+Create Date: 2026-10-18 20:12:44.318406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b6d8f4a917'
+down_revision: Union[str, None] = 'c4e8a1f05d92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.alter_column('operations', 'app_user_id', existing_type=sa.UUID(), nullable=True)
+
+
+def downgrade() -> None:
+    op.execute("DELETE FROM operations WHERE app_user_id IS NULL")
+    op.alter_column('operations', 'app_user_id', existing_type=sa.UUID(), nullable=False)
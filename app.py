@@ -1,24 +1,158 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
 import requests
-import json
+import base64
+import binascii
+import hmac
 import os
 import logging
 import uuid
-from models import get_db, User
-from webhook_handler import process_webhook_event
+from concurrent.futures import ThreadPoolExecutor
+from models import db_session, pool_stats, User
+from operation_history import (record_operation, finish_operation, list_operations, operation_summary,
+                               InvalidCursor, MAX_PAGE_SIZE)
+from webhook_handler import process_webhook_event, recent_events
+from webhook_queue import WebhookQueueWorker, enqueue_webhook
+from webhook_replay import WebhookReplay, replay_jobs, parse_time
+from balance_cache import balance_cache
+from bulk_credits import apply_bulk_credits, read_rows, InvalidBulkBody
+from credits import (debit_credits, credit_credits, place_hold, attach_hold, release_hold,
+                     settle_operation_holds, UserNotFound, InsufficientCredits)
+from upstream import VertexClient
+from circuit_breaker import CircuitOpen, upstream_breakers
+from admission import AdmissionScheduler, AdmissionRejected, ADMISSION_SCHEDULER, client_key
+from blob_store import BlobStore, InlineBlobBody, UploadTooLarge, BLOB_PLACEHOLDER
+from image_prep import ImagePreprocessor, InvalidImage, IMAGE_PREP
+from generation_dedupe import GenerationDeduper, generation_key
+from video_results import (extract_videos, DIGEST_PATTERN, VIDEO_STORE_DIR, VIDEO_MAX_BYTES,
+                           VIDEO_STORE_MAX_BYTES, VIDEO_STORE_MAX_AGE)
+from media_pipeline import MediaPipeline, MEDIA_PIPELINE, media_type
+from token_cache import TokenCache
+from operation_cache import OperationStatusCache, is_terminal
+from operation_watcher import OperationWatcher
+from hold_sweeper import HoldSweeper, HOLD_SWEEP, OPERATION_GONE_STATUSES
+import metrics
+from request_log import log_event
+import request_log
 
 app = Flask(__name__)
 CORS(app)
+metrics.instrument_flask(app)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 PROJECT_ID = os.getenv('PROJECT_ID', 'daring-runway-465515-i2')
 LOCATION = os.getenv('LOCATION', 'us-central1')
+LONG_POLL_MAX_WAIT = float(os.getenv('LONG_POLL_MAX_WAIT', 50))
+GENERATION_COST = int(os.getenv('GENERATION_COST', 1))
+COMPLETION_WORKERS = int(os.getenv('COMPLETION_WORKERS', 2))
+WEBHOOK_ASYNC = os.getenv('WEBHOOK_ASYNC', '0') == '1'
+# Required as X-Admin-Key on admin endpoints; without it they answer 503
+ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', '')
+# Local development only: serve admin endpoints without a key when ADMIN_API_KEY is unset
+ADMIN_API_INSECURE = os.getenv('ADMIN_API_INSECURE', '0') == '1'
+
+vertex = VertexClient(PROJECT_ID, LOCATION)
+blob_store = BlobStore()
+image_prep = ImagePreprocessor(blob_store)
+generation_deduper = GenerationDeduper()
+admission = AdmissionScheduler()
+if ADMISSION_SCHEDULER and admission.bucket is None:
+    logger.warning("ADMISSION_RATE_PER_MINUTE is 0: submissions are not paced to the Veo quota")
+# Media pipeline outputs live in media/<digest>/ and are evicted with their video
+video_store = BlobStore(VIDEO_STORE_DIR, gcs_prefix='', max_bytes=VIDEO_MAX_BYTES,
+                        max_total_bytes=VIDEO_STORE_MAX_BYTES, max_age=VIDEO_STORE_MAX_AGE, sidecar_dirs=('media',))
+media_pipeline = MediaPipeline(video_store)
+token_cache = TokenCache()
+operation_cache = OperationStatusCache()
 
 def get_access_token():
-    return "Hello, world"
+    return token_cache.get()
+
+def fetch_operation_status(model_id, operation_name):
+    def fetch():
+        response = vertex.post_hedged(model_id, 'fetchPredictOperation', get_access_token(),
+                               {'operationName': operation_name})
+        if response.status_code == 200:
+            return response.status_code, response.json()
+        return response.status_code, response.text
+
+    return operation_cache.get(operation_name, fetch)
+
+def model_for_operation(operation_name):
+    if 'veo-2.0-generate-001' in operation_name:
+        return 'veo-2.0-generate-001'
+    elif 'veo-3.0-generate-preview' in operation_name:
+        return 'veo-3.0-generate-preview'
+    return 'veo-3.0-fast-generate-001'
+
+
+# Work triggered by an operation finishing runs here, never on the polling request
+completion_executor = ThreadPoolExecutor(max_workers=COMPLETION_WORKERS, thread_name_prefix='completion')
+
+def operation_succeeded(payload):
+    return (payload.get('done') is True and not payload.get('error')
+            and bool((payload.get('response') or {}).get('videos')))
+
+def settle_credit_holds(operation_name, succeeded):
+    with db_session() as db:
+        try:
+            closed = settle_operation_holds(db, operation_name, succeeded)
+            if closed:
+                action = 'Settled' if succeeded else 'Released'
+                logger.info(f"{action} {closed} credit hold(s) for operation {operation_name}")
+        except Exception as e:
+            logger.error(f"Error settling credit holds for {operation_name}: {str(e)}")
+
+def record_operation_result(operation_name, payload, succeeded):
+    with db_session() as db:
+        try:
+            finish_operation(db, operation_name, payload, succeeded)
+        except Exception as e:
+            logger.error(f"Error recording the result of operation {operation_name}: {str(e)}")
+
+def release_credit_hold(hold_id):
+    with db_session() as db:
+        try:
+            if release_hold(db, hold_id):
+                logger.info(f"Released credit hold {hold_id}")
+        except Exception as e:
+            logger.error(f"Error releasing credit hold {hold_id}: {str(e)}")
+
+def on_operation_terminal(operation_name, payload):
+    succeeded = operation_succeeded(payload)
+    if not succeeded:
+        # Let an identical request start a fresh operation instead of reusing a failed one
+        generation_deduper.forget_operation(operation_name)
+    completion_executor.submit(settle_credit_holds, operation_name, succeeded)
+    completion_executor.submit(record_operation_result, operation_name, payload, succeeded)
+    if succeeded and MEDIA_PIPELINE and media_pipeline.available:
+        completion_executor.submit(media_pipeline.submit, operation_name, payload)
+
+def on_operation_lost(operation_name, status_code, payload):
+    # Vertex no longer knows the operation: refund it rather than hold the credits forever
+    if status_code not in OPERATION_GONE_STATUSES:
+        return
+    logger.warning(f"Operation {operation_name} ended with status {status_code}; releasing its credit holds")
+    generation_deduper.forget_operation(operation_name)
+    completion_executor.submit(settle_credit_holds, operation_name, False)
+    completion_executor.submit(record_operation_result, operation_name,
+                               {'error': {'message': f'Upstream returned {status_code}'}}, False)
+
+operation_watcher = OperationWatcher(lambda name: fetch_operation_status(model_for_operation(name), name),
+                                     on_error=on_operation_lost)
+# Holds a restart (or a crash mid-submit) left open are settled from the database
+hold_sweeper = HoldSweeper(lambda name: fetch_operation_status(model_for_operation(name), name),
+                           operation_succeeded, watch=lambda name: operation_watcher.watch_until_done(name))
+
+operation_cache.add_listener(on_operation_terminal)
+# Finished videos are stored once and served from /videos instead of riding along on every poll
+operation_cache.add_transform(lambda operation_name, payload: extract_videos(video_store, payload))
+
+webhook_worker = WebhookQueueWorker()
+if WEBHOOK_ASYNC:
+    webhook_worker.start()
 
 @app.route('/')
 def hello_world():
@@ -37,6 +171,72 @@ def hello_world():
 def health_check():
     return jsonify({'status': 'healthy api'}), 200
 
+stats_providers = {
+    'upstream': lambda: vertex.stats(),
+    'token': lambda: token_cache.stats(),
+    'operations': lambda: operation_cache.stats(),
+    'watcher': lambda: operation_watcher.stats(),
+    'webhook_queue': lambda: webhook_worker.stats() if WEBHOOK_ASYNC else {'enabled': False},
+    'webhook_recent_events': lambda: recent_events.stats(),
+    'balances': lambda: balance_cache.stats(),
+    'db_pool': pool_stats,
+    'request_log': request_log.stats,
+    'image_prep': lambda: image_prep.stats(),
+    'generation_dedupe': lambda: generation_deduper.stats(),
+    'media': lambda: media_pipeline.stats(),
+    'video_store': lambda: video_store.stats(),
+    'admission': lambda: admission.stats(),
+    'circuit_breakers': upstream_breakers.stats,
+    'webhook_replays': lambda: replay_jobs.stats(),
+    'credit_holds': lambda: hold_sweeper.stats(),
+    'blob_store': lambda: blob_store.stats(),
+}
+
+metrics.register_stats('db_pool', pool_stats, counters=('checkouts', 'timeouts', 'wait_seconds_total'))
+metrics.register_stats('admission', lambda: admission.stats(),
+                       counters=('admitted', 'rejected_full', 'rejected_timeout', 'retries', 'upstream_throttled'))
+
+@app.route('/stats')
+def stats():
+    return jsonify({name: provider() for name, provider in stats_providers.items()}), 200
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def circuit_open(e):
+    response = jsonify({'error': str(e), 'model': e.model_id, 'verb': e.verb})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+def admin_denied():
+    if not ADMIN_API_KEY:
+        if ADMIN_API_INSECURE:
+            return None
+        return jsonify({'error': 'Admin API is not configured'}), 503
+    if not hmac.compare_digest(request.headers.get('X-Admin-Key', ''), ADMIN_API_KEY):
+        return jsonify({'error': 'Invalid or missing admin key'}), 401
+    return None
+
+def admission_user(app_user_id=None):
+    return client_key(app_user_id, request.headers.get('X-Forwarded-For', ''), request.remote_addr)
+
+def admitted(user, send):
+    """Run a predictLongRunning call through the admission scheduler. Returns (response, queue_info)."""
+    if not ADMISSION_SCHEDULER:
+        return send(), None
+    return admission.run(user, send)
+
+def admission_rejected(e):
+    log_event('admission_rejected', reason=str(e), position=e.position, eta_seconds=round(e.eta_seconds, 1))
+    response = jsonify({
+        'error': str(e),
+        'queue_position': e.position,
+        'eta_seconds': round(e.eta_seconds, 1)
+    })
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
 @app.route('/projects/<project_id>/locations/<location>/publishers/google/models/<model_id>:predictLongRunning', methods=['POST'])
 def predict_long_running(project_id, location, model_id):
     try:
@@ -51,216 +251,383 @@ def predict_long_running(project_id, location, model_id):
         if model_id not in valid_models:
             return jsonify({'error': f'Invalid model ID. Must be one of: {valid_models}'}), 400
         
-        url = f"https://{LOCATION}-aiplatform.googleapis.com/v1/projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/{model_id}:predictLongRunning"
-        
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json',
-        }
+        url = vertex.model_url(model_id, 'predictLongRunning')
         
-        # Log the request details
-        print(f"\n=== VERTEX AI REQUEST ===")
-        print(f"URL: {url}")
-        print(f"Model: {model_id}")
-        print(f"Request Body:")
-        print(json.dumps(data, indent=2))
-        print(f"========================\n")
+        log_event('vertex_request', route='predictLongRunning', url=url, model=model_id, body=data)
         
-        response = requests.post(url, headers=headers, json=data)
+        response, _ = admitted(admission_user(),
+                               lambda: vertex.post(model_id, 'predictLongRunning', access_token, data))
+        elapsed_ms = round(response.elapsed.total_seconds() * 1000, 1)
         
         if response.status_code == 200:
             result = response.json()
-            print(f"\n=== VERTEX AI RESPONSE SUCCESS ===")
-            print(json.dumps(result, indent=2))
-            print(f"==================================\n")
+            log_event('vertex_response', route='predictLongRunning', model=model_id,
+                      status_code=200, elapsed_ms=elapsed_ms, body=result)
             return jsonify(result)
         else:
-            print(f"\n=== VERTEX AI RESPONSE ERROR ===")
-            print(f"Status Code: {response.status_code}")
-            print(f"Response: {response.text}")
-            print(f"=================================\n")
+            log_event('vertex_response', route='predictLongRunning', model=model_id,
+                      status_code=response.status_code, elapsed_ms=elapsed_ms, body=response.text)
             return jsonify({
                 'error': 'Failed to generate video',
                 'status_code': response.status_code,
                 'message': response.text
             }), response.status_code
             
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+    except CircuitOpen as e:
+        return circuit_open(e)
+    except requests.exceptions.Timeout:
+        return jsonify({'error': 'Upstream request timed out'}), 504
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/projects/<project_id>/locations/<location>/publishers/google/models/<model_id>:fetchPredictOperation', methods=['POST'])
 def fetch_predict_operation(project_id, location, model_id):
     try:
-        access_token = get_access_token()
-
         model_id = "veo-3.0-fast-generate-001"
         
         data = request.get_json()
         if not data or 'operationName' not in data:
             return jsonify({'error': 'operationName is required'}), 400
         
-        url = f"https://{LOCATION}-aiplatform.googleapis.com/v1/projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/{model_id}:fetchPredictOperation"
+        status_code, result = fetch_operation_status(model_id, data['operationName'])
         
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json',
-        }
-        
-        response = requests.post(url, headers=headers, json=data)
-        
-        if response.status_code == 200:
-            return jsonify(response.json())
+        if status_code == 200:
+            return jsonify(result)
         else:
             return jsonify({
                 'error': 'Failed to fetch operation status',
-                'status_code': response.status_code,
-                'message': response.text
-            }), response.status_code
+                'status_code': status_code,
+                'message': result
+            }), status_code
             
+    except CircuitOpen as e:
+        return circuit_open(e)
+    except requests.exceptions.Timeout:
+        return jsonify({'error': 'Upstream request timed out'}), 504
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def build_veo_request(data):
+    # Build instances array
+    instance = {}
+
+    # Handle prompt
+    if 'prompt' in data:
+        instance['prompt'] = data['prompt']
+
+    if 'image' in data:
+        image_data = data['image']
+        if isinstance(image_data, dict):
+            instance['image'] = image_data
+        elif isinstance(image_data, str):
+            # Assume it's base64 encoded
+            instance['image'] = {
+                'bytesBase64Encoded': image_data,
+                'mimeType': data.get('imageMimeType', 'image/jpeg')
+            }
+
+    parameters = {
+        'aspectRatio': data.get('aspectRatio', '16:9'),
+        'durationSeconds': data.get('durationSeconds', 8),
+        'enhancePrompt': data.get('enhancePrompt', True),
+        'personGeneration': data.get('personGeneration', 'allow_adult'),
+        'sampleCount': data.get('sampleCount', 1)
+    }
+
+    if 'generateAudio' in data:
+        parameters['generateAudio'] = data['generateAudio']
+    if 'negativePrompt' in data:
+        parameters['negativePrompt'] = data['negativePrompt']
+    if 'seed' in data:
+        parameters['seed'] = data['seed']
+    if 'storageUri' in data:
+        parameters['storageUri'] = data['storageUri']
+
+    return {
+        'instances': [instance],
+        'parameters': parameters
+    }
+
+UPLOAD_INT_FIELDS = ('durationSeconds', 'sampleCount', 'seed', 'cost')
+UPLOAD_BOOL_FIELDS = ('enhancePrompt', 'generateAudio', 'dedupe')
+
+def upload_params(values):
+    """Form or query-string fields of an upload request, typed like the JSON body."""
+    data = {}
+    for key, value in values.items():
+        if key in UPLOAD_INT_FIELDS:
+            data[key] = int(value)
+        elif key in UPLOAD_BOOL_FIELDS:
+            data[key] = value.lower() in ('1', 'true', 'yes')
+        else:
+            data[key] = value
+    return data
+
+def read_generation_request():
+    """Return (data, blob) for a JSON, multipart/form-data or raw image request.
+
+    Uploaded images are streamed into the blob store and never held in
+    memory; the other fields come from the form or the query string.
+    """
+    if request.mimetype == 'multipart/form-data':
+        data = upload_params(request.form)
+        image = request.files.get('image')
+        if image is None:
+            return data, None
+        mime_type = image.mimetype or data.get('imageMimeType', 'image/jpeg')
+        return data, blob_store.put_stream(image.stream, mime_type)
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        data = upload_params(request.args)
+        mime_type = request.mimetype if request.mimetype.startswith('image/') else data.get('imageMimeType', 'image/jpeg')
+        return data, blob_store.put_stream(request.stream, mime_type)
+    return request.get_json(), None
+
+def inline_image_blob(data):
+    """Move a base64 image from a JSON body into the blob store so it can be preprocessed."""
+    image = data.get('image')
+    if isinstance(image, str):
+        encoded, mime_type = image, data.get('imageMimeType', 'image/jpeg')
+    elif isinstance(image, dict) and isinstance(image.get('bytesBase64Encoded'), str):
+        encoded, mime_type = image['bytesBase64Encoded'], image.get('mimeType', 'image/jpeg')
+    else:
+        return None
+    return blob_store.put_bytes(base64.b64decode(encoded, validate=True), mime_type)
+
+def blob_image(blob):
+    gcs_uri = blob_store.gcs_uri(blob.digest)
+    if gcs_uri:
+        return {'gcsUri': gcs_uri, 'mimeType': blob.mime_type}
+    # Filled in by InlineBlobBody while the request is sent
+    return {'bytesBase64Encoded': BLOB_PLACEHOLDER, 'mimeType': blob.mime_type}
+
+def post_generation(model_id, access_token, veo_request, blob=None):
+    if blob is None or blob_store.gcs_uri(blob.digest):
+        return vertex.post(model_id, 'predictLongRunning', access_token, veo_request)
+    body = InlineBlobBody(veo_request, blob)
+    try:
+        return vertex.post_body(model_id, 'predictLongRunning', access_token, body)
+    finally:
+        body.close()
+
+def submit_generation(access_token, model_id, veo_request, blob, user_uuid, cost, client):
+    """Reserve credits, start the Veo operation and attach the hold. Returns (payload, status_code).
+
+    The upstream call waits its turn in the admission queue under `client`;
+    AdmissionRejected propagates after the hold is released.
+    """
+    hold_id = None
+    if user_uuid is not None:
+        with db_session() as db:
+            try:
+                hold_id, remaining_credits = place_hold(db, user_uuid, cost)
+            except UserNotFound:
+                return {'error': 'User not found'}, 404
+            except InsufficientCredits as e:
+                return {
+                    'error': 'Insufficient credits',
+                    'available_credits': e.available,
+                    'requested_credits': cost
+                }, 400
+
+    url = vertex.model_url(model_id, 'predictLongRunning')
+    
+    log_event('vertex_request', route='generate-video', url=url, model=model_id, body=veo_request,
+              upload={'sha256': blob.digest, 'size': blob.size} if blob is not None else None)
+    
+    try:
+        response, queue = admitted(client, lambda: post_generation(model_id, access_token, veo_request, blob))
+    except Exception:
+        if hold_id is not None:
+            release_credit_hold(hold_id)
+        raise
+    
+    if response.status_code == 200:
+        result = response.json()
+        with db_session() as db:
+            try:
+                record_operation(db, result['name'], user_uuid, model_id, generation_key(
+                    model_id, veo_request, image_digest=blob.digest if blob is not None else None))
+                if hold_id is not None:
+                    # Committed together with the hold, so the history never misses a paid-for operation
+                    attach_hold(db, hold_id, result['name'])
+                else:
+                    db.commit()
+            except Exception as e:
+                if hold_id is not None:
+                    raise
+                # Nothing to settle: the operation is still returned, just missing from the history
+                db.rollback()
+                logger.error(f"Error recording operation {result['name']}: {str(e)}")
+        if hold_id is not None:
+            # Make sure the hold is settled even if the client never polls again; other
+            # operations finish in the history when a poll sees them terminal
+            cached = operation_cache.peek(result['name'])
+            if cached is not None and is_terminal(cached[1]):
+                on_operation_terminal(result['name'], cached[1])
+            else:
+                operation_watcher.watch_until_done(result['name'])
+            result['credits'] = {
+                'hold_id': hold_id,
+                'reserved': cost,
+                'remaining_credits': remaining_credits
+            }
+        if queue is not None:
+            result['queue'] = queue
+        log_event('vertex_response', route='generate-video', model=model_id, status_code=200,
+                  elapsed_ms=round(response.elapsed.total_seconds() * 1000, 1), body=result)
+        return result, 200
+    else:
+        if hold_id is not None:
+            release_credit_hold(hold_id)
+        log_event('vertex_response', route='generate-video', model=model_id,
+                  status_code=response.status_code,
+                  elapsed_ms=round(response.elapsed.total_seconds() * 1000, 1), body=response.text)
+        failure = {
+            'error': 'Failed to generate video',
+            'status_code': response.status_code,
+            'message': response.text
+        }
+        if queue is not None:
+            failure['queue'] = queue
+        return failure, response.status_code
+
+def dedupe_result(submitted):
+    payload, status_code = submitted
+    return (payload['name'] if status_code == 200 else None), submitted
+
 @app.route('/generate-video', methods=['POST'])
 def generate_video():
     try:
         access_token = get_access_token()
         
-        data = request.get_json()
-        if not data:
+        try:
+            data, blob = read_generation_request()
+        except UploadTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+        except ValueError as e:
+            return jsonify({'error': f'Invalid upload field: {str(e)}'}), 400
+        if not data and blob is None:
             return jsonify({'error': 'No data provided'}), 400
+        if IMAGE_PREP:
+            try:
+                if blob is None:
+                    blob = inline_image_blob(data)
+                if blob is not None:
+                    blob = image_prep.prepare(blob, data.get('aspectRatio', '16:9'))
+            except (InvalidImage, binascii.Error) as e:
+                return jsonify({'error': f'Invalid image: {str(e)}'}), 400
+        if blob is not None:
+            data['image'] = blob_image(blob)
 
         model_id = 'veo-3.0-fast-generate-001'
-        
-        # Build instances array
-        instance = {}
-        
-        # Handle prompt
-        if 'prompt' in data:
-            instance['prompt'] = data['prompt']
-
-        if 'image' in data:
-            image_data = data['image']
-            if isinstance(image_data, dict):
-                instance['image'] = image_data
-            elif isinstance(image_data, str):
-                # Assume it's base64 encoded
-                instance['image'] = {
-                    'bytesBase64Encoded': image_data,
-                    'mimeType': data.get('imageMimeType', 'image/jpeg')
-                }
-
-        parameters = {
-            'aspectRatio': data.get('aspectRatio', '16:9'),
-            'durationSeconds': data.get('durationSeconds', 8),
-            'enhancePrompt': data.get('enhancePrompt', True),
-            'personGeneration': data.get('personGeneration', 'allow_adult'),
-            'sampleCount': data.get('sampleCount', 1)
-        }
+        veo_request = build_veo_request(data)
 
-        if 'generateAudio' in data:
-            parameters['generateAudio'] = data['generateAudio']
-        if 'negativePrompt' in data:
-            parameters['negativePrompt'] = data['negativePrompt']
-        if 'seed' in data:
-            parameters['seed'] = data['seed']
-        if 'storageUri' in data:
-            parameters['storageUri'] = data['storageUri']
-        
-        # Construct the request
-        veo_request = {
-            'instances': [instance],
-            'parameters': parameters
-        }
+        # Optional credit reservation: hold the cost now, settle or refund when the operation ends
+        app_user_id = data.get('app_user_id')
+        user_uuid = None
+        cost = None
+        if app_user_id:
+            cost = data.get('cost', GENERATION_COST)
+            if not isinstance(cost, int) or cost <= 0:
+                return jsonify({'error': 'cost must be a positive integer'}), 400
+            try:
+                user_uuid = uuid.UUID(app_user_id)
+            except ValueError:
+                return jsonify({'error': 'Invalid UUID format for app_user_id'}), 400
 
-        url = f"https://{LOCATION}-aiplatform.googleapis.com/v1/projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/{model_id}:predictLongRunning"
-        
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json',
-        }
-        
-        # Log the request details
-        print(f"\n=== GENERATE VIDEO REQUEST ===")
-        print(f"URL: {url}")
-        print(f"Model: {model_id}")
-        print(f"Request Body:")
-        print(json.dumps(veo_request, indent=2))
-        print(f"=============================\n")
-        
-        response = requests.post(url, headers=headers, json=veo_request)
-        
-        if response.status_code == 200:
-            result = response.json()
-            print(f"\n=== GENERATE VIDEO RESPONSE SUCCESS ===")
-            print(json.dumps(result, indent=2))
-            print(f"=======================================\n")
-            return jsonify(result)
+        client = admission_user(app_user_id)
+
+        def submit():
+            return submit_generation(access_token, model_id, veo_request, blob, user_uuid, cost, client)
+
+        # Resubmissions of the same seeded (or opted-in) request reuse the operation
+        if data.get('dedupe', 'seed' in data):
+            key = generation_key(model_id, veo_request, app_user_id, blob.digest if blob is not None else None)
+            operation_name, deduplicated, submitted = generation_deduper.submit(
+                key, lambda: dedupe_result(submit()))
+            if deduplicated:
+                log_event('generation_deduplicated', model=model_id, operation=operation_name)
+                return jsonify({'name': operation_name, 'deduplicated': True}), 200
+            payload, status_code = submitted
         else:
-            print(f"\n=== GENERATE VIDEO RESPONSE ERROR ===")
-            print(f"Status Code: {response.status_code}")
-            print(f"Response: {response.text}")
-            print(f"======================================\n")
-            return jsonify({
-                'error': 'Failed to generate video',
-                'status_code': response.status_code,
-                'message': response.text
-            }), response.status_code
+            payload, status_code = submit()
+        return jsonify(payload), status_code
             
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+    except CircuitOpen as e:
+        return circuit_open(e)
+    except requests.exceptions.Timeout:
+        return jsonify({'error': 'Upstream request timed out'}), 504
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/check-operation', methods=['POST'])
 def check_operation_simple():
     try:
-        access_token = get_access_token()
-        
         data = request.get_json()
         if not data or 'operationName' not in data:
             return jsonify({'error': 'operationName is required'}), 400
         
         operation_name = data['operationName']
+        model_id = model_for_operation(operation_name)
 
-        model_id = 'veo-3.0-fast-generate-001'
-        if 'veo-2.0-generate-001' in operation_name:
-            model_id = 'veo-2.0-generate-001'
-        elif 'veo-3.0-generate-preview' in operation_name:
-            model_id = 'veo-3.0-generate-preview'
-        
-        url = f"https://{LOCATION}-aiplatform.googleapis.com/v1/projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/{model_id}:fetchPredictOperation"
+        try:
+            wait = min(max(float(data.get('wait') or 0), 0), LONG_POLL_MAX_WAIT)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'wait must be a number of seconds'}), 400
         
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json',
-        }
+        url = vertex.model_url(model_id, 'fetchPredictOperation')
         
-        print(f"\n=== CHECK OPERATION REQUEST ===")
-        print(f"URL: {url}")
-        print(f"Model: {model_id}")
-        print(f"Operation Name: {operation_name}")
-        print(f"===============================\n")
+        log_event('check_operation_request', url=url, model=model_id, operation=operation_name, wait=wait)
         
-        response = requests.post(url, headers=headers, json={'operationName': operation_name})
+        if wait > 0:
+            status_code, result = operation_watcher.wait_for_change(operation_name, wait)
+        else:
+            status_code, result = fetch_operation_status(model_id, operation_name)
         
-        if response.status_code == 200:
-            result = response.json()
-            print(f"\n=== CHECK OPERATION RESPONSE SUCCESS ===")
-            print(json.dumps(result, indent=2))
-            print(f"========================================\n")
-            return jsonify(result)
+        if status_code == 200:
+            log_event('check_operation_response', operation=operation_name, status_code=200, body=result)
+            return jsonify(media_pipeline.annotate(result))
         else:
-            print(f"\n=== CHECK OPERATION RESPONSE ERROR ===")
-            print(f"Status Code: {response.status_code}")
-            print(f"Response: {response.text}")
-            print(f"======================================\n")
+            log_event('check_operation_response', operation=operation_name, status_code=status_code, body=result)
             return jsonify({
                 'error': 'Failed to check operation status',
-                'status_code': response.status_code,
-                'message': response.text
-            }), response.status_code
+                'status_code': status_code,
+                'message': result
+            }), status_code
             
+    except CircuitOpen as e:
+        return circuit_open(e)
+    except requests.exceptions.Timeout:
+        return jsonify({'error': 'Upstream request timed out'}), 504
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/videos/<digest>', methods=['GET'])
+def get_video(digest):
+    if not DIGEST_PATTERN.match(digest) or not os.path.exists(video_store.path(digest)):
+        return jsonify({'error': 'Video not found'}), 404
+    video_store.touch(digest)
+    # send_file answers Range, If-Range and If-None-Match; the content never changes
+    response = send_file(video_store.path(digest), mimetype='video/mp4', conditional=True, etag=digest,
+                         max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/videos/<digest>/<path:name>', methods=['GET'])
+def get_video_media(digest, name):
+    path = media_pipeline.file_path(digest, name)
+    if path is None:
+        return jsonify({'error': 'Not found', 'status': media_pipeline.status(digest)}), 404
+    video_store.touch(digest)
+    # Derived from an immutable video, so these never change either
+    response = send_file(path, mimetype=media_type(name), conditional=True, max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @app.route('/register-user', methods=['POST'])
 def register_user():
     try:
@@ -279,8 +646,7 @@ def register_user():
         except ValueError:
             return jsonify({'error': 'Invalid UUID format for app_user_id'}), 400
         
-        db = next(get_db())
-        try:
+        with db_session() as db:
             existing_user = db.query(User).filter(User.id == user_uuid).first()
             if existing_user:
                 return jsonify({'error': 'User already exists', 'user_id': str(existing_user.id)}), 409
@@ -291,6 +657,7 @@ def register_user():
             )
             db.add(new_user)
             db.commit()
+            balance_cache.invalidate(user_uuid)
             
             logger.info(f"Registered new user: {app_user_id} with {credits} credits")
             
@@ -300,9 +667,6 @@ def register_user():
                 'credits': new_user.credits
             }), 201
             
-        finally:
-            db.close()
-            
     except Exception as e:
         logger.error(f"Error registering user: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -315,26 +679,60 @@ def get_credits(app_user_id):
         except ValueError:
             return jsonify({'error': 'Invalid UUID format for app_user_id'}), 400
         
-        db = next(get_db())
-        try:
-            user = db.query(User).filter(User.id == user_uuid).first()
+        balance, version = balance_cache.get(user_uuid)
+        if balance is None:
+            with db_session() as db:
+                balance = db.query(User.credits, User.created_at).filter(User.id == user_uuid).first()
             
-            if not user:
+            if not balance:
                 return jsonify({'error': 'User not found'}), 404
             
-            logger.info(f"Retrieved credits for user: {app_user_id} - Credits: {user.credits}")
+            balance = (balance.credits, balance.created_at.isoformat())
+            balance_cache.fill(user_uuid, balance, version)
+        
+        credits, created_at = balance
+        logger.debug(f"Retrieved credits for user: {app_user_id} - Credits: {credits}")
+        
+        # ETag over the body: clients polling an unchanged balance get an empty 304
+        response = jsonify({
+            'user_id': str(user_uuid),
+            'credits': credits,
+            'created_at': created_at
+        })
+        response.add_etag()
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
             
-            return jsonify({
-                'user_id': str(user.id),
-                'credits': user.credits,
-                'created_at': user.created_at.isoformat()
-            }), 200
+    except Exception as e:
+        logger.error(f"Error getting credits: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/users/<app_user_id>/operations', methods=['GET'])
+def get_user_operations(app_user_id):
+    try:
+        try:
+            user_uuid = uuid.UUID(app_user_id)
+        except ValueError:
+            return jsonify({'error': 'Invalid UUID format for app_user_id'}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', 20)), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        
+        # Served entirely from the operations table; Vertex is never asked
+        with db_session() as db:
+            try:
+                operations, next_cursor = list_operations(db, user_uuid, limit, request.args.get('cursor'))
+            except InvalidCursor:
+                return jsonify({'error': 'Invalid cursor'}), 400
             
-        finally:
-            db.close()
+            return jsonify({
+                'operations': [operation_summary(operation) for operation in operations],
+                'next_cursor': next_cursor
+            })
             
     except Exception as e:
-        logger.error(f"Error getting credits: {str(e)}")
+        logger.error(f"Error listing operations: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/add-credits', methods=['POST'])
@@ -358,28 +756,21 @@ def add_credits():
         except ValueError:
             return jsonify({'error': 'Invalid UUID format for app_user_id'}), 400
         
-        db = next(get_db())
-        try:
-            user = db.query(User).filter(User.id == user_uuid).first()
-            
-            if not user:
+        with db_session() as db:
+            try:
+                total_credits = credit_credits(db, user_uuid, credits_to_add)
+            except UserNotFound:
                 return jsonify({'error': 'User not found'}), 404
             
-            user.credits += credits_to_add
-            db.commit()
-            
-            logger.info(f"Added {credits_to_add} credits for user: {app_user_id} - Total: {user.credits}")
+            logger.info(f"Added {credits_to_add} credits for user: {app_user_id} - Total: {total_credits}")
             
             return jsonify({
                 'message': 'Credits added successfully',
-                'user_id': str(user.id),
+                'user_id': str(user_uuid),
                 'credits_added': credits_to_add,
-                'total_credits': user.credits
+                'total_credits': total_credits
             }), 200
             
-        finally:
-            db.close()
-            
     except Exception as e:
         logger.error(f"Error adding credits: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -406,42 +797,59 @@ def use_credits():
         except ValueError:
             return jsonify({'error': 'Invalid UUID format for app_user_id'}), 400
         
-        db = next(get_db())
-        try:
-            # Find user
-            user = db.query(User).filter(User.id == user_uuid).first()
-            
-            if not user:
+        with db_session() as db:
+            # Conditional debit: only succeeds if the balance covers it
+            try:
+                remaining_credits = debit_credits(db, user_uuid, credits_to_use)
+            except UserNotFound:
                 return jsonify({'error': 'User not found'}), 404
-            
-            # Check if user has enough credits
-            if user.credits < credits_to_use:
+            except InsufficientCredits as e:
                 return jsonify({
                     'error': 'Insufficient credits',
-                    'available_credits': user.credits,
+                    'available_credits': e.available,
                     'requested_credits': credits_to_use
                 }), 400
             
-            # Subtract credits
-            user.credits -= credits_to_use
-            db.commit()
-            
-            logger.info(f"Used {credits_to_use} credits for user: {app_user_id} - Remaining: {user.credits}")
+            logger.info(f"Used {credits_to_use} credits for user: {app_user_id} - Remaining: {remaining_credits}")
             
             return jsonify({
                 'message': 'Credits used successfully',
-                'user_id': str(user.id),
+                'user_id': str(user_uuid),
                 'credits_used': credits_to_use,
-                'remaining_credits': user.credits
+                'remaining_credits': remaining_credits
             }), 200
             
-        finally:
-            db.close()
-            
     except Exception as e:
         logger.error(f"Error using credits: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/bulk-credits', methods=['POST'])
+def bulk_credits():
+    # Body: {"grants": [{"app_user_id": ..., "delta": ...}]}, NDJSON with the same
+    # objects one per line, or CSV with app_user_id,delta columns
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        try:
+            summary, results = apply_bulk_credits(read_rows(request.stream, request.mimetype))
+        except InvalidBulkBody as e:
+            return jsonify({'error': str(e)}), 400
+        if not summary['rows']:
+            return jsonify({'error': 'No rows provided'}), 400
+        
+        reason = request.args.get('reason')
+        logger.info(f"Bulk credits ({reason or 'no reason given'}): {summary}")
+        log_event('bulk_credits', reason=reason, **summary)
+        
+        if request.args.get('results') == 'failed':
+            results = [result for result in results if result['status'] != 'applied']
+        return jsonify({'summary': summary, 'results': results}), 200
+        
+    except Exception as e:
+        logger.error(f"Error applying bulk credits: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/PostBack', methods=['POST'])
 def revenuecat_webhook():
     try:
@@ -452,19 +860,67 @@ def revenuecat_webhook():
         event_type = event_data.get('event', {}).get('type', 'Unknown')
         logger.info(f"Received RevenueCat webhook: {event_type}")
         
-        logger.debug(f"Full webhook payload: {json.dumps(event_data, indent=2)}")
+        log_event('webhook_received', event_type=event_type, event_id=event_data.get('event', {}).get('id'))
         
-        db = next(get_db())
-        try:
+        with db_session() as db:
+            if WEBHOOK_ASYNC:
+                # Fast ack: persist the raw event and let the queue worker apply it
+                queue_id = enqueue_webhook(db, event_data)
+                webhook_worker.start()
+                webhook_worker.notify()
+                metrics.observe_webhook('queued')
+                return jsonify({'status': 'queued', 'queue_id': queue_id}), 200
             result = process_webhook_event(event_data, db)
+            metrics.observe_webhook(result['status'])
             return jsonify(result), 200
-        finally:
-            db.close()
             
     except Exception as e:
         logger.error(f"Error processing webhook: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/admin/webhook-replays', methods=['POST'])
+def start_webhook_replay():
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            since = parse_time(data.get('since'))
+            until = parse_time(data.get('until'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'since and until must be ISO 8601 timestamps'}), 400
+        
+        replay = WebhookReplay(since=since, until=until, event_type=data.get('event_type'),
+                               app_user_id=data.get('app_user_id'), dry_run=bool(data.get('dry_run')),
+                               clawback=bool(data.get('clawback')))
+        job_id = replay_jobs.start(replay)
+        if job_id is None:
+            return jsonify({'error': 'A webhook replay is already running'}), 409
+        
+        logger.info(f"Started webhook replay {job_id}: {replay.stats()['filters']} dry_run={replay.dry_run}")
+        log_event('webhook_replay_started', job_id=job_id, dry_run=replay.dry_run, clawback=replay.clawback,
+                  **replay.stats()['filters'])
+        return jsonify({'id': job_id, 'status_url': f'/admin/webhook-replays/{job_id}'}), 202
+        
+    except Exception as e:
+        logger.error(f"Error starting webhook replay: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/admin/webhook-replays/<int:job_id>', methods=['GET', 'DELETE'])
+def webhook_replay_status(job_id):
+    denied = admin_denied()
+    if denied:
+        return denied
+    replay = replay_jobs.get(job_id)
+    if replay is None:
+        return jsonify({'error': 'Replay not found'}), 404
+    if request.method == 'DELETE':
+        replay.cancel()
+    return jsonify({'id': job_id, **replay.stats()}), 200
+
 if __name__ == '__main__':
+    if HOLD_SWEEP:
+        hold_sweeper.start()
     port = int(os.getenv('PORT', 5000))
     app.run(debug=True, host='0.0.0.0', port=port)
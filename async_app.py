@@ -0,0 +1,487 @@
+"""aiohttp front for the Flask app.
+
+Long-lived connections (Server-Sent Events) and, unless ASYNC_PROXY=0, the
+Vertex proxy routes are served natively on the event loop, so idle
+subscribers and in-flight upstream calls cost a coroutine instead of a
+request thread. Every other route is handed to the Flask app on a
+fixed-size thread pool.
+
+    gunicorn --worker-class aiohttp.GunicornWebWorker async_app:app
+"""
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from multidict import CIMultiDict
+
+import app as proxy
+import metrics
+from operation_cache import is_terminal
+from request_log import log_event
+from video_results import DIGEST_PATTERN
+from media_pipeline import media_type, stored_videos
+from operation_watcher import is_transient
+from upstream import AsyncVertexClient
+from admission import AdmissionRejected, client_key
+from circuit_breaker import CircuitOpen
+from hold_sweeper import HOLD_SWEEP
+
+logger = logging.getLogger(__name__)
+
+WSGI_THREADS = int(os.getenv('WSGI_THREADS', 8))
+MAX_REQUEST_BYTES = int(os.getenv('MAX_REQUEST_BYTES', 50 * 1024 * 1024))
+SSE_KEEPALIVE_SECONDS = float(os.getenv('SSE_KEEPALIVE_SECONDS', 15))
+ASYNC_PROXY = os.getenv('ASYNC_PROXY', '1') == '1'
+ASYNC_PROXY_KEY = web.AppKey('async_proxy', bool)
+
+# Set when a request was handed to Flask, which records its own request metrics
+bridged = contextvars.ContextVar('bridged', default=False)
+
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+vertex = AsyncVertexClient(proxy.PROJECT_ID, proxy.LOCATION)
+proxy.stats_providers['upstream_async'] = lambda: vertex.stats()
+
+
+UPLOAD_TYPES = ('multipart/form-data', 'application/octet-stream')
+
+
+def is_upload(request):
+    return request.content_type in UPLOAD_TYPES or request.content_type.startswith('image/')
+
+
+class StreamedInput:
+    """wsgi.input that pulls the request body off the event loop as Flask reads it.
+
+    Lets uploads reach the blob store in chunks instead of being buffered
+    whole before the WSGI call.
+    """
+
+    def __init__(self, content, loop):
+        self.content = content
+        self.loop = loop
+
+    def read(self, size=-1):
+        coro = self.content.read() if size is None or size < 0 else self.content.read(size)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def readline(self, size=-1):
+        return asyncio.run_coroutine_threadsafe(self.content.readline(), self.loop).result()
+
+
+def run_wsgi(environ):
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = status
+        captured['headers'] = headers
+        return lambda data: captured.setdefault('written', []).append(data)
+
+    result = proxy.app(environ, start_response)
+    try:
+        body = b''.join(captured.get('written', [])) + b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return captured['status'], captured['headers'], body
+
+
+async def handle_wsgi(request):
+    bridged.set(True)
+    loop = asyncio.get_running_loop()
+    if is_upload(request):
+        body = None
+        wsgi_input = StreamedInput(request.content, loop)
+        content_length = request.headers.get('Content-Length', '')
+    else:
+        body = await request.read()
+        wsgi_input = io.BytesIO(body)
+        content_length = str(len(body))
+    host, _, port = (request.host or 'localhost').partition(':')
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': request.path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': request.query_string,
+        'CONTENT_TYPE': request.headers.get('Content-Type', ''),
+        'CONTENT_LENGTH': content_length,
+        'SERVER_NAME': host,
+        'SERVER_PORT': port or ('443' if request.secure else '80'),
+        'SERVER_PROTOCOL': f'HTTP/{request.version.major}.{request.version.minor}',
+        'REMOTE_ADDR': request.remote or '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.scheme,
+        'wsgi.input': wsgi_input,
+        'wsgi.input_terminated': body is None and not content_length,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for key, value in request.headers.items():
+        name = key.upper().replace('-', '_')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            continue
+        name = f'HTTP_{name}'
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+
+    status, headers, payload = await loop.run_in_executor(wsgi_executor, run_wsgi, environ)
+
+    code, _, reason = status.partition(' ')
+    response_headers = CIMultiDict(
+        (key, value) for key, value in headers if key.lower() not in ('content-length', 'transfer-encoding')
+    )
+    return web.Response(status=int(code), reason=reason or None, headers=response_headers, body=payload)
+
+
+@web.middleware
+async def request_metrics(request, handler):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        if not bridged.get():
+            route = request.match_info.route.resource
+            observed = route.canonical if route is not None else 'unmatched'
+            metrics.observe_request(observed, request.method, status, time.perf_counter() - started)
+
+
+def format_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data)}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+def is_final(status_code, payload):
+    return not is_transient(status_code) and (status_code != 200 or is_terminal(payload))
+
+
+def subscribe_queue(operation_name, state):
+    """Subscribe to the shared watcher; changes arrive on the returned asyncio.Queue."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def on_change(changed_status, changed_payload):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (changed_status, changed_payload))
+        except RuntimeError:
+            # Event loop already closed
+            pass
+
+    unsubscribe = proxy.operation_watcher.subscribe(operation_name, state, on_change)
+    return queue, unsubscribe
+
+
+async def operation_events(request):
+    operation_name = request.match_info['name']
+    model_id = proxy.model_for_operation(operation_name)
+
+    try:
+        if request.app[ASYNC_PROXY_KEY]:
+            status_code, payload = await fetch_operation_status(model_id, operation_name)
+        else:
+            status_code, payload = await asyncio.get_running_loop().run_in_executor(
+                wsgi_executor, proxy.fetch_operation_status, model_id, operation_name)
+    except CircuitOpen as e:
+        return circuit_open(e)
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    await response.prepare(request)
+
+    sequence = 0
+    await response.write(format_event('status', {'status_code': status_code, 'operation': payload}, sequence))
+    if is_final(status_code, payload):
+        await response.write(format_event('done', {'status_code': status_code}))
+        return response
+
+    queue, unsubscribe = subscribe_queue(operation_name, (status_code, payload))
+    try:
+        while True:
+            try:
+                status_code, payload = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                await response.write(b': keep-alive\n\n')
+                continue
+
+            sequence += 1
+            await response.write(format_event('status', {'status_code': status_code, 'operation': payload}, sequence))
+            if is_final(status_code, payload):
+                await response.write(format_event('done', {'status_code': status_code}))
+                break
+    except (ConnectionResetError, asyncio.CancelledError):
+        logger.info(f"Event stream for {operation_name} closed by client")
+        raise
+    finally:
+        unsubscribe()
+    return response
+
+
+async def get_access_token():
+    token = proxy.token_cache.peek()
+    if token is None:
+        token = await asyncio.get_running_loop().run_in_executor(wsgi_executor, proxy.get_access_token)
+    return token
+
+
+async def fetch_operation_status(model_id, operation_name):
+    async def fetch():
+        status_code, text = await vertex.post_hedged(model_id, 'fetchPredictOperation', await get_access_token(),
+                                                     {'operationName': operation_name})
+        if status_code == 200:
+            return status_code, json.loads(text)
+        return status_code, text
+
+    return await proxy.operation_cache.aget(operation_name, fetch)
+
+
+async def wait_for_change(operation_name, model_id, timeout):
+    status_code, payload = await fetch_operation_status(model_id, operation_name)
+    if status_code != 200 or is_terminal(payload):
+        return status_code, payload
+
+    queue, unsubscribe = subscribe_queue(operation_name, (status_code, payload))
+    try:
+        return await asyncio.wait_for(queue.get(), timeout)
+    except asyncio.TimeoutError:
+        return status_code, payload
+    finally:
+        unsubscribe()
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def upstream_response(status_code, text, error):
+    if status_code == 200:
+        return web.json_response(json.loads(text) if isinstance(text, str) else text)
+    return web.json_response({
+        'error': error,
+        'status_code': status_code,
+        'message': text
+    }, status=status_code)
+
+
+class UpstreamReply:
+    """The parts of a response the admission scheduler looks at."""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+
+
+async def admitted_post(request, model_id, access_token, payload):
+    """predictLongRunning through the admission queue. Returns (status_code, text, queue_info).
+
+    Both the wait in the queue and the upstream call stay on the event
+    loop, so queued submissions don't take WSGI threads.
+    """
+    if not proxy.ADMISSION_SCHEDULER:
+        status_code, text = await vertex.post(model_id, 'predictLongRunning', access_token, payload)
+        return status_code, text, None
+
+    async def send():
+        return UpstreamReply(*await vertex.post(model_id, 'predictLongRunning', access_token, payload))
+
+    user = client_key(None, request.headers.get('X-Forwarded-For', ''), request.remote)
+    reply, queue = await proxy.admission.run_async(user, send)
+    return reply.status_code, reply.text, queue
+
+
+def admission_rejected(e):
+    log_event('admission_rejected', reason=str(e), position=e.position, eta_seconds=round(e.eta_seconds, 1))
+    return web.json_response({
+        'error': str(e),
+        'queue_position': e.position,
+        'eta_seconds': round(e.eta_seconds, 1)
+    }, status=429, headers={'Retry-After': str(e.retry_after)})
+
+
+def circuit_open(e):
+    return web.json_response({'error': str(e), 'model': e.model_id, 'verb': e.verb}, status=503,
+                             headers={'Retry-After': str(e.retry_after)})
+
+
+def proxy_route(handler):
+    async def wrapper(request):
+        try:
+            return await handler(request)
+        except CircuitOpen as e:
+            return circuit_open(e)
+        except asyncio.TimeoutError:
+            return web.json_response({'error': 'Upstream request timed out'}, status=504)
+        except Exception as e:
+            return web.json_response({'error': str(e)}, status=500)
+    return wrapper
+
+
+@proxy_route
+async def predict_long_running(request):
+    access_token = await get_access_token()
+
+    data = await read_json(request)
+    if not data:
+        return web.json_response({'error': 'No data provided'}, status=400)
+
+    model_id = 'veo-3.0-fast-generate-001'
+    log_event('vertex_request', route='predictLongRunning', model=model_id, body=data)
+    try:
+        status_code, text, _ = await admitted_post(request, model_id, access_token, data)
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+    log_event('vertex_response', route='predictLongRunning', model=model_id, status_code=status_code, body=text)
+    return upstream_response(status_code, text, 'Failed to generate video')
+
+
+@proxy_route
+async def fetch_predict_operation(request):
+    model_id = 'veo-3.0-fast-generate-001'
+
+    data = await read_json(request)
+    if not data or 'operationName' not in data:
+        return web.json_response({'error': 'operationName is required'}, status=400)
+
+    status_code, result = await fetch_operation_status(model_id, data['operationName'])
+    return upstream_response(status_code, result, 'Failed to fetch operation status')
+
+
+@proxy_route
+async def generate_video(request):
+    if is_upload(request):
+        # Streamed into the blob store by the Flask handler
+        return await handle_wsgi(request)
+    data = await read_json(request)
+    if not data:
+        return web.json_response({'error': 'No data provided'}, status=400)
+    if data.get('app_user_id') or data.get('image') or data.get('dedupe', 'seed' in data):
+        # Credit holds need the database, images go through the blocking
+        # preprocessing stage and deduplicated submissions wait on threads;
+        # let the Flask handler do the whole request
+        return await handle_wsgi(request)
+
+    access_token = await get_access_token()
+
+    model_id = 'veo-3.0-fast-generate-001'
+    veo_request = proxy.build_veo_request(data)
+    log_event('vertex_request', route='generate-video', model=model_id, body=veo_request)
+    try:
+        status_code, text, queue = await admitted_post(request, model_id, access_token, veo_request)
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+    log_event('vertex_response', route='generate-video', model=model_id, status_code=status_code, body=text)
+    if status_code == 200 and queue is not None:
+        text = dict(json.loads(text), queue=queue)
+    return upstream_response(status_code, text, 'Failed to generate video')
+
+
+@proxy_route
+async def check_operation(request):
+    data = await read_json(request)
+    if not data or 'operationName' not in data:
+        return web.json_response({'error': 'operationName is required'}, status=400)
+
+    operation_name = data['operationName']
+    model_id = proxy.model_for_operation(operation_name)
+
+    try:
+        wait = min(max(float(data.get('wait') or 0), 0), proxy.LONG_POLL_MAX_WAIT)
+    except (TypeError, ValueError):
+        return web.json_response({'error': 'wait must be a number of seconds'}, status=400)
+
+    if wait > 0:
+        status_code, result = await wait_for_change(operation_name, model_id, wait)
+    else:
+        status_code, result = await fetch_operation_status(model_id, operation_name)
+    if status_code == 200 and stored_videos(result):
+        # Reads manifests from disk on a cache miss; keep that off the event loop
+        result = await asyncio.get_running_loop().run_in_executor(
+            wsgi_executor, proxy.media_pipeline.annotate, result)
+    return upstream_response(status_code, result, 'Failed to check operation status')
+
+
+async def get_video(request):
+    digest = request.match_info['digest']
+    path = proxy.video_store.path(digest)
+    if not DIGEST_PATTERN.match(digest) or not os.path.exists(path):
+        return web.json_response({'error': 'Video not found'}, status=404)
+    # touch() may run an eviction scan; it doesn't need to finish before the response
+    asyncio.get_running_loop().run_in_executor(wsgi_executor, proxy.video_store.touch, digest)
+    # Sent with sendfile from the event loop instead of through the WSGI bridge,
+    # which would buffer the whole file; FileResponse handles Range and ETag
+    return web.FileResponse(path, headers={
+        'Content-Type': 'video/mp4',
+        'Cache-Control': 'public, max-age=31536000, immutable',
+    })
+
+
+async def get_video_media(request):
+    digest, name = request.match_info['digest'], request.match_info['name']
+    loop = asyncio.get_running_loop()
+    path = await loop.run_in_executor(wsgi_executor, proxy.media_pipeline.file_path, digest, name)
+    if path is None:
+        status = await loop.run_in_executor(wsgi_executor, proxy.media_pipeline.status, digest)
+        return web.json_response({'error': 'Not found', 'status': status}, status=404)
+    loop.run_in_executor(wsgi_executor, proxy.video_store.touch, digest)
+    return web.FileResponse(path, headers={
+        'Content-Type': media_type(name),
+        'Cache-Control': 'public, max-age=31536000, immutable',
+    })
+
+
+async def vertex_client_ctx(application):
+    await vertex.start()
+    yield
+    await vertex.close()
+
+
+async def start_hold_sweeper(application):
+    proxy.hold_sweeper.start()
+
+
+def create_app(async_proxy=ASYNC_PROXY):
+    application = web.Application(client_max_size=MAX_REQUEST_BYTES, middlewares=[request_metrics])
+    application[ASYNC_PROXY_KEY] = async_proxy
+    if HOLD_SWEEP:
+        application.on_startup.append(start_hold_sweeper)
+    application.router.add_get('/operations/{name:.+}/events', operation_events)
+    application.router.add_get('/videos/{digest}', get_video)
+    application.router.add_get('/videos/{digest}/{name:.+}', get_video_media)
+    if async_proxy:
+        model_route = '/projects/{project_id}/locations/{location}/publishers/google/models/{model_id}'
+        application.cleanup_ctx.append(vertex_client_ctx)
+        application.router.add_post(model_route + ':predictLongRunning', predict_long_running)
+        application.router.add_post(model_route + ':fetchPredictOperation', fetch_predict_operation)
+        application.router.add_post('/generate-video', generate_video)
+        application.router.add_post('/check-operation', check_operation)
+    application.router.add_route('*', '/{tail:.*}', handle_wsgi)
+    return application
+
+
+app = create_app()
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 5000))
+    web.run_app(app, host='0.0.0.0', port=port)
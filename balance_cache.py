@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+BALANCE_CACHE_TTL = float(os.getenv('BALANCE_CACHE_TTL', 30))
+BALANCE_CACHE_MAX_ENTRIES = int(os.getenv('BALANCE_CACHE_MAX_ENTRIES', 50000))
+
+
+class BalanceCache:
+    """Read-through cache of user balances for /get-credits, keyed by user UUID.
+
+    Entries live for `ttl` seconds in a bounded LRU. Every write path calls
+    invalidate() after its commit; a reader only fills the cache if that
+    user wasn't invalidated since it started its query, so a slow read can't
+    put back a balance that was already overwritten. Writes to other users
+    don't spoil the fill.
+    """
+
+    def __init__(self, ttl=BALANCE_CACHE_TTL, max_entries=BALANCE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # user_uuid -> sequence number of its latest invalidation, bounded like the entries
+        self._versions = OrderedDict()
+        self._sequence = 0
+        # Latest invalidation dropped from _versions; reads older than it can't be checked
+        self._floor = 0
+        self._counters = {'hits': 0, 'misses': 0, 'invalidations': 0, 'stale_fills': 0}
+
+    def get(self, user_uuid):
+        """Return the cached (credits, created_at) or (None, version) on a miss; pass version to fill()."""
+        with self._lock:
+            entry = self._entries.get(user_uuid)
+            if entry is not None:
+                expires_at, value = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(user_uuid)
+                    self._counters['hits'] += 1
+                    return value, self._sequence
+                del self._entries[user_uuid]
+            self._counters['misses'] += 1
+            return None, self._sequence
+
+    def fill(self, user_uuid, value, version):
+        with self._lock:
+            if version < self._floor or self._versions.get(user_uuid, 0) > version:
+                self._counters['stale_fills'] += 1
+                return
+            self._entries[user_uuid] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(user_uuid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_uuid):
+        self.invalidate_many((user_uuid,))
+
+    def invalidate_many(self, user_uuids):
+        with self._lock:
+            self._sequence += 1
+            self._counters['invalidations'] += 1
+            for user_uuid in user_uuids:
+                self._entries.pop(user_uuid, None)
+                self._versions[user_uuid] = self._sequence
+                self._versions.move_to_end(user_uuid)
+            while len(self._versions) > self.max_entries:
+                _, self._floor = self._versions.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        return stats
+
+
+balance_cache = BalanceCache()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Concurrency ceiling of the Vertex proxy routes, threaded vs asyncio.
+
+Fires N concurrent :predictLongRunning calls through async_app.py against a
+fake upstream with fixed latency, once with the proxy routes bridged to
+Flask on the WSGI thread pool (the old gunicorn --threads 8 model) and once
+with the native asyncio handlers, and prints one JSON line per mode.
+
+    python bench_async_proxy.py --requests 400 --latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'bench-token')
+# Measures the proxy routes themselves; the admission queue would cap both modes at
+# ADMISSION_MAX_CONCURRENCY and pace them to the Veo quota (set it to 1 to include it)
+os.environ.setdefault('ADMISSION_SCHEDULER', '0')
+
+import aiohttp
+from aiohttp import web
+
+import request_log
+from fake_vertex import start_fake_vertex
+
+
+async def run_mode(mode, requests_count, fake):
+    import app as proxy
+    import async_app
+    from upstream import AsyncVertexClient, VertexClient
+
+    proxy.vertex = VertexClient(proxy.PROJECT_ID, proxy.LOCATION, base_url=fake.base_url)
+    async_app.vertex = AsyncVertexClient(proxy.PROJECT_ID, proxy.LOCATION, base_url=fake.base_url)
+
+    runner = web.AppRunner(async_app.create_app(async_proxy=(mode == 'asyncio')))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = (f'http://127.0.0.1:{port}/projects/{proxy.PROJECT_ID}/locations/{proxy.LOCATION}'
+           f'/publishers/google/models/veo-3.0-fast-generate-001:predictLongRunning')
+
+    fake.max_in_flight = 0
+    latencies = []
+    statuses = {}
+
+    async def one(session):
+        started = time.perf_counter()
+        async with session.post(url, json={'instances': [{'prompt': 'bench'}]}) as response:
+            await response.read()
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+        latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(session) for _ in range(requests_count)))
+        elapsed = time.perf_counter() - started
+
+    await runner.cleanup()
+    proxy.vertex.close()
+
+    latencies.sort()
+    return {
+        'mode': mode,
+        'requests': requests_count,
+        'upstream_latency_s': fake.latency,
+        'wall_s': round(elapsed, 3),
+        'throughput_rps': round(requests_count / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        'max_upstream_concurrency': fake.max_in_flight,
+        'statuses': statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.5)
+    args = parser.parse_args()
+
+    # Request events go to stderr; stdout stays one JSON line per mode
+    request_log.configure(stream=sys.stderr)
+    fake = start_fake_vertex(latency=args.latency)
+    try:
+        for mode in ('threads', 'asyncio'):
+            result = asyncio.run(run_mode(mode, args.requests, fake))
+            print(json.dumps(result))
+    finally:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
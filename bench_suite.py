@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""Reproducible load scenarios for the proxy, with a JSON latency report.
+
+Starts the fake Vertex upstream (fake_vertex.py) and the proxy
+(async_app.py) as subprocesses, backed by a throwaway SQLite database
+unless --database-url points at a scratch Postgres, and drives each
+scenario with an asyncio client:
+
+    poll_storm         many clients polling /check-operation for a few operations
+    generate_burst     a burst of /generate-video with credit holds, one heavy user
+    webhook_flood      RevenueCat renewals on /PostBack, some of them redelivered
+    credit_contention  /use-credits and /get-credits on a handful of hot users
+
+The report has p50/p95/p99/max latency, status counts and throughput per
+endpoint and scenario. With --baseline, endpoints whose p95 or throughput
+moved past --tolerance are listed and the exit status is 1.
+
+    python bench_suite.py --output bench.json
+    python bench_suite.py --scenarios poll_storm --duration 5 --baseline bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import aiohttp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ('poll_storm', 'generate_burst', 'webhook_flood', 'credit_contention')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{process.args} exited with {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'{process.args} did not start listening on {port}')
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.started = time.perf_counter()
+
+    async def call(self, session, endpoint, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                body = await response.read()
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            body, status = b'', type(e).__name__
+        self.latencies[endpoint].append(time.perf_counter() - started)
+        self.statuses[endpoint][str(status)] += 1
+        return status, body
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            ordered = sorted(latencies)
+            statuses = self.statuses[endpoint]
+            endpoints[endpoint] = {
+                'requests': len(ordered),
+                'errors': sum(count for status, count in statuses.items()
+                              if not status.isdigit() or int(status) >= 500),
+                'status': dict(statuses),
+                'throughput_rps': round(len(ordered) / elapsed, 1),
+                'p50_ms': round(percentile(ordered, 50) * 1000, 2),
+                'p95_ms': round(percentile(ordered, 95) * 1000, 2),
+                'p99_ms': round(percentile(ordered, 99) * 1000, 2),
+                'max_ms': round(ordered[-1] * 1000, 2),
+            }
+        return {'duration_s': round(elapsed, 2), 'endpoints': endpoints}
+
+
+async def closed_loop(concurrency, duration, step):
+    """Run `step()` back to back on `concurrency` workers for `duration` seconds."""
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        while time.monotonic() < deadline:
+            await step()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def register_users(session, base_url, count, credits):
+    users = [str(uuid.uuid4()) for _ in range(count)]
+    for user in users:
+        async with session.post(f'{base_url}/register-user', json={'app_user_id': user, 'credits': credits}) as r:
+            assert r.status == 201, await r.text()
+    return users
+
+
+async def poll_storm(session, base_url, args):
+    operations = []
+    for i in range(args.operations):
+        async with session.post(f'{base_url}/generate-video', json={'prompt': f'poll storm {i}'}) as response:
+            if response.status == 200:
+                operations.append((await response.json())['name'])
+    recorder = Recorder()
+
+    async def step():
+        await recorder.call(session, 'check-operation', 'POST', f'{base_url}/check-operation',
+                            json={'operationName': random.choice(operations)})
+
+    await closed_loop(args.concurrency, args.duration, step)
+    return recorder.report()
+
+
+async def generate_burst(session, base_url, args):
+    users = await register_users(session, base_url, 10, args.burst)
+    # Half the burst comes from one user, the rest is spread over the others
+    owners = [users[0]] * (args.burst // 2) + [random.choice(users[1:]) for _ in range(args.burst - args.burst // 2)]
+    random.shuffle(owners)
+    recorder = Recorder()
+    await asyncio.gather(*(
+        recorder.call(session, 'generate-video', 'POST', f'{base_url}/generate-video',
+                      json={'prompt': f'burst {i}', 'app_user_id': owner})
+        for i, owner in enumerate(owners)
+    ))
+    return recorder.report()
+
+
+async def webhook_flood(session, base_url, args):
+    users = await register_users(session, base_url, 50, 0)
+    delivered = []
+    recorder = Recorder()
+
+    async def step():
+        if delivered and random.random() < 0.2:
+            # RevenueCat redelivers events it didn't see acknowledged in time
+            event_id, user = random.choice(delivered)
+        else:
+            event_id, user = str(uuid.uuid4()), random.choice(users)
+            delivered.append((event_id, user))
+        await recorder.call(session, 'PostBack', 'POST', f'{base_url}/PostBack', json={'event': {
+            'id': event_id,
+            'type': 'RENEWAL',
+            'app_user_id': user,
+            'product_id': 'com.vemix.weekly',
+            'environment': 'SANDBOX',
+            'event_timestamp_ms': int(time.time() * 1000),
+        }})
+
+    await closed_loop(args.concurrency, args.duration, step)
+    return recorder.report()
+
+
+async def credit_contention(session, base_url, args):
+    users = await register_users(session, base_url, 5, 10 ** 6)
+    recorder = Recorder()
+
+    async def step():
+        user = random.choice(users)
+        if random.random() < 0.8:
+            await recorder.call(session, 'use-credits', 'POST', f'{base_url}/use-credits',
+                                json={'app_user_id': user, 'credits': 1})
+        else:
+            await recorder.call(session, 'get-credits', 'GET', f'{base_url}/get-credits/{user}')
+
+    await closed_loop(args.concurrency, args.duration, step)
+    return recorder.report()
+
+
+def prepare_database(url):
+    os.environ['DATABASE_URL'] = url
+    from sqlalchemy import create_engine, text
+    import models
+    engine = create_engine(url)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    if url.startswith('sqlite'):
+        with engine.connect() as connection:
+            # Readers don't block the writer; the closest SQLite gets to Postgres here
+            connection.execute(text('PRAGMA journal_mode=WAL'))
+    engine.dispose()
+
+
+def start_services(args, workdir):
+    fake_port, proxy_port = free_port(), free_port()
+    fake = subprocess.Popen(
+        [sys.executable, 'fake_vertex.py', '--port', str(fake_port), '--complete-after', str(args.complete_after),
+         '--latency', str(args.latency), '--error-rate', str(args.error_rate), '--quota', str(args.quota),
+         '--quota-window', str(args.quota_window)],
+        cwd=HERE, stdout=subprocess.DEVNULL)
+    env = dict(os.environ,
+               PORT=str(proxy_port),
+               VERTEX_API_BASE=f'http://127.0.0.1:{fake_port}',
+               VERTEX_ACCESS_TOKEN='bench-token',
+               BLOB_STORE_DIR=os.path.join(workdir, 'blobs'),
+               VIDEO_STORE_DIR=os.path.join(workdir, 'videos'),
+               MEDIA_PIPELINE='0',
+               # The fake's --quota stands in for Veo's; pace to it only when asked
+               ADMISSION_RATE_PER_MINUTE=os.getenv('ADMISSION_RATE_PER_MINUTE', '0'))
+    proxy = subprocess.Popen([sys.executable, 'async_app.py'], cwd=HERE, env=env,
+                             stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, 'proxy.log'), 'w'))
+    try:
+        wait_for_port(fake_port, fake)
+        wait_for_port(proxy_port, proxy)
+    except RuntimeError:
+        stop_services(fake, proxy)
+        raise
+    return fake, proxy, f'http://127.0.0.1:{proxy_port}'
+
+
+def stop_services(*processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def compare(report, baseline, tolerance):
+    """Endpoints whose p95 grew, or throughput shrank, by more than `tolerance`."""
+    regressions = []
+    for scenario, result in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario, {}).get('endpoints', {})
+        for endpoint, stats in result['endpoints'].items():
+            before = previous.get(endpoint)
+            if before is None:
+                continue
+            if stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{scenario}/{endpoint}: p95 {before['p95_ms']} -> {stats['p95_ms']} ms")
+            if stats['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+                regressions.append(f"{scenario}/{endpoint}: throughput "
+                                   f"{before['throughput_rps']} -> {stats['throughput_rps']} rps")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args, base_url):
+    scenarios = {}
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        for name in args.scenarios:
+            print(f'running {name}', file=sys.stderr, flush=True)
+            scenarios[name] = await globals()[name](session, base_url, args)
+    return scenarios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--duration', type=float, default=10, help='seconds per closed-loop scenario')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--operations', type=int, default=20, help='operations polled by poll_storm')
+    parser.add_argument('--burst', type=int, default=200, help='requests in generate_burst')
+    parser.add_argument('--latency', type=float, default=0.05, help='fake upstream latency (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fake upstream 503 fraction')
+    parser.add_argument('--quota', type=int, default=0, help='fake upstream predict quota per window')
+    parser.add_argument('--quota-window', type=float, default=60.0)
+    parser.add_argument('--complete-after', type=float, default=5.0, help='seconds until fake operations finish')
+    parser.add_argument('--database-url', help='defaults to a fresh SQLite file')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='previous report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix='bench-suite-') as workdir:
+        prepare_database(args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        fake, proxy, base_url = start_services(args, workdir)
+        try:
+            scenarios = asyncio.run(run(args, base_url))
+        finally:
+            stop_services(proxy, fake)
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('output', 'baseline', 'database_url')},
+        'database': 'postgresql' if (args.database_url or '').startswith('postgres') else 'sqlite',
+        'scenarios': scenarios,
+    }
+    encoded = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(encoded + '\n')
+    else:
+        print(encoded)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
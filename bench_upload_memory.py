@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Peak Python memory of /generate-video per image-to-video request mode.
+
+Runs the Flask handler in-process under tracemalloc against a fake Vertex
+upstream in a subprocess, for each image size and mode:
+
+    json       base64 image inside the JSON body (the original path)
+    multipart  multipart/form-data upload, streamed to the blob store
+    raw        raw image body with parameters in the query string
+
+The request body is built before tracing starts, so the numbers are what
+the proxy itself allocates. Prints one JSON line per run.
+
+    python bench_upload_memory.py --sizes 5 10 20
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'bench-token')
+
+from werkzeug.test import EnvironBuilder
+
+import request_log
+
+MB = 1024 * 1024
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def build_environ(mode, image):
+    if mode == 'json':
+        body = json.dumps({'prompt': 'bench', 'image': base64.b64encode(image).decode(),
+                           'imageMimeType': 'image/png'})
+        builder = EnvironBuilder(path='/generate-video', method='POST', data=body,
+                                 content_type='application/json')
+    elif mode == 'multipart':
+        # Pre-encode the form so the client-side copy isn't counted
+        encoded = EnvironBuilder(path='/generate-video', method='POST',
+                                 data={'prompt': 'bench', 'image': (io.BytesIO(image), 'bench.png', 'image/png')})
+        environ = encoded.get_environ()
+        body = environ['wsgi.input'].read()
+        builder = EnvironBuilder(path='/generate-video', method='POST', data=body,
+                                 content_type=environ['CONTENT_TYPE'])
+    else:
+        builder = EnvironBuilder(path='/generate-video', method='POST', query_string={'prompt': 'bench'},
+                                 data=image, content_type='image/png')
+    return builder.get_environ()
+
+
+def run(proxy, mode, size_mb):
+    image = os.urandom(size_mb * MB)
+    environ = build_environ(mode, image)
+    statuses = []
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    body = b''.join(proxy.app.wsgi_app(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert statuses[0].startswith('200'), body[:200]
+    return {
+        'mode': mode,
+        'image_mb': size_mb,
+        'peak_mb': round(peak / MB, 1),
+        'peak_per_image_mb': round(peak / len(image), 2),
+        'elapsed_ms': round(elapsed * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 10, 20])
+    parser.add_argument('--modes', nargs='+', default=['json', 'multipart', 'raw'])
+    args = parser.parse_args()
+
+    port = free_port()
+    fake = subprocess.Popen([sys.executable, 'fake_vertex.py', '--port', str(port), '--complete-after', '0'],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+    os.environ['VERTEX_API_BASE'] = f'http://127.0.0.1:{port}'
+    os.environ.setdefault('MAX_UPLOAD_BYTES', str(64 * MB))
+    os.environ.setdefault('BLOB_STORE_DIR', tempfile.mkdtemp(prefix='bench-blobs-'))
+    request_log.configure(stream=sys.stderr)
+    try:
+        for _ in range(50):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        import app as proxy
+        for size_mb in args.sizes:
+            for mode in args.modes:
+                print(json.dumps(run(proxy, mode, size_mb)), flush=True)
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""Content-addressed blob store for uploaded images.
+
+Uploads are streamed to disk in fixed-size chunks while being hashed, then
+renamed to <root>/<sha256[:2]>/<sha256>, so an identical image is stored
+once. The local directory is a stand-in for a bucket: when BLOB_STORE_GCS_PREFIX
+is set (e.g. the directory is a gcsfuse mount), blobs are handed to Vertex
+as gs:// references instead of inline bytes.
+
+The store is a cache, not an archive: blobs not used (written, reused or
+served) for `max_age` seconds are deleted, and once the store holds more
+than `max_total_bytes` the least recently used blobs go first. On Cloud
+Run the default /tmp lives in memory, so keep the cap well under the
+instance memory or point the store at a mounted bucket.
+"""
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BLOB_STORE_DIR = os.getenv('BLOB_STORE_DIR', os.path.join(tempfile.gettempdir(), 'veo-proxy-blobs'))
+BLOB_STORE_GCS_PREFIX = os.getenv('BLOB_STORE_GCS_PREFIX', '')
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 30 * 1024 * 1024))
+# 0 disables the limit
+BLOB_STORE_MAX_BYTES = int(os.getenv('BLOB_STORE_MAX_BYTES', 512 * 1024 * 1024))
+BLOB_STORE_MAX_AGE = float(os.getenv('BLOB_STORE_MAX_AGE', 24 * 3600))
+# Never evicted sooner, so a blob handed to Vertex or a worker isn't pulled from under it
+BLOB_STORE_MIN_AGE = float(os.getenv('BLOB_STORE_MIN_AGE', 600))
+BLOB_STORE_EVICT_INTERVAL = float(os.getenv('BLOB_STORE_EVICT_INTERVAL', 60))
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class Blob:
+    def __init__(self, store, digest, size, mime_type):
+        self.store = store
+        self.digest = digest
+        self.size = size
+        self.mime_type = mime_type
+
+    @property
+    def path(self):
+        return self.store.path(self.digest)
+
+
+class BlobStore:
+    def __init__(self, root=BLOB_STORE_DIR, gcs_prefix=BLOB_STORE_GCS_PREFIX, max_bytes=MAX_UPLOAD_BYTES,
+                 max_total_bytes=BLOB_STORE_MAX_BYTES, max_age=BLOB_STORE_MAX_AGE, min_age=BLOB_STORE_MIN_AGE,
+                 evict_interval=BLOB_STORE_EVICT_INTERVAL, sidecar_dirs=()):
+        self.root = root
+        self.gcs_prefix = gcs_prefix.rstrip('/')
+        self.max_bytes = max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_age = max_age
+        self.min_age = min_age
+        self.evict_interval = evict_interval
+        # <root>/<name>/<digest>/ directories of files derived from a blob:
+        # counted in its size and evicted with it
+        self.sidecar_dirs = sidecar_dirs
+        self.evict_listeners = []
+        os.makedirs(root, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._evicting = threading.Lock()
+        self._total_bytes = None
+        self._last_evict = 0.0
+        self._counters = {'evictions': 0, 'evicted_bytes': 0, 'scans': 0}
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def touch(self, digest):
+        """Mark a blob as used, so LRU eviction keeps it longer."""
+        path = self.path(digest)
+        try:
+            # Recency is the access time; mtime stays put because file ETags are built from it
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except FileNotFoundError:
+            pass
+        self._maybe_evict()
+
+    def gcs_uri(self, digest):
+        return f"{self.gcs_prefix}/{digest[:2]}/{digest}" if self.gcs_prefix else None
+
+    def put_stream(self, stream, mime_type):
+        """Copy `stream` (anything with read(n)) into the store. Returns a Blob."""
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge(f'Upload exceeds {self.max_bytes} bytes')
+                    sha256.update(chunk)
+                    out.write(chunk)
+            digest = sha256.hexdigest()
+            os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+            os.replace(tmp_path, self.path(digest))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += size
+        self._maybe_evict()
+        return Blob(self, digest, size, mime_type)
+
+    def put_bytes(self, data, mime_type):
+        return self.put_stream(io.BytesIO(data), mime_type)
+
+    def _derived_link(self, source_digest, variant):
+        return os.path.join(self.root, 'derived', f'{source_digest}.{variant}')
+
+    def get_derived(self, source_digest, variant):
+        """Blob previously stored with put_derived() for this source and variant, or None."""
+        try:
+            with open(self._derived_link(source_digest, variant)) as link:
+                digest, size, mime_type = link.read().split()
+        except (FileNotFoundError, ValueError):
+            return None
+        if not os.path.exists(self.path(digest)):
+            return None
+        self.touch(digest)
+        return Blob(self, digest, int(size), mime_type)
+
+    def put_derived(self, source_digest, variant, data, mime_type):
+        """Store `data` as a blob and remember it as `variant` of the source blob."""
+        blob = self.put_bytes(data, mime_type)
+        link = self._derived_link(source_digest, variant)
+        os.makedirs(os.path.dirname(link), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(link), prefix='.link-')
+        with os.fdopen(fd, 'w') as out:
+            out.write(f'{blob.digest} {blob.size} {mime_type}')
+        os.replace(tmp_path, link)
+        return blob
+
+    def _maybe_evict(self):
+        with self._lock:
+            over = (self.max_total_bytes and self._total_bytes is not None
+                    and self._total_bytes > self.max_total_bytes)
+            due = time.monotonic() - self._last_evict >= self.evict_interval
+        if (over or due) and self._evicting.acquire(blocking=False):
+            try:
+                self.evict()
+            except Exception as e:
+                logger.error(f"Blob store eviction in {self.root} failed: {str(e)}")
+            finally:
+                self._evicting.release()
+
+    def evict(self):
+        """Delete expired blobs, then least recently used ones while over the size limit. Returns the count."""
+        now = time.time()
+        entries, total = self._scan(now)
+        entries.sort()
+        evicted = evicted_bytes = 0
+        for used, size, digest in entries:
+            age = now - used
+            if age < self.min_age:
+                break
+            if not ((self.max_age and age > self.max_age)
+                    or (self.max_total_bytes and total > self.max_total_bytes)):
+                break
+            self._remove(digest)
+            total -= size
+            evicted += 1
+            evicted_bytes += size
+
+        with self._lock:
+            self._total_bytes = total
+            self._last_evict = time.monotonic()
+            self._counters['scans'] += 1
+            self._counters['evictions'] += evicted
+            self._counters['evicted_bytes'] += evicted_bytes
+        if evicted:
+            logger.info(f"Evicted {evicted} blob(s), {evicted_bytes} bytes, from {self.root}")
+        return evicted
+
+    def _scan(self, now):
+        """Return ([last used, size, digest] per blob, total bytes), dropping stale temp files and dead links."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.root):
+            if entry.name.startswith('.') and entry.is_file() and now - entry.stat().st_mtime > self.min_age:
+                # Left behind by a crashed upload
+                _unlink(entry.path)
+            elif len(entry.name) == 2 and entry.is_dir():
+                for blob in os.scandir(entry.path):
+                    try:
+                        stat = blob.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append([stat.st_atime, stat.st_size, blob.name])
+                    total += stat.st_size
+
+        derived = os.path.join(self.root, 'derived')
+        if os.path.isdir(derived):
+            for link in os.scandir(derived):
+                if link.name.startswith('.'):
+                    continue
+                try:
+                    with open(link.path) as f:
+                        digest = f.read().split()[0]
+                except (OSError, IndexError):
+                    continue
+                if not os.path.exists(self.path(digest)):
+                    _unlink(link.path)
+
+        by_digest = {entry[2]: entry for entry in entries}
+        for name in self.sidecar_dirs:
+            sidecars = os.path.join(self.root, name)
+            if not os.path.isdir(sidecars):
+                continue
+            for sidecar in os.scandir(sidecars):
+                if sidecar.name.startswith('.'):
+                    continue
+                entry = by_digest.get(sidecar.name)
+                if entry is None:
+                    if now - sidecar.stat().st_mtime > self.min_age:
+                        shutil.rmtree(sidecar.path, ignore_errors=True)
+                    continue
+                size = _tree_size(sidecar.path)
+                entry[1] += size
+                total += size
+        return entries, total
+
+    def _remove(self, digest):
+        _unlink(self.path(digest))
+        for name in self.sidecar_dirs:
+            shutil.rmtree(os.path.join(self.root, name, digest), ignore_errors=True)
+        for listener in self.evict_listeners:
+            try:
+                listener(digest)
+            except Exception as e:
+                logger.warning(f"Evict listener for {digest} failed: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['bytes'] = self._total_bytes
+            stats['max_bytes'] = self.max_total_bytes or None
+        return stats
+
+
+def _tree_size(path):
+    size = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return size
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+BLOB_PLACEHOLDER = '__blob_base64__'
+
+
+class InlineBlobBody:
+    """Request body for `payload` with BLOB_PLACEHOLDER replaced by the blob's base64.
+
+    The JSON around the image is encoded once; the image itself is read
+    from disk and base64-encoded chunk by chunk as the HTTP client calls
+    read(), so no full-size copy of the bytes or the base64 text is ever
+    built. __len__ lets requests send a Content-Length instead of chunking.
+    """
+
+    def __init__(self, payload, blob):
+        encoded = json.dumps(payload, separators=(',', ':')).encode()
+        self._prefix, _, self._suffix = encoded.partition(json.dumps(BLOB_PLACEHOLDER).encode())
+        self._prefix += b'"'
+        self._suffix = b'"' + self._suffix
+        self._blob = blob
+        self._file = None
+        self._pending = b''
+        self._offset = 0
+        self._stage = 'prefix'
+        self._length = len(self._prefix) + 4 * ((blob.size + 2) // 3) + len(self._suffix)
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length
+        pieces = []
+        while size > 0:
+            if self._offset >= len(self._pending):
+                if self._stage == 'done':
+                    break
+                self._pending, self._offset = self._next_piece(), 0
+                continue
+            piece = self._pending[self._offset:self._offset + size]
+            self._offset += len(piece)
+            size -= len(piece)
+            pieces.append(piece)
+        return b''.join(pieces)
+
+    def _next_piece(self):
+        if self._stage == 'prefix':
+            self._stage = 'blob'
+            self._file = open(self._blob.path, 'rb')
+            return self._prefix
+        if self._stage == 'blob':
+            # Multiple of 3 so each chunk encodes without padding except the last
+            chunk = self._file.read(CHUNK_SIZE - CHUNK_SIZE % 3)
+            if chunk:
+                return base64.b64encode(chunk)
+            self._file.close()
+            self._stage = 'done'
+            return self._suffix
+        return b''
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
@@ -0,0 +1,145 @@
+"""Bulk credit grants and adjustments.
+
+Rows of (app_user_id, delta) come from a JSON body, NDJSON or CSV and are
+read as a stream. Every `chunk_size` valid rows are applied with one
+set-based UPDATE (see credits.apply_credit_deltas) and committed, so a
+100k-row promotion is a hundred statements instead of 100k round trips,
+and a failure loses at most the chunk in flight.
+"""
+import codecs
+import csv
+import json
+import logging
+import os
+import time
+import uuid
+
+from balance_cache import balance_cache
+from credits import apply_credit_deltas
+from models import db_session
+
+logger = logging.getLogger(__name__)
+
+BULK_CREDITS_CHUNK_SIZE = int(os.getenv('BULK_CREDITS_CHUNK_SIZE', 1000))
+BULK_CREDITS_MAX_DELTA = int(os.getenv('BULK_CREDITS_MAX_DELTA', 1000000))
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/ndjson')
+CSV_TYPES = ('text/csv',)
+
+
+class InvalidBulkBody(Exception):
+    pass
+
+
+def read_rows(stream, mimetype):
+    """Yield (app_user_id, delta) pairs as sent, without validating them."""
+    if mimetype in NDJSON_TYPES:
+        for line in codecs.getreader('utf-8')(stream):
+            if line.strip():
+                yield _json_row(line)
+    elif mimetype in CSV_TYPES:
+        reader = csv.reader(codecs.getreader('utf-8')(stream))
+        for i, fields in enumerate(reader):
+            if not fields:
+                continue
+            if i == 0 and fields[0].strip().lower() == 'app_user_id':
+                continue
+            yield fields[0].strip(), (fields[1].strip() if len(fields) > 1 else None)
+    else:
+        try:
+            data = json.load(stream)
+        except ValueError as e:
+            raise InvalidBulkBody(f'Invalid JSON body: {e}')
+        rows = data.get('grants') if isinstance(data, dict) else data
+        if not isinstance(rows, list):
+            raise InvalidBulkBody('Expected a list of grants or {"grants": [...]}')
+        for row in rows:
+            yield _fields(row)
+
+
+def _json_row(line):
+    try:
+        return _fields(json.loads(line))
+    except ValueError:
+        return None, None
+
+
+def _fields(row):
+    if not isinstance(row, dict):
+        return None, None
+    return row.get('app_user_id'), row.get('delta', row.get('credits'))
+
+
+def parse_row(app_user_id, delta):
+    """(user_uuid, delta) or raise ValueError with the reason the row is invalid."""
+    try:
+        user_uuid = uuid.UUID(str(app_user_id))
+    except ValueError:
+        raise ValueError('Invalid UUID format for app_user_id')
+    if isinstance(delta, bool) or isinstance(delta, float):
+        raise ValueError('delta must be an integer')
+    try:
+        delta = int(delta)
+    except (TypeError, ValueError):
+        raise ValueError('delta must be an integer')
+    if delta == 0 or abs(delta) > BULK_CREDITS_MAX_DELTA:
+        raise ValueError(f'delta must be non-zero and at most {BULK_CREDITS_MAX_DELTA} in magnitude')
+    return user_uuid, delta
+
+
+def apply_bulk_credits(rows, chunk_size=None):
+    """Apply `rows` of (app_user_id, delta) and return (summary, per-row results).
+
+    Rows for the same user within a chunk are summed and applied (or
+    refused) together, so each of them reports the same outcome. A chunk
+    the database rejects is reported with status 'error' and the rest
+    carry on.
+    """
+    chunk_size = chunk_size or BULK_CREDITS_CHUNK_SIZE
+    started = time.perf_counter()
+    results = []
+    summary = {'rows': 0, 'applied': 0, 'insufficient_credits': 0, 'not_found': 0, 'invalid': 0,
+               'error': 0, 'chunks': 0}
+    pending = []
+
+    with db_session() as db:
+        def flush():
+            deltas = {}
+            for result in pending:
+                deltas[result['_user']] = deltas.get(result['_user'], 0) + result['delta']
+            try:
+                outcome = apply_credit_deltas(db, deltas)
+                db.commit()
+            except Exception as e:
+                # Earlier chunks stay committed; this one is reported as not applied
+                db.rollback()
+                logger.error(f"Error applying bulk credit chunk of {len(deltas)} users: {str(e)}")
+                outcome = {user: ('error', None) for user in deltas}
+            balance_cache.invalidate_many([user for user, (status, _) in outcome.items() if status == 'applied'])
+            for result in pending:
+                status, credits = outcome[result.pop('_user')]
+                result['status'] = status
+                if credits is not None:
+                    result['credits'] = credits
+                summary[status] += 1
+            summary['chunks'] += 1
+            pending.clear()
+
+        for app_user_id, delta in rows:
+            summary['rows'] += 1
+            result = {'row': summary['rows'], 'app_user_id': app_user_id, 'delta': delta}
+            results.append(result)
+            try:
+                result['_user'], result['delta'] = parse_row(app_user_id, delta)
+            except ValueError as e:
+                result.update(status='invalid', error=str(e))
+                summary['invalid'] += 1
+                continue
+            pending.append(result)
+            if len(pending) >= chunk_size:
+                flush()
+        if pending:
+            flush()
+
+    summary['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return summary, results
@@ -0,0 +1,140 @@
+"""Per-model, per-verb circuit breakers for Vertex AI calls.
+
+After `failure_threshold` consecutive failures (timeouts, connection
+errors, 5xx) a breaker opens and calls fail immediately with CircuitOpen
+instead of tying up a request thread on an unhealthy region. After
+`reset_timeout` seconds it lets `half_open_probes` requests through; one
+success closes it again, a failure re-opens it. 429 is a quota answer,
+not an outage, and is left to the admission scheduler.
+"""
+import math
+import os
+import threading
+import time
+
+from metrics import observe_circuit_rejected, observe_circuit_state
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', 30))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv('BREAKER_HALF_OPEN_PROBES', 1))
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+
+class CircuitOpen(Exception):
+    def __init__(self, model_id, verb, retry_after):
+        super().__init__(f'Vertex AI {model_id}:{verb} is unavailable; failing fast')
+        self.model_id = model_id
+        self.verb = verb
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def is_failure(status):
+    """`status` as passed to observe_upstream(): an HTTP status, 'timeout' or 'error'."""
+    return not isinstance(status, int) or status >= 500
+
+
+class CircuitBreaker:
+    def __init__(self, model_id, verb, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=BREAKER_RESET_TIMEOUT, half_open_probes=BREAKER_HALF_OPEN_PROBES,
+                 clock=time.monotonic):
+        self.model_id = model_id
+        self.verb = verb
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self._counters = {'rejected': 0, 'opened': 0}
+        observe_circuit_state(model_id, verb, CLOSED)
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may go upstream now. Pair with record()."""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.reset_timeout - self.clock()
+                if remaining > 0:
+                    self._reject(remaining)
+                self._set_state(HALF_OPEN)
+                self.probes = 0
+            if self.state == HALF_OPEN:
+                if self.probes >= self.half_open_probes:
+                    self._reject(self.reset_timeout)
+                self.probes += 1
+            return True
+
+    def record(self, status):
+        """`status` None means the call was abandoned (e.g. a cancelled hedge) and says nothing about health."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probes = max(0, self.probes - 1)
+                if status is None:
+                    return
+                if is_failure(status):
+                    self._open()
+                else:
+                    self.failures = 0
+                    self._set_state(CLOSED)
+            elif self.state == CLOSED and status is not None:
+                if not is_failure(status):
+                    self.failures = 0
+                else:
+                    self.failures += 1
+                    if self.failures >= self.failure_threshold:
+                        self._open()
+            # Calls that were already in flight when the breaker opened don't count
+
+    def _open(self):
+        self.opened_at = self.clock()
+        self._counters['opened'] += 1
+        self._set_state(OPEN)
+
+    def _reject(self, retry_after):
+        self._counters['rejected'] += 1
+        observe_circuit_rejected(self.model_id, self.verb)
+        raise CircuitOpen(self.model_id, self.verb, retry_after)
+
+    def _set_state(self, state):
+        self.state = state
+        observe_circuit_state(self.model_id, self.verb, state)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['state'] = self.state
+            stats['consecutive_failures'] = self.failures
+        return stats
+
+
+class CircuitBreakers:
+    """Lazily created breaker per (model, verb), shared by the sync and async clients."""
+
+    def __init__(self, **options):
+        self.options = options
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, model_id, verb):
+        key = (model_id, verb)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if breaker is None:
+                    breaker = self._breakers[key] = CircuitBreaker(model_id, verb, **self.options)
+        return breaker
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {f'{model_id}:{verb}': breaker.stats() for (model_id, verb), breaker in breakers.items()}
+
+
+upstream_breakers = CircuitBreakers()
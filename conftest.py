@@ -0,0 +1,46 @@
+import os
+import uuid
+
+import pytest
+from sqlalchemy import create_engine
+
+# Tests drive settlement themselves; no background sweeper against the dev database
+os.environ.setdefault('HOLD_SWEEP', '0')
+# The fake upstream has no quota unless a test gives it one (and its own scheduler)
+os.environ.setdefault('ADMISSION_RATE_PER_MINUTE', '0')
+
+import models
+
+
+@pytest.fixture
+def db_engine(tmp_path):
+    """Bind the app's sessions to a throwaway database for the duration of a test.
+
+    Uses TEST_DATABASE_URL when set (e.g. a scratch Postgres), otherwise a
+    SQLite file under tmp_path.
+    """
+    url = os.getenv('TEST_DATABASE_URL') or f"sqlite:///{tmp_path / 'test.db'}"
+    connect_args = {'check_same_thread': False, 'timeout': 30} if url.startswith('sqlite') else {}
+    engine = create_engine(url, connect_args=connect_args, pool_size=20, max_overflow=20)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+
+    previous_bind = models.SessionLocal.kw['bind']
+    models.SessionLocal.configure(bind=engine)
+    try:
+        yield engine
+    finally:
+        models.SessionLocal.configure(bind=previous_bind)
+        models.Base.metadata.drop_all(engine)
+        engine.dispose()
+
+
+def register(client, credits=0):
+    """Register a fresh user through the API and return its app_user_id."""
+    user_id = str(uuid.uuid4())
+    assert client.post('/register-user', json={'app_user_id': user_id, 'credits': credits}).status_code == 201
+    return user_id
+
+
+def balance(client, user_id):
+    return client.get(f'/get-credits/{user_id}').get_json()['credits']
@@ -0,0 +1,202 @@
+from sqlalchemy import Integer, Uuid, bindparam, column, func, select, text, update, values
+from sqlalchemy.orm import Session
+
+from balance_cache import balance_cache
+from models import User, CreditHold
+
+HOLD_HELD = 'held'
+HOLD_SETTLED = 'settled'
+HOLD_RELEASED = 'released'
+
+
+class UserNotFound(Exception):
+    pass
+
+
+class InsufficientCredits(Exception):
+    def __init__(self, available):
+        super().__init__(f'Insufficient credits: {available} available')
+        self.available = available
+
+
+def debit_credits(db: Session, user_uuid, amount):
+    """Atomically subtract `amount` credits and return the remaining balance.
+
+    A single conditional UPDATE ... WHERE credits >= amount RETURNING credits,
+    so parallel debits can never overdraw. The balance is only re-read on
+    the failure path to tell a missing user from an insufficient balance.
+    """
+    remaining = _debit(db, user_uuid, amount)
+    db.commit()
+    balance_cache.invalidate(user_uuid)
+    return remaining
+
+
+def _debit(db: Session, user_uuid, amount):
+    stmt = (
+        update(User)
+        .where(User.id == user_uuid, User.credits >= amount)
+        .values(credits=User.credits - amount)
+        .returning(User.credits)
+        .execution_options(synchronize_session=False)
+    )
+    remaining = db.execute(stmt).scalar_one_or_none()
+    if remaining is None:
+        available = db.execute(select(User.credits).where(User.id == user_uuid)).scalar_one_or_none()
+        db.rollback()
+        if available is None:
+            raise UserNotFound()
+        raise InsufficientCredits(available)
+    return remaining
+
+
+def credit_credits(db: Session, user_uuid, amount):
+    """Atomically add `amount` credits and return the new balance."""
+    total = _credit(db, user_uuid, amount)
+    db.commit()
+    balance_cache.invalidate(user_uuid)
+    return total
+
+
+def _credit(db: Session, user_uuid, amount):
+    stmt = (
+        update(User)
+        .where(User.id == user_uuid)
+        .values(credits=User.credits + amount)
+        .returning(User.credits)
+        .execution_options(synchronize_session=False)
+    )
+    total = db.execute(stmt).scalar_one_or_none()
+    if total is None:
+        db.rollback()
+        raise UserNotFound()
+    return total
+
+
+def apply_credit_deltas(db: Session, deltas):
+    """Add each user's delta (negative to take credits away) in one set-based UPDATE. Does not commit.
+
+    `deltas` maps user UUID -> delta. A delta that would take a balance
+    below zero is not applied. Returns {user_uuid: (status, credits)} with
+    status 'applied' (credits is the new balance), 'insufficient_credits'
+    (credits is the unchanged balance) or 'not_found'.
+    """
+    if not deltas:
+        return {}
+    if db.get_bind().dialect.name == 'sqlite':
+        # SQLite can't alias the columns of a VALUES list, only of a CTE
+        rows = ', '.join(f'(:id{i}, :delta{i})' for i in range(len(deltas)))
+        stmt = text(
+            f'WITH batch(id, delta) AS (VALUES {rows}) '
+            'UPDATE users SET credits = users.credits + batch.delta FROM batch '
+            'WHERE users.id = batch.id AND users.credits + batch.delta >= 0 '
+            'RETURNING users.id, users.credits'
+        ).bindparams(
+            *(bindparam(f'id{i}', user_uuid, type_=Uuid) for i, user_uuid in enumerate(deltas)),
+            *(bindparam(f'delta{i}', delta) for i, delta in enumerate(deltas.values())),
+        ).columns(id=Uuid, credits=Integer)
+    else:
+        # UPDATE ... FROM (VALUES ...): one join against the batch, however many users it has
+        batch = values(column('id', Uuid), column('delta', Integer), name='batch').data(list(deltas.items()))
+        stmt = (
+            update(User)
+            .where(User.id == batch.c.id, User.credits + batch.c.delta >= 0)
+            .values(credits=User.credits + batch.c.delta)
+            .returning(User.id, User.credits)
+            .execution_options(synchronize_session=False)
+        )
+    applied = db.execute(stmt).all()
+    results = {user_uuid: ('applied', credits) for user_uuid, credits in applied}
+
+    missing = [user_uuid for user_uuid in deltas if user_uuid not in results]
+    if missing:
+        balances = dict(db.execute(select(User.id, User.credits).where(User.id.in_(missing))).all())
+        for user_uuid in missing:
+            if user_uuid in balances:
+                results[user_uuid] = ('insufficient_credits', balances[user_uuid])
+            else:
+                results[user_uuid] = ('not_found', None)
+    return results
+
+
+def place_hold(db: Session, user_uuid, amount):
+    """Debit `amount` credits into a hold in one transaction. Returns (hold_id, remaining)."""
+    remaining = _debit(db, user_uuid, amount)
+    hold = CreditHold(app_user_id=user_uuid, amount=amount, status=HOLD_HELD)
+    db.add(hold)
+    db.flush()
+    hold_id = hold.id
+    db.commit()
+    balance_cache.invalidate(user_uuid)
+    return hold_id, remaining
+
+
+def attach_hold(db: Session, hold_id, operation_name):
+    db.execute(
+        update(CreditHold)
+        .where(CreditHold.id == hold_id)
+        .values(operation_name=operation_name)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def _close_hold(db: Session, condition, status):
+    # The status transition is the guard: a hold only leaves 'held' once,
+    # so settling or releasing twice is a no-op.
+    closed = db.execute(
+        update(CreditHold)
+        .where(condition, CreditHold.status == HOLD_HELD)
+        .values(status=status)
+        .returning(CreditHold.app_user_id, CreditHold.amount)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if status == HOLD_RELEASED:
+        for app_user_id, amount in closed:
+            db.execute(
+                update(User)
+                .where(User.id == app_user_id)
+                .values(credits=User.credits + amount)
+                .execution_options(synchronize_session=False)
+            )
+    db.commit()
+    if status == HOLD_RELEASED:
+        for app_user_id, _ in closed:
+            balance_cache.invalidate(app_user_id)
+    return len(closed)
+
+
+def release_hold(db: Session, hold_id):
+    """Refund a hold. Returns True if it was still held."""
+    return _close_hold(db, CreditHold.id == hold_id, HOLD_RELEASED) > 0
+
+
+def settle_operation_holds(db: Session, operation_name, succeeded):
+    """Settle (keep the credits) or release (refund) every open hold on an operation."""
+    status = HOLD_SETTLED if succeeded else HOLD_RELEASED
+    return _close_hold(db, CreditHold.operation_name == operation_name, status)
+
+
+def release_stale_holds(db: Session, orphaned_before, expired_before):
+    """Refund holds that can no longer be settled. Returns (orphaned, expired) counts.
+
+    Orphaned holds never got an operation attached (the process died
+    between place_hold and attach_hold); expired holds have been open
+    longer than any Veo operation runs.
+    """
+    orphaned = _close_hold(db, (CreditHold.operation_name.is_(None)) & (CreditHold.created_at < orphaned_before),
+                           HOLD_RELEASED)
+    expired = _close_hold(db, CreditHold.created_at < expired_before, HOLD_RELEASED)
+    return orphaned, expired
+
+
+def open_hold_operations(db: Session, created_before, limit):
+    """Operation names with holds still open since before `created_before`, oldest first."""
+    return db.execute(
+        select(CreditHold.operation_name)
+        .where(CreditHold.status == HOLD_HELD, CreditHold.operation_name.is_not(None),
+               CreditHold.created_at < created_before)
+        .group_by(CreditHold.operation_name)
+        .order_by(func.min(CreditHold.created_at))
+        .limit(limit)
+    ).scalars().all()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Vertex AI Veo endpoints.
+
+Serves :predictLongRunning and :fetchPredictOperation with HTTP/1.1 keep-alive
+so the proxy can be exercised without Google credentials. Operations whose
+prompt contains "FAIL" finish with an error instead of a video. With
+--quota, predictLongRunning answers 429 RESOURCE_EXHAUSTED once more than
+that many submissions arrive within --quota-window seconds, like the
+per-project Veo quota. --error-rate makes that fraction of calls fail with
+503 UNAVAILABLE.
+
+    python fake_vertex.py --port 8099
+    VERTEX_API_BASE=http://127.0.0.1:8099 python app.py
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODEL_PATH = re.compile(
+    r'^/v1/projects/(?P<project>[^/]+)/locations/(?P<location>[^/]+)'
+    r'/publishers/google/models/(?P<model>[^:/]+):(?P<verb>\w+)$'
+)
+
+
+class FakeVertexServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, complete_after=0.0, latency=0.0, inline_video_bytes=0,
+                 quota=0, quota_window=60.0, error_rate=0.0):
+        super().__init__(address, FakeVertexHandler)
+        self.complete_after = complete_after
+        self.latency = latency
+        self.inline_video_bytes = inline_video_bytes
+        self.quota = quota
+        self.quota_window = quota_window
+        self.error_rate = error_rate
+        self.quota_used = deque()
+        self.throttled = 0
+        self.accepted_prompts = []
+        # Set at runtime: an HTTP status every call returns (a regional outage),
+        # and a number of upcoming calls that take `slow_latency` seconds
+        self.outage = 0
+        self.slow_next = 0
+        self.slow_latency = 1.0
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = {'predictLongRunning': 0, 'fetchPredictOperation': 0}
+        self.operations = {}
+        self.last_predict = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeVertexHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        match = MODEL_PATH.match(self.path)
+        if not match:
+            return self._reply(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+        verb = match.group('verb')
+        with self.server.lock:
+            if verb in self.server.requests:
+                self.server.requests[verb] += 1
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        with self.server.lock:
+            slow = self.server.slow_next > 0
+            self.server.slow_next -= slow
+        try:
+            if self.server.latency or slow:
+                time.sleep(self.server.slow_latency if slow else self.server.latency)
+            outage = self.server.outage or (503 if random.random() < self.server.error_rate else 0)
+            if outage:
+                return self._reply(outage, {'error': {
+                    'code': outage, 'message': 'The service is currently unavailable.',
+                    'status': 'UNAVAILABLE'}})
+            self._dispatch(match, verb, body)
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def _dispatch(self, match, verb, body):
+        if verb == 'predictLongRunning':
+            return self._predict(match, body)
+        if verb == 'fetchPredictOperation':
+            return self._fetch(body)
+        return self._reply(400, {'error': {'code': 400, 'message': f'Unknown verb {verb}'}})
+
+    def _predict(self, match, body):
+        name = (f"projects/{match.group('project')}/locations/{match.group('location')}"
+                f"/publishers/google/models/{match.group('model')}/operations/{uuid.uuid4()}")
+        prompts = ' '.join(str(instance.get('prompt', '')) for instance in body.get('instances') or [])
+        with self.server.lock:
+            if not self._within_quota():
+                self.server.throttled += 1
+                throttled = True
+            else:
+                throttled = False
+                self.server.operations[name] = (time.monotonic(), 'FAIL' in prompts)
+                self.server.last_predict = body
+                self.server.accepted_prompts.append(prompts)
+        if throttled:
+            return self._reply(429, {'error': {
+                'code': 429,
+                'message': 'Quota exceeded for aiplatform.googleapis.com/online_prediction_requests_per_base_model',
+                'status': 'RESOURCE_EXHAUSTED',
+            }})
+        self._reply(200, {'name': name})
+
+    def _within_quota(self):
+        if not self.server.quota:
+            return True
+        now = time.monotonic()
+        used = self.server.quota_used
+        while used and used[0] <= now - self.server.quota_window:
+            used.popleft()
+        if len(used) >= self.server.quota:
+            return False
+        used.append(now)
+        return True
+
+    def _fetch(self, body):
+        name = body.get('operationName')
+        with self.server.lock:
+            operation = self.server.operations.get(name)
+        if operation is None:
+            return self._reply(404, {'error': {'code': 404, 'message': 'Operation not found'}})
+
+        started, fails = operation
+        if time.monotonic() - started < self.server.complete_after:
+            return self._reply(200, {'name': name})
+        if fails:
+            return self._reply(200, {
+                'name': name,
+                'done': True,
+                'error': {'code': 3, 'message': 'The prompt could not be processed.'},
+            })
+        if self.server.inline_video_bytes:
+            video = {'bytesBase64Encoded': base64.b64encode(fake_video(name, self.server.inline_video_bytes)).decode(),
+                     'mimeType': 'video/mp4'}
+        else:
+            video = {'gcsUri': f"gs://fake-bucket/{name.rsplit('/', 1)[-1]}/sample_0.mp4", 'mimeType': 'video/mp4'}
+        self._reply(200, {
+            'name': name,
+            'done': True,
+            'response': {
+                '@type': 'type.googleapis.com/cloud.ai.large_models.vision.GenerateVideoResponse',
+                'raiMediaFilteredCount': 0,
+                'videos': [video],
+            },
+        })
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def fake_video(operation_name, size):
+    """Deterministic stand-in video bytes, the same on every poll of an operation."""
+    block = hashlib.sha256(operation_name.encode()).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+def start_fake_vertex(host='127.0.0.1', port=0, **options):
+    return FakeVertexServer((host, port), **options).start()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake Vertex AI Veo upstream')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--complete-after', type=float, default=30.0,
+                        help='seconds before an operation reports done')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every response')
+    parser.add_argument('--inline-video-bytes', type=int, default=0,
+                        help='return videos inline as base64 of this size instead of gcsUri')
+    parser.add_argument('--quota', type=int, default=0,
+                        help='predictLongRunning calls allowed per --quota-window (0 = unlimited)')
+    parser.add_argument('--quota-window', type=float, default=60.0)
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of calls answered with 503')
+    args = parser.parse_args()
+
+    server = FakeVertexServer((args.host, args.port), complete_after=args.complete_after,
+                              latency=args.latency, inline_video_bytes=args.inline_video_bytes,
+                              quota=args.quota, quota_window=args.quota_window,
+                              error_rate=args.error_rate)
+    print(f"Fake Vertex listening on {server.base_url}")
+    server.serve_forever()
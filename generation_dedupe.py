@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+GENERATION_DEDUPE_TTL = float(os.getenv('GENERATION_DEDUPE_TTL', 600))
+GENERATION_DEDUPE_MAX_ENTRIES = int(os.getenv('GENERATION_DEDUPE_MAX_ENTRIES', 10000))
+
+
+def generation_key(model_id, veo_request, app_user_id=None, image_digest=None):
+    """Canonical hash of a generation request.
+
+    Inline image bytes are replaced by their sha256 so the key doesn't
+    depend on how the image arrived. The user is part of the key: an
+    operation is never shared across accounts.
+    """
+    instances = []
+    for instance in veo_request.get('instances', []):
+        instance = dict(instance)
+        if image_digest is not None and 'image' in instance:
+            instance['image'] = {'sha256': image_digest, 'mimeType': instance['image'].get('mimeType')}
+        instances.append(instance)
+    canonical = json.dumps({
+        'model': model_id,
+        'user': app_user_id,
+        'instances': instances,
+        'parameters': veo_request.get('parameters', {}),
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class _Submission:
+    def __init__(self):
+        self.event = threading.Event()
+        self.operation_name = None
+
+
+class GenerationDeduper:
+    """Maps generation keys to the Veo operation already started for them.
+
+    The first request for a key submits; identical requests arriving while
+    it is in flight wait for its operation name, and later ones get it
+    from a bounded LRU for `ttl` seconds. Operations that finish with an
+    error are forgotten so a retry starts a new one.
+    """
+
+    def __init__(self, ttl=GENERATION_DEDUPE_TTL, max_entries=GENERATION_DEDUPE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_operation = {}
+        self._inflight = {}
+        self._counters = {'submitted': 0, 'deduplicated': 0, 'coalesced': 0, 'forgotten': 0}
+
+    def submit(self, key, submit):
+        """Return (operation_name, deduplicated, submit_result).
+
+        `submit` is called for the first request of a key and must return
+        (operation_name or None, result); None means the submission failed
+        and nothing is remembered. Duplicates get (name, True, None).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, operation_name = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self._counters['deduplicated'] += 1
+                    return operation_name, True, None
+                self._forget(key)
+
+            submission = self._inflight.get(key)
+            leader = submission is None
+            if leader:
+                submission = _Submission()
+                self._inflight[key] = submission
+
+        if not leader:
+            submission.event.wait()
+            if submission.operation_name is not None:
+                with self._lock:
+                    self._counters['coalesced'] += 1
+                return submission.operation_name, True, None
+            # The first submission failed; try on our own
+            return self.submit(key, submit)
+
+        try:
+            operation_name, result = submit()
+            submission.operation_name = operation_name
+            if operation_name is not None:
+                self._remember(key, operation_name)
+            return operation_name, False, result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            submission.event.set()
+
+    def _remember(self, key, operation_name):
+        with self._lock:
+            self._counters['submitted'] += 1
+            self._entries[key] = (time.monotonic() + self.ttl, operation_name)
+            self._entries.move_to_end(key)
+            self._keys_by_operation[operation_name] = key
+            while len(self._entries) > self.max_entries:
+                self._forget(next(iter(self._entries)))
+
+    def forget_operation(self, operation_name):
+        """Drop the key that points at `operation_name`, e.g. because it failed."""
+        with self._lock:
+            key = self._keys_by_operation.get(operation_name)
+            if key is not None:
+                self._counters['forgotten'] += 1
+                self._forget(key)
+
+    def _forget(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._keys_by_operation.pop(entry[1], None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['in_flight'] = len(self._inflight)
+        return stats
@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from models import SessionLocal
+from credits import open_hold_operations, release_stale_holds, settle_operation_holds
+from operation_cache import is_terminal
+from operation_watcher import is_transient
+
+logger = logging.getLogger(__name__)
+
+HOLD_SWEEP = os.getenv('HOLD_SWEEP', '1') == '1'
+HOLD_SWEEP_INTERVAL = float(os.getenv('HOLD_SWEEP_INTERVAL', 60))
+HOLD_SWEEP_BATCH = int(os.getenv('HOLD_SWEEP_BATCH', 200))
+# Open holds younger than this are left to the operation watcher
+HOLD_RECHECK_AFTER = float(os.getenv('HOLD_RECHECK_AFTER', 120))
+# Submission (admission wait plus retries) never takes this long
+HOLD_ORPHAN_GRACE = float(os.getenv('HOLD_ORPHAN_GRACE', 600))
+HOLD_TTL = float(os.getenv('HOLD_TTL', 6 * 3600))
+
+# The operation itself is gone or invalid; 401/403 say nothing about it
+OPERATION_GONE_STATUSES = (400, 404)
+
+
+class HoldSweeper:
+    """Settles credit holds that no in-memory watch is going to settle.
+
+    Holds are otherwise settled by the pinned operation watch, which a
+    restart loses. On start and then every `interval` seconds this:
+
+    - refunds holds with no operation older than `orphan_grace` and any
+      hold older than `ttl`;
+    - re-checks operations of holds open longer than `recheck_after`:
+      terminal ones are settled, gone ones (404) released, and running
+      ones handed back to `watch(operation_name)`.
+
+    Every transition is guarded on status 'held', so several processes
+    sweeping the same table can't settle a hold twice.
+    """
+
+    def __init__(self, fetch_status, succeeded, watch=None, interval=HOLD_SWEEP_INTERVAL,
+                 batch_size=HOLD_SWEEP_BATCH, recheck_after=HOLD_RECHECK_AFTER,
+                 orphan_grace=HOLD_ORPHAN_GRACE, ttl=HOLD_TTL):
+        self.fetch_status = fetch_status
+        self.succeeded = succeeded
+        self.watch = watch
+        self.interval = interval
+        self.batch_size = batch_size
+        self.recheck_after = recheck_after
+        self.orphan_grace = orphan_grace
+        self.ttl = ttl
+
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._counters = {'sweeps': 0, 'settled': 0, 'released': 0, 'orphaned': 0, 'expired': 0,
+                          'rewatched': 0, 'errors': 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='hold-sweeper', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                self.sweep_once()
+            except Exception as e:
+                logger.error(f"Credit hold sweep failed: {str(e)}")
+                self._count(errors=1)
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def sweep_once(self):
+        """One pass over the open holds. Returns this pass's counts."""
+        now = datetime.utcnow()
+        counts = {'settled': 0, 'released': 0, 'rewatched': 0}
+        db = SessionLocal()
+        try:
+            counts['orphaned'], counts['expired'] = release_stale_holds(
+                db, now - timedelta(seconds=self.orphan_grace), now - timedelta(seconds=self.ttl))
+            names = open_hold_operations(db, now - timedelta(seconds=self.recheck_after), self.batch_size)
+            db.commit()
+
+            for operation_name in names:
+                try:
+                    status_code, payload = self.fetch_status(operation_name)
+                except Exception as e:
+                    logger.warning(f"Hold sweep could not check {operation_name}: {str(e)}")
+                    continue
+                if status_code == 200 and is_terminal(payload):
+                    succeeded = self.succeeded(payload)
+                    closed = settle_operation_holds(db, operation_name, succeeded)
+                    counts['settled' if succeeded else 'released'] += closed
+                elif status_code in OPERATION_GONE_STATUSES:
+                    counts['released'] += settle_operation_holds(db, operation_name, False)
+                elif status_code == 200 and self.watch is not None:
+                    self.watch(operation_name)
+                    counts['rewatched'] += 1
+                elif not is_transient(status_code):
+                    logger.warning(f"Hold sweep got {status_code} for {operation_name}; leaving its holds open")
+        finally:
+            db.close()
+
+        if any(counts.values()):
+            logger.info(f"Credit hold sweep: {counts}")
+        self._count(sweeps=1, **counts)
+        return counts
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._counters[name] += value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['running'] = self._thread is not None and self._thread.is_alive()
+        return stats
@@ -0,0 +1,106 @@
+import io
+import math
+import os
+import threading
+
+from PIL import Image, ImageOps
+
+IMAGE_PREP = os.getenv('IMAGE_PREP', '1') == '1'
+IMAGE_TARGET_SHORT_EDGE = int(os.getenv('IMAGE_TARGET_SHORT_EDGE', 720))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 90))
+
+ASPECT_RATIOS = {'16:9': (16, 9), '9:16': (9, 16)}
+
+# EXIF orientations that rotate the image by 90 degrees
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def target_size(aspect_ratio, short_edge=IMAGE_TARGET_SHORT_EDGE):
+    width, height = ASPECT_RATIOS.get(aspect_ratio, ASPECT_RATIOS['16:9'])
+    if width >= height:
+        return math.ceil(short_edge * width / height), short_edge
+    return short_edge, math.ceil(short_edge * height / width)
+
+
+def cover_scale(size, target):
+    """Scale that makes `size` just cover `target`; Veo crops to the aspect ratio itself."""
+    return max(target[0] / size[0], target[1] / size[1])
+
+
+class ImagePreprocessor:
+    """Downscales uploaded images to the Veo output resolution before forwarding.
+
+    Photos are decoded (JPEG at reduced size via draft mode), rotated per
+    EXIF, resized to just cover the target frame for the aspect ratio and
+    re-encoded without metadata. Results are stored in the blob store as
+    derived blobs of the source hash, so the same photo is processed once.
+    Images that are already small enough are forwarded untouched.
+    """
+
+    def __init__(self, store, short_edge=IMAGE_TARGET_SHORT_EDGE, quality=IMAGE_JPEG_QUALITY):
+        self.store = store
+        self.short_edge = short_edge
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._counters = {'processed': 0, 'cache_hits': 0, 'passed_through': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    def prepare(self, blob, aspect_ratio):
+        """Return a blob with the image sized for `aspect_ratio` (possibly `blob` itself)."""
+        target = target_size(aspect_ratio, self.short_edge)
+        variant = f'{target[0]}x{target[1]}q{self.quality}'
+
+        derived = self.store.get_derived(blob.digest, variant)
+        if derived is not None:
+            self._count('cache_hits', blob, derived)
+            return derived
+
+        try:
+            with Image.open(blob.path) as image:
+                data, mime_type = self._process(image, target)
+        except (Image.UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+            raise InvalidImage(f'Could not decode image: {str(e)}')
+
+        if data is None:
+            self._count('passed_through', blob, blob)
+            return blob
+        derived = self.store.put_derived(blob.digest, variant, data, mime_type)
+        self._count('processed', blob, derived)
+        return derived
+
+    def _process(self, image, target):
+        orientation = image.getexif().get(0x0112, 1)
+        upright = image.size[::-1] if orientation in TRANSPOSED_ORIENTATIONS else image.size
+        scale = cover_scale(upright, target)
+        if scale >= 1 and orientation == 1 and image.format in ('JPEG', 'PNG'):
+            return None, None
+
+        if scale < 1:
+            # JPEG decodes directly at 1/2, 1/4 or 1/8 size when that still covers the target
+            image.draft('RGB', (math.ceil(image.size[0] * scale), math.ceil(image.size[1] * scale)))
+        image = ImageOps.exif_transpose(image)
+
+        scale = cover_scale(image.size, target)
+        if scale < 1:
+            size = (max(1, round(image.size[0] * scale)), max(1, round(image.size[1] * scale)))
+            image = image.resize(size, Image.Resampling.LANCZOS)
+
+        output = io.BytesIO()
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image.save(output, format='PNG', optimize=True)
+            return output.getvalue(), 'image/png'
+        image.convert('RGB').save(output, format='JPEG', quality=self.quality, optimize=True)
+        return output.getvalue(), 'image/jpeg'
+
+    def _count(self, outcome, source, result):
+        with self._lock:
+            self._counters[outcome] += 1
+            self._counters['bytes_in'] += source.size
+            self._counters['bytes_out'] += result.size
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
@@ -0,0 +1,274 @@
+"""ffmpeg post-processing for finished videos.
+
+For every stored video of a finished operation, a worker process runs
+ffmpeg to extract a poster JPEG, remux the MP4 with +faststart (moov atom
+first, so players can start before the whole file is downloaded) and,
+optionally, encode a low-bitrate HLS rendition. Outputs live next to the
+video store under media/<sha256>/ and are built in a temporary directory
+that is renamed into place, so a video is processed once no matter how
+many operations or processes ask for it.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from video_results import DIGEST_PATTERN, video_url
+
+logger = logging.getLogger(__name__)
+
+MEDIA_PIPELINE = os.getenv('MEDIA_PIPELINE', '1') == '1'
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', 2))
+MEDIA_HLS = os.getenv('MEDIA_HLS', '0') == '1'
+MEDIA_HLS_HEIGHT = int(os.getenv('MEDIA_HLS_HEIGHT', 360))
+MEDIA_HLS_BITRATE = os.getenv('MEDIA_HLS_BITRATE', '600k')
+MEDIA_TIMEOUT = float(os.getenv('MEDIA_TIMEOUT', 300))
+MEDIA_MAX_OPERATIONS = int(os.getenv('MEDIA_MAX_OPERATIONS', 10000))
+FFMPEG_BIN = os.getenv('FFMPEG_BIN', 'ffmpeg')
+
+MANIFEST = 'manifest.json'
+POSTER = 'poster.jpg'
+FASTSTART = 'faststart.mp4'
+HLS_PLAYLIST = 'hls/index.m3u8'
+
+MEDIA_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.mp4': 'video/mp4',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+}
+
+
+def media_type(name):
+    return MEDIA_TYPES.get(os.path.splitext(name)[1], 'application/octet-stream')
+
+
+def run_ffmpeg(ffmpeg, args, timeout):
+    subprocess.run([ffmpeg, '-nostdin', '-y', '-loglevel', 'error', *args],
+                   check=True, capture_output=True, timeout=timeout)
+
+
+def process_video(source, output_dir, ffmpeg=FFMPEG_BIN, hls=MEDIA_HLS, hls_height=MEDIA_HLS_HEIGHT,
+                  hls_bitrate=MEDIA_HLS_BITRATE, timeout=MEDIA_TIMEOUT):
+    """Build poster, faststart MP4 and optional HLS for `source` into `output_dir`.
+
+    Runs in a worker process. Returns the manifest; an existing
+    `output_dir` is taken as already done.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    parent = os.path.dirname(output_dir)
+    os.makedirs(parent, exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=parent, prefix='.work-')
+    try:
+        # thumbnail picks a representative frame; the first one is often black
+        run_ffmpeg(ffmpeg, ['-i', source, '-vf', 'thumbnail', '-frames:v', '1', '-q:v', '3',
+                            os.path.join(work_dir, POSTER)], timeout)
+        run_ffmpeg(ffmpeg, ['-i', source, '-map', '0', '-c', 'copy', '-movflags', '+faststart',
+                            os.path.join(work_dir, FASTSTART)], timeout)
+        manifest = {'poster': POSTER, 'faststart': FASTSTART}
+        if hls:
+            os.makedirs(os.path.join(work_dir, 'hls'))
+            run_ffmpeg(ffmpeg, ['-i', source, '-vf', f'scale=-2:{hls_height}',
+                                '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', hls_bitrate,
+                                '-maxrate', hls_bitrate, '-bufsize', hls_bitrate,
+                                '-c:a', 'aac', '-b:a', '64k',
+                                '-f', 'hls', '-hls_time', '4', '-hls_playlist_type', 'vod',
+                                '-hls_segment_filename', os.path.join(work_dir, 'hls', 'seg_%03d.ts'),
+                                os.path.join(work_dir, HLS_PLAYLIST)], timeout)
+            manifest['hls'] = HLS_PLAYLIST
+        with open(os.path.join(work_dir, MANIFEST), 'w') as f:
+            json.dump(manifest, f)
+        try:
+            os.rename(work_dir, output_dir)
+        except OSError:
+            # Another worker finished the same video first
+            if not os.path.exists(manifest_path):
+                raise
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return manifest
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+
+class MediaPipeline:
+    """Runs process_video() for finished operations on a bounded process pool.
+
+    submit() only queues work, once per operation; videos already
+    processed or in progress are not queued again. annotate() adds the
+    poster/faststart/HLS URLs to an operation payload once they exist.
+    """
+
+    def __init__(self, store, workers=MEDIA_WORKERS, hls=MEDIA_HLS, ffmpeg=FFMPEG_BIN, executor=None):
+        self.store = store
+        self.root = os.path.join(store.root, 'media')
+        self.workers = workers
+        self.hls = hls
+        self.ffmpeg = ffmpeg
+
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._operations = OrderedDict()
+        self._running = {}
+        self._manifests = {}
+        self._failed = set()
+        self._counters = {'operations': 0, 'duplicate_operations': 0, 'jobs': 0, 'already_processed': 0,
+                          'coalesced': 0, 'completed': 0, 'failed': 0}
+        store.evict_listeners.append(self.forget)
+
+    @property
+    def available(self):
+        return shutil.which(self.ffmpeg) is not None
+
+    def media_dir(self, digest):
+        return os.path.join(self.root, digest)
+
+    def submit(self, operation_name, payload):
+        """Queue post-processing for the stored videos of a finished operation."""
+        digests = [video['sha256'] for video in stored_videos(payload)]
+        jobs = []
+        with self._lock:
+            if operation_name in self._operations:
+                self._counters['duplicate_operations'] += 1
+                return
+            self._operations[operation_name] = digests
+            while len(self._operations) > MEDIA_MAX_OPERATIONS:
+                self._operations.popitem(last=False)
+            self._counters['operations'] += 1
+
+            for digest in digests:
+                if digest in self._running:
+                    self._counters['coalesced'] += 1
+                elif self._manifest(digest) is not None:
+                    self._counters['already_processed'] += 1
+                else:
+                    self._failed.discard(digest)
+                    self._running[digest] = None
+                    self._counters['jobs'] += 1
+                    jobs.append(digest)
+
+        for digest in jobs:
+            try:
+                future = self._pool().submit(process_video, self.store.path(digest), self.media_dir(digest),
+                                             self.ffmpeg, self.hls)
+            except Exception as e:
+                self._finish(digest, None, e)
+                continue
+            future.add_done_callback(lambda future, digest=digest: self._done(digest, future))
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the app has threads and open sockets
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _done(self, digest, future):
+        try:
+            self._finish(digest, future.result(), None)
+        except Exception as e:
+            self._finish(digest, None, e)
+
+    def _finish(self, digest, manifest, error):
+        with self._lock:
+            self._running.pop(digest, None)
+            if error is None:
+                self._manifests[digest] = manifest
+                self._counters['completed'] += 1
+            else:
+                self._failed.add(digest)
+                self._counters['failed'] += 1
+        if error is not None:
+            detail = getattr(error, 'stderr', None) or str(error)
+            logger.error(f"Media processing failed for video {digest}: {detail}")
+
+    def _manifest(self, digest):
+        manifest = self._manifests.get(digest)
+        if manifest is None:
+            try:
+                with open(os.path.join(self.media_dir(digest), MANIFEST)) as f:
+                    manifest = json.load(f)
+            except (FileNotFoundError, ValueError):
+                return None
+            self._manifests[digest] = manifest
+        return manifest
+
+    def forget(self, digest):
+        """Drop what's cached about a video the store evicted along with its media dir."""
+        with self._lock:
+            self._manifests.pop(digest, None)
+            self._failed.discard(digest)
+
+    def status(self, digest):
+        """'ready', 'processing', 'failed' or None for a video never submitted."""
+        with self._lock:
+            if self._manifest(digest) is not None:
+                return 'ready'
+            if digest in self._running:
+                return 'processing'
+            if digest in self._failed:
+                return 'failed'
+        return None
+
+    def annotate(self, payload):
+        """Copy of `payload` whose stored videos carry a `media` entry with their derived URLs."""
+        if not stored_videos(payload):
+            return payload
+        videos = []
+        for video in payload['response']['videos']:
+            if 'sha256' in video and DIGEST_PATTERN.match(str(video['sha256'])):
+                video = {**video, 'media': self.media_info(video['sha256'])}
+            videos.append(video)
+        return {**payload, 'response': {**payload['response'], 'videos': videos}}
+
+    def media_info(self, digest):
+        with self._lock:
+            manifest = self._manifest(digest)
+            status = 'ready' if manifest else 'processing' if digest in self._running else \
+                'failed' if digest in self._failed else 'pending'
+        info = {'status': status}
+        if manifest:
+            info['posterUrl'] = f"{video_url(digest)}/{manifest['poster']}"
+            info['faststartUrl'] = f"{video_url(digest)}/{manifest['faststart']}"
+            if 'hls' in manifest:
+                info['hlsUrl'] = f"{video_url(digest)}/{manifest['hls']}"
+        return info
+
+    def file_path(self, digest, name):
+        """Path of a derived file, or None if it doesn't exist or `name` escapes the media dir."""
+        if not DIGEST_PATTERN.match(digest):
+            return None
+        base = self.media_dir(digest)
+        path = os.path.normpath(os.path.join(base, name))
+        if not path.startswith(base + os.sep) or os.path.basename(path) == MANIFEST or not os.path.isfile(path):
+            return None
+        return path
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['running'] = len(self._running)
+        return stats
+
+
+def stored_videos(payload):
+    """Videos of a terminal payload that extract_videos() moved into the video store."""
+    if not isinstance(payload, dict):
+        return []
+    videos = (payload.get('response') or {}).get('videos') or []
+    return [video for video in videos if isinstance(video, dict) and 'sha256' in video]
@@ -0,0 +1,122 @@
+"""Prometheus metrics for the proxy, served at /metrics.
+
+Everything here is a counter or histogram update (a dict lookup and a
+lock), so it stays on in the hot path. Label values are bounded: Flask
+url rules rather than raw paths, model ids and verbs, endpoint names.
+"""
+import time
+
+from flask import g, has_request_context, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests handled',
+                        ['route', 'method', 'status'])
+HTTP_LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency',
+                         ['route', 'method'])
+UPSTREAM_REQUESTS = Counter('vertex_upstream_requests_total', 'Vertex AI calls by outcome',
+                            ['model', 'verb', 'status'])
+UPSTREAM_LATENCY = Histogram('vertex_upstream_duration_seconds', 'Vertex AI call latency',
+                             ['model', 'verb'],
+                             buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+UPSTREAM_CIRCUIT_STATE = Gauge('vertex_upstream_circuit_state',
+                               'Circuit breaker state (0 closed, 1 half-open, 2 open)', ['model', 'verb'])
+UPSTREAM_CIRCUIT_REJECTED = Counter('vertex_upstream_circuit_rejected_total',
+                                    'Calls failed fast by an open circuit breaker', ['model', 'verb'])
+UPSTREAM_HEDGES = Counter('vertex_upstream_hedges_total',
+                          'Hedged second requests by outcome (sent, won)', ['model', 'verb', 'outcome'])
+DB_QUERY_LATENCY = Histogram('db_query_duration_seconds', 'Database statement time by endpoint',
+                             ['endpoint'],
+                             buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 5))
+WEBHOOK_EVENTS = Counter('webhook_events_total', 'RevenueCat webhook outcomes', ['outcome'])
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+CIRCUIT_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+def observe_request(route, method, status, seconds):
+    HTTP_REQUESTS.labels(route, method, str(status)).inc()
+    HTTP_LATENCY.labels(route, method).observe(seconds)
+
+
+def observe_upstream(model_id, verb, status, seconds):
+    """`status` is the HTTP status code, or 'timeout' / 'error' when no response arrived."""
+    UPSTREAM_REQUESTS.labels(model_id, verb, str(status)).inc()
+    UPSTREAM_LATENCY.labels(model_id, verb).observe(seconds)
+
+
+def observe_circuit_state(model_id, verb, state):
+    UPSTREAM_CIRCUIT_STATE.labels(model_id, verb).set(CIRCUIT_STATES[state])
+
+
+def observe_circuit_rejected(model_id, verb):
+    UPSTREAM_CIRCUIT_REJECTED.labels(model_id, verb).inc()
+
+
+def observe_hedge(model_id, verb, outcome):
+    UPSTREAM_HEDGES.labels(model_id, verb, outcome).inc()
+
+
+def observe_webhook(outcome):
+    WEBHOOK_EVENTS.labels(outcome).inc()
+
+
+def instrument_flask(app):
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            observe_request(route, request.method, response.status_code, time.perf_counter() - started)
+        return response
+
+
+def db_endpoint():
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'background'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_query_time(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    DB_QUERY_LATENCY.labels(db_endpoint()).observe(time.perf_counter() - started)
+
+
+class StatsCollector:
+    """Exports numeric values from a stats() dict (e.g. the DB pool) at scrape time."""
+
+    def __init__(self, prefix, stats, counters=()):
+        self.prefix = prefix
+        self.stats = stats
+        self.counters = set(counters)
+
+    def collect(self):
+        for key, value in self.stats().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f'{self.prefix}_{key}'
+            if key in self.counters:
+                yield CounterMetricFamily(name, key.replace('_', ' '), value=value)
+            else:
+                yield GaugeMetricFamily(name, key.replace('_', ' '), value=value)
+
+
+def register_stats(prefix, stats, counters=()):
+    REGISTRY.register(StatsCollector(prefix, stats, counters))
+
+
+def render():
+    return generate_latest(REGISTRY)
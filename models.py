@@ -1,8 +1,12 @@
-from sqlalchemy import create_engine, Column, String, DateTime, Boolean, JSON, Integer
+from sqlalchemy import create_engine, Column, String, DateTime, Boolean, JSON, Integer, Uuid, Index
+from sqlalchemy.exc import TimeoutError as PoolTimeout
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.pool import QueuePool
+from contextlib import contextmanager
 from datetime import datetime
+import threading
+import time
 import uuid
 import os
 from dotenv import load_dotenv
@@ -10,8 +14,70 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DATABASE_URL = os.getenv('DATABASE_URL', '')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
 
-engine = create_engine(DATABASE_URL)
+
+class PoolMetrics:
+    """Checkout wait times and timeouts, shared by every InstrumentedQueuePool.
+
+    Module-level because engine.dispose() replaces the pool instance.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {'checkouts': 0, 'timeouts': 0, 'wait_seconds_total': 0.0, 'wait_seconds_max': 0.0}
+
+    def record(self, waited, timed_out=False):
+        with self._lock:
+            self._counters['timeouts' if timed_out else 'checkouts'] += 1
+            self._counters['wait_seconds_total'] += waited
+            self._counters['wait_seconds_max'] = max(self._counters['wait_seconds_max'], waited)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long callers wait for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            pool_metrics.record(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_metrics.record(time.perf_counter() - started)
+        return connection
+
+
+def engine_options(url):
+    """create_engine() keyword arguments for `url`, from the DB_* settings."""
+    if url.startswith('sqlite'):
+        return {}
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+    if DB_STATEMENT_TIMEOUT_MS and url.startswith('postgresql'):
+        options['connect_args'] = {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'}
+    return options
+
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -19,7 +85,7 @@ Base = declarative_base()
 class User(Base):
     __tablename__ = "users"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
     credits = Column(Integer, default=0, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     
@@ -35,13 +101,74 @@ class WebhookEvent(Base):
     event_timestamp = Column(DateTime, nullable=False)
     payload = Column(JSON, nullable=False)
     processed = Column(Boolean, default=False)
+    # Credits this event has added so far; replays apply only the difference
+    credits_granted = Column(Integer, default=0, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class WebhookQueueItem(Base):
+    __tablename__ = "webhook_queue"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    payload = Column(JSON, nullable=False)
+    received_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(String)
+
+class CreditHold(Base):
+    __tablename__ = "credit_holds"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    app_user_id = Column(Uuid(as_uuid=True), nullable=False, index=True)
+    amount = Column(Integer, nullable=False)
+    operation_name = Column(String, index=True)
+    status = Column(String, nullable=False, default='held')
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # The hold sweeper looks for open holds by age
+    __table_args__ = (
+        Index('ix_credit_holds_status_created_at', 'status', 'created_at'),
+    )
+
+class Operation(Base):
+    __tablename__ = "operations"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, unique=True, nullable=False)
+    # NULL for generations submitted without an app_user_id
+    app_user_id = Column(Uuid(as_uuid=True))
+    model = Column(String, nullable=False)
+    params_hash = Column(String(64), nullable=False)
+    status = Column(String, nullable=False, default='running')
+    result_uri = Column(String)
+    error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Keyset pagination of a user's history, newest first; id breaks created_at ties
+    __table_args__ = (
+        Index('ix_operations_app_user_id_created_at', 'app_user_id', 'created_at', 'id'),
+    )
+
 # Base.metadata.create_all(bind=engine)  # Tables will be created by Alembic migrations
 
-def get_db():
+@contextmanager
+def db_session():
+    """Session for one unit of work; always closed (and rolled back if uncommitted) on exit."""
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def pool_stats():
+    """Current pool occupancy plus cumulative checkout wait metrics."""
+    pool = SessionLocal.kw['bind'].pool
+    stats = pool_metrics.stats()
+    stats['pool'] = type(pool).__name__
+    if isinstance(pool, QueuePool):
+        stats['size'] = pool.size()
+        stats['checked_out'] = pool.checkedout()
+        stats['checked_in'] = pool.checkedin()
+        stats['overflow'] = max(pool.overflow(), 0)
+    return stats
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+OPERATION_PENDING_TTL = float(os.getenv('OPERATION_PENDING_TTL', 2))
+OPERATION_PENDING_MAX_ENTRIES = int(os.getenv('OPERATION_PENDING_MAX_ENTRIES', 10000))
+OPERATION_TERMINAL_MAX_ENTRIES = int(os.getenv('OPERATION_TERMINAL_MAX_ENTRIES', 5000))
+
+
+def is_terminal(result):
+    return isinstance(result, dict) and (result.get('done') is True or 'error' in result)
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class OperationStatusCache:
+    """Status cache for long-running Veo operations, keyed by operation name.
+
+    Pending statuses are served for `pending_ttl` seconds, terminal statuses
+    (done or failed) are kept in a bounded LRU and never fetched again.
+    Concurrent misses for the same operation share a single upstream call.
+    """
+
+    def __init__(self, pending_ttl=OPERATION_PENDING_TTL,
+                 pending_max_entries=OPERATION_PENDING_MAX_ENTRIES,
+                 terminal_max_entries=OPERATION_TERMINAL_MAX_ENTRIES):
+        self.pending_ttl = pending_ttl
+        self.pending_max_entries = pending_max_entries
+        self.terminal_max_entries = terminal_max_entries
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._terminal = OrderedDict()
+        self._inflight = {}
+        self._async_inflight = {}
+        self._listeners = []
+        self._transforms = []
+        self._counters = {'hits': 0, 'terminal_hits': 0, 'misses': 0, 'coalesced': 0, 'upstream_calls': 0}
+
+    def get(self, operation_name, fetch):
+        """Return (status_code, payload) for the operation.
+
+        `fetch` is called with no arguments on a miss and must return
+        (status_code, payload); only 200 responses are cached.
+        """
+        with self._lock:
+            cached = self._lookup(operation_name)
+            if cached is not None:
+                return cached
+
+            call = self._inflight.get(operation_name)
+            if call is not None:
+                self._counters['coalesced'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._inflight[operation_name] = call
+                self._counters['misses'] += 1
+                self._counters['upstream_calls'] += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fetch()
+            status_code, payload = call.result
+            if status_code == 200:
+                call.result = status_code, self.put(operation_name, payload)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(operation_name, None)
+            call.event.set()
+        return call.result
+
+    async def aget(self, operation_name, fetch):
+        """Event-loop variant of get(); `fetch` is a coroutine function."""
+        with self._lock:
+            cached = self._lookup(operation_name)
+            if cached is not None:
+                return cached
+            future = self._async_inflight.get(operation_name)
+            if future is not None:
+                self._counters['coalesced'] += 1
+            else:
+                self._counters['misses'] += 1
+                self._counters['upstream_calls'] += 1
+
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._async_inflight[operation_name] = future
+        try:
+            result = await fetch()
+            if result[0] == 200:
+                if is_terminal(result[1]) and self._transforms:
+                    # Transforms do disk I/O; keep them off the event loop
+                    stored = await asyncio.get_running_loop().run_in_executor(
+                        None, self.put, operation_name, result[1])
+                else:
+                    stored = self.put(operation_name, result[1])
+                result = result[0], stored
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so a leader-only failure doesn't log "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._async_inflight.pop(operation_name, None)
+
+    def peek(self, operation_name):
+        with self._lock:
+            return self._lookup(operation_name, count=False)
+
+    def add_listener(self, listener):
+        """Call `listener(operation_name, payload)` when an operation is first seen terminal.
+
+        Listeners run on the caller's thread (possibly the event loop), so
+        they must hand any blocking work off to an executor.
+        """
+        self._listeners.append(listener)
+
+    def add_transform(self, transform):
+        """Rewrite terminal payloads once before they are cached: `transform(operation_name, payload)`.
+
+        Used to move large results (e.g. inline video bytes) out of the
+        payload so they aren't re-sent on every poll. Runs off the event loop.
+        """
+        self._transforms.append(transform)
+
+    def put(self, operation_name, payload):
+        """Cache a 200 status and return the payload as stored (terminal ones transformed)."""
+        if is_terminal(payload) and self._transforms:
+            with self._lock:
+                stored = self._terminal.get(operation_name)
+            if stored is not None:
+                return stored
+            for transform in self._transforms:
+                try:
+                    payload = transform(operation_name, payload)
+                except Exception as e:
+                    logger.error(f"Terminal transform failed for {operation_name}: {str(e)}")
+
+        newly_terminal = False
+        with self._lock:
+            if is_terminal(payload):
+                newly_terminal = operation_name not in self._terminal
+                self._pending.pop(operation_name, None)
+                self._terminal[operation_name] = payload
+                self._terminal.move_to_end(operation_name)
+                while len(self._terminal) > self.terminal_max_entries:
+                    self._terminal.popitem(last=False)
+            else:
+                if len(self._pending) >= self.pending_max_entries:
+                    self._purge_expired()
+                self._pending[operation_name] = (time.monotonic() + self.pending_ttl, payload)
+
+        if newly_terminal:
+            for listener in self._listeners:
+                listener(operation_name, payload)
+        return payload
+
+    def _lookup(self, operation_name, count=True):
+        payload = self._terminal.get(operation_name)
+        if payload is not None:
+            self._terminal.move_to_end(operation_name)
+            if count:
+                self._counters['terminal_hits'] += 1
+            return 200, payload
+
+        entry = self._pending.get(operation_name)
+        if entry is not None:
+            expires_at, payload = entry
+            if time.monotonic() < expires_at:
+                if count:
+                    self._counters['hits'] += 1
+                return 200, payload
+            del self._pending[operation_name]
+        return None
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for name in [name for name, (expires_at, _) in self._pending.items() if expires_at <= now]:
+            del self._pending[name]
+        while len(self._pending) >= self.pending_max_entries:
+            self._pending.pop(next(iter(self._pending)))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['pending_entries'] = len(self._pending)
+            stats['terminal_entries'] = len(self._terminal)
+            stats['in_flight'] = len(self._inflight) + len(self._async_inflight)
+        return stats
@@ -0,0 +1,93 @@
+import base64
+import binascii
+from datetime import datetime
+
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.orm import Session
+
+from models import Operation
+
+OPERATION_RUNNING = 'running'
+OPERATION_SUCCEEDED = 'succeeded'
+OPERATION_FAILED = 'failed'
+
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def record_operation(db: Session, name, user_uuid, model_id, params_hash):
+    """Add a running operation to the user's history. Does not commit."""
+    db.add(Operation(name=name, app_user_id=user_uuid, model=model_id,
+                     params_hash=params_hash, status=OPERATION_RUNNING))
+
+
+def result_uri(payload):
+    """Where the first video of a finished operation can be fetched from."""
+    for video in (payload.get('response') or {}).get('videos') or []:
+        uri = video.get('url') or video.get('gcsUri')
+        if uri:
+            return uri
+    return None
+
+
+def finish_operation(db: Session, name, payload, succeeded):
+    """Record the terminal status of an operation. Only the first call for an operation has any effect."""
+    if succeeded:
+        values = {'status': OPERATION_SUCCEEDED, 'result_uri': result_uri(payload)}
+    else:
+        error = payload.get('error') or {}
+        values = {'status': OPERATION_FAILED,
+                  'error': error.get('message') if isinstance(error, dict) else str(error)}
+    finished = db.execute(
+        update(Operation)
+        .where(Operation.name == name, Operation.status == OPERATION_RUNNING)
+        .values(updated_at=datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return finished
+
+
+def encode_cursor(operation):
+    return base64.urlsafe_b64encode(f'{operation.created_at.isoformat()}|{operation.id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, operation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(operation_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor(str(e))
+
+
+def list_operations(db: Session, user_uuid, limit, cursor=None):
+    """One page of a user's operations, newest first. Returns (operations, next_cursor).
+
+    Keyset pagination over (app_user_id, created_at, id): each page is a
+    single range scan of the index starting after the cursor, however
+    deep into the history it is.
+    """
+    query = select(Operation).where(Operation.app_user_id == user_uuid)
+    if cursor is not None:
+        query = query.where(tuple_(Operation.created_at, Operation.id) < decode_cursor(cursor))
+    rows = db.execute(
+        query.order_by(Operation.created_at.desc(), Operation.id.desc()).limit(limit + 1)
+    ).scalars().all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def operation_summary(operation):
+    return {
+        'name': operation.name,
+        'model': operation.model,
+        'params_hash': operation.params_hash,
+        'status': operation.status,
+        'result_uri': operation.result_uri,
+        'error': operation.error,
+        'created_at': operation.created_at.isoformat(),
+        'updated_at': operation.updated_at.isoformat() if operation.updated_at else None,
+    }
@@ -0,0 +1,186 @@
+import logging
+import os
+import threading
+import time
+
+from operation_cache import is_terminal
+
+logger = logging.getLogger(__name__)
+
+WATCH_MIN_INTERVAL = float(os.getenv('WATCH_MIN_INTERVAL', 2))
+WATCH_MAX_INTERVAL = float(os.getenv('WATCH_MAX_INTERVAL', 10))
+WATCH_BACKOFF = float(os.getenv('WATCH_BACKOFF', 1.5))
+WATCH_IDLE_TIMEOUT = float(os.getenv('WATCH_IDLE_TIMEOUT', 30))
+
+
+def is_transient(status_code):
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+class _Watch:
+    def __init__(self, operation_name, lock, state):
+        self.operation_name = operation_name
+        self.cond = threading.Condition(lock)
+        self.state = state
+        self.version = 0
+        self.finished = False
+        self.waiters = 0
+        self.subscribers = []
+        self.pinned = False
+        self.last_interest = time.monotonic()
+
+
+class OperationWatcher:
+    """One background poller per live operation, shared by every waiter.
+
+    `fetch_status(operation_name)` returns (status_code, payload). Each watch
+    thread polls on an exponential schedule between `min_interval` and
+    `max_interval` (reset whenever the status changes), wakes its waiters on
+    change and exits once the operation is terminal or nobody is interested.
+    A watch that ends on a non-transient error status calls
+    `on_error(operation_name, status_code, payload)`.
+    """
+
+    def __init__(self, fetch_status, min_interval=WATCH_MIN_INTERVAL, max_interval=WATCH_MAX_INTERVAL,
+                 backoff=WATCH_BACKOFF, idle_timeout=WATCH_IDLE_TIMEOUT, on_error=None):
+        self.fetch_status = fetch_status
+        self.on_error = on_error
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+
+        self._lock = threading.Lock()
+        self._watches = {}
+        self._counters = {'watches_started': 0, 'polls': 0, 'changes': 0}
+
+    def wait_for_change(self, operation_name, timeout):
+        """Return the operation status once it differs from the current one, or after `timeout` seconds."""
+        status_code, payload = self.fetch_status(operation_name)
+        if status_code != 200 or is_terminal(payload):
+            return status_code, payload
+
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            watch = self._watch(operation_name, (status_code, payload))
+            if watch.state != (status_code, payload):
+                return watch.state
+            version = watch.version
+            watch.waiters += 1
+            try:
+                while watch.version == version and not watch.finished:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    watch.cond.wait(remaining)
+                return watch.state
+            finally:
+                watch.waiters -= 1
+                watch.last_interest = time.monotonic()
+
+    def subscribe(self, operation_name, state, callback):
+        """Call `callback(status_code, payload)` from the watch thread on every status change.
+
+        `state` is the status the subscriber already has. Returns an
+        unsubscribe function.
+        """
+        with self._lock:
+            watch = self._watch(operation_name, state)
+            watch.subscribers.append(callback)
+            current = watch.state
+
+        if current is not None and current != state:
+            callback(*current)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in watch.subscribers:
+                    watch.subscribers.remove(callback)
+                watch.last_interest = time.monotonic()
+
+        return unsubscribe
+
+    def watch_until_done(self, operation_name):
+        """Keep polling an operation until it is terminal, even with nobody waiting on it.
+
+        The watch starts with an unknown (None) state, which the first
+        waiter or subscriber replaces with the status it already has.
+        """
+        with self._lock:
+            self._watch(operation_name, None).pinned = True
+
+    def _watch(self, operation_name, state):
+        # Caller holds self._lock
+        watch = self._watches.get(operation_name)
+        if watch is None:
+            watch = _Watch(operation_name, self._lock, state)
+            self._watches[operation_name] = watch
+            self._counters['watches_started'] += 1
+            threading.Thread(target=self._run, args=(watch,), name=f'watch-{operation_name[-12:]}',
+                             daemon=True).start()
+        elif watch.state is None and state is not None:
+            # A pinned watch that hasn't polled yet: take the caller's fresher status
+            watch.state = state
+        watch.last_interest = time.monotonic()
+        return watch
+
+    def _run(self, watch):
+        interval = self.min_interval
+        while True:
+            time.sleep(interval)
+            try:
+                status_code, payload = self.fetch_status(watch.operation_name)
+            except Exception as e:
+                logger.warning(f"Polling {watch.operation_name} failed: {str(e)}")
+                status_code, payload = None, None
+
+            changed = False
+            failed = False
+            with self._lock:
+                self._counters['polls'] += 1
+                if not is_transient(status_code) and (status_code, payload) != watch.state:
+                    watch.state = (status_code, payload)
+                    watch.version += 1
+                    self._counters['changes'] += 1
+                    watch.cond.notify_all()
+                    changed = True
+                    interval = self.min_interval
+                else:
+                    interval = min(interval * self.backoff, self.max_interval)
+                subscribers = list(watch.subscribers)
+
+                if not is_transient(status_code) and (status_code != 200 or is_terminal(payload)):
+                    watch.finished = True
+                    failed = status_code != 200
+                elif not self._interested(watch):
+                    watch.finished = True
+
+                if watch.finished:
+                    watch.cond.notify_all()
+                    self._watches.pop(watch.operation_name, None)
+
+            if changed:
+                for callback in subscribers:
+                    try:
+                        callback(status_code, payload)
+                    except Exception as e:
+                        logger.warning(f"Watch subscriber for {watch.operation_name} failed: {str(e)}")
+            if failed and self.on_error is not None:
+                try:
+                    self.on_error(watch.operation_name, status_code, payload)
+                except Exception as e:
+                    logger.warning(f"Error handler for {watch.operation_name} failed: {str(e)}")
+            if watch.finished:
+                return
+
+    def _interested(self, watch):
+        return (watch.pinned or watch.waiters > 0 or watch.subscribers
+                or time.monotonic() - watch.last_interest < self.idle_timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['active_watches'] = len(self._watches)
+            stats['waiters'] = sum(watch.waiters for watch in self._watches.values())
+            stats['subscribers'] = sum(len(watch.subscribers) for watch in self._watches.values())
+        return stats
@@ -0,0 +1,116 @@
+"""Structured, non-blocking logging of proxied requests and responses.
+
+log_event() only enqueues the record; redaction, hashing and JSON
+encoding happen on a background QueueListener thread, which writes one
+compact JSON line per event. Payloads handed to log_event() must not be
+mutated afterwards. When the queue is full, events are dropped and
+counted instead of blocking the request.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_MAX_FIELD_CHARS = int(os.getenv('LOG_MAX_FIELD_CHARS', 256))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+# Binary content is never logged, only its size and a hash prefix
+REDACTED_FIELDS = {'bytesBase64Encoded'}
+
+events = logging.getLogger('vertex_proxy.events')
+events.setLevel(logging.INFO)
+events.propagate = False
+
+
+def fingerprint(value):
+    if isinstance(value, bytes):
+        return {'redacted': True, 'size': len(value), 'sha256': hashlib.sha256(value).hexdigest()[:16]}
+    # Hash in slices so a multi-megabyte base64 string is never copied whole
+    value = str(value)
+    sha256 = hashlib.sha256()
+    for start in range(0, len(value), 65536):
+        sha256.update(value[start:start + 65536].encode())
+    return {'redacted': True, 'size': len(value), 'sha256': sha256.hexdigest()[:16]}
+
+
+def summarize(value, max_chars=LOG_MAX_FIELD_CHARS):
+    """Copy of a JSON-like value with binary fields replaced and long strings truncated."""
+    if isinstance(value, dict):
+        return {key: fingerprint(item) if key in REDACTED_FIELDS else summarize(item, max_chars)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [summarize(item, max_chars) for item in value]
+    if isinstance(value, bytes):
+        return fingerprint(value)
+    if isinstance(value, str) and len(value) > max_chars:
+        return {'truncated': value[:max_chars], 'size': len(value)}
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        line = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'event': record.getMessage(),
+        }
+        line.update(summarize(getattr(record, 'fields', {})))
+        return json.dumps(line, separators=(',', ':'), default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting is the expensive part; leave it to the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+
+
+def configure(stream=None, queue_size=LOG_QUEUE_SIZE):
+    """(Re)build the queue and listener. Stopping the old listener flushes it."""
+    global _handler, _listener
+    if _listener is not None:
+        _listener.stop()
+    if _handler is not None:
+        events.removeHandler(_handler)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    _handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+    events.addHandler(_handler)
+    _listener = QueueListener(_handler.queue, output)
+    _listener.start()
+
+
+def log_event(event, **fields):
+    events.info(event, extra={'fields': fields})
+
+
+def stats():
+    return {'queued': _handler.queue.qsize(), 'dropped': _handler.dropped}
+
+
+def _shutdown():
+    if _listener is not None:
+        _listener.stop()
+
+
+configure()
+atexit.register(_shutdown)
@@ -0,0 +1,229 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'test-token')
+
+import requests
+
+import app as proxy
+import async_app
+from admission import AdmissionRejected, AdmissionScheduler, TokenBucket
+from fake_vertex import start_fake_vertex
+from test_async_app import start_server, use_fake_vertex
+from upstream import VertexClient
+
+
+class Reply:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_users_are_served_round_robin():
+    scheduler = AdmissionScheduler(max_concurrency=1, max_wait=10)
+    release = threading.Event()
+    order = []
+
+    def send(label):
+        def call():
+            order.append(label)
+            if label == 'heavy-0':
+                release.wait()
+            return Reply(200)
+        return call
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        first = pool.submit(scheduler.run, 'heavy', send('heavy-0'))
+        wait_until(lambda: order == ['heavy-0'])
+        heavy = [pool.submit(scheduler.run, 'heavy', send(f'heavy-{i}')) for i in range(1, 5)]
+        wait_until(lambda: scheduler.stats()['queued'] == 4)
+        light = pool.submit(scheduler.run, 'light', send('light-0'))
+        wait_until(lambda: scheduler.stats()['queued'] == 5)
+        release.set()
+        results = [future.result() for future in [first, light, *heavy]]
+
+    # The light user's request overtakes the heavy user's backlog
+    assert order[:3] == ['heavy-0', 'heavy-1', 'light-0']
+    assert results[1][1]['position'] == 2
+    assert all(response.status_code == 200 for response, _ in results)
+
+
+def test_retries_throttled_calls_with_backoff():
+    scheduler = AdmissionScheduler(max_retries=3, backoff_base=0.01, backoff_max=0.05)
+    replies = iter([Reply(429), Reply(503, {'Retry-After': '0'}), Reply(200)])
+    response, info = scheduler.run('user', lambda: next(replies))
+    assert response.status_code == 200
+    assert info['retries'] == 2
+    assert scheduler.stats()['upstream_throttled'] == 1
+
+    response, info = scheduler.run('user', lambda: Reply(429))
+    assert response.status_code == 429
+    assert info['retries'] == 3
+
+
+def test_token_bucket_paces_and_pauses():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, burst=2, clock=lambda: now[0])
+    bucket.take()
+    bucket.take()
+    assert bucket.delay() == 0.5
+    now[0] = 0.5
+    assert bucket.delay() == 0
+    bucket.pause(3)
+    assert bucket.delay() == 3
+    now[0] = 3.5
+    # Nothing accrued during the pause
+    assert bucket.delay() == 0.5
+    assert bucket.eta(3) == 1.5
+
+
+def test_burst_against_a_quota_limited_upstream(monkeypatch):
+    fake = start_fake_vertex(quota=4, quota_window=1.0)
+    monkeypatch.setattr(proxy, 'vertex', VertexClient(proxy.PROJECT_ID, proxy.LOCATION, base_url=fake.base_url))
+    monkeypatch.setattr(proxy, 'admission', AdmissionScheduler(rate_per_minute=180, burst=1, max_wait=30,
+                                                               backoff_base=0.2, backoff_max=1))
+    client = proxy.app.test_client()
+
+    def submit(i):
+        return client.post('/generate-video', json={'prompt': f'burst {i}'},
+                           headers={'X-Forwarded-For': f'10.0.0.{i % 3}'})
+
+    try:
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            responses = list(pool.map(submit, range(12)))
+    finally:
+        proxy.vertex.close()
+        fake.stop()
+
+    assert [response.status_code for response in responses] == [200] * 12
+    assert fake.requests['predictLongRunning'] - fake.throttled == 12
+    # The bucket keeps us at the quota, so the upstream rarely (if ever) says no
+    assert fake.throttled <= 2
+    queue = responses[-1].get_json()['queue']
+    assert set(queue) == {'position', 'eta_seconds', 'waited_ms', 'retries'}
+
+
+def test_requests_beyond_the_wait_budget_are_told_when_to_retry(monkeypatch):
+    fake = start_fake_vertex()
+    monkeypatch.setattr(proxy, 'vertex', VertexClient(proxy.PROJECT_ID, proxy.LOCATION, base_url=fake.base_url))
+    monkeypatch.setattr(proxy, 'admission', AdmissionScheduler(rate_per_minute=6, burst=1, max_wait=5))
+    client = proxy.app.test_client()
+    try:
+        assert client.post('/generate-video', json={'prompt': 'first'}).status_code == 200
+        rejected = client.post('/generate-video', json={'prompt': 'second'})
+    finally:
+        proxy.vertex.close()
+        fake.stop()
+
+    assert rejected.status_code == 429
+    body = rejected.get_json()
+    assert body['error'] == 'Generation queue is full'
+    assert body['queue_position'] == 1
+    assert 5 < body['eta_seconds'] <= 10
+    assert int(rejected.headers['Retry-After']) >= 6
+    assert fake.requests['predictLongRunning'] == 1
+
+
+def test_rejection_carries_position_and_eta():
+    scheduler = AdmissionScheduler(max_queue_per_user=0)
+    try:
+        scheduler.run('user', lambda: Reply(200))
+    except AdmissionRejected as e:
+        assert e.position == 1
+        assert e.retry_after >= 1
+    else:
+        raise AssertionError('expected AdmissionRejected')
+
+
+def test_async_waiters_are_admitted_on_the_event_loop():
+    scheduler = AdmissionScheduler(max_concurrency=2, max_wait=10)
+    sent_from = set()
+    active = [0, 0]
+
+    async def send():
+        sent_from.add(threading.current_thread().name)
+        active[0] += 1
+        active[1] = max(active)
+        await asyncio.sleep(0.05)
+        active[0] -= 1
+        return Reply(200)
+
+    async def burst():
+        return await asyncio.gather(*(scheduler.run_async(f'user-{i % 3}', send) for i in range(12)))
+
+    threads_before = threading.active_count()
+    results = asyncio.run(burst())
+    assert all(response.status_code == 200 for response, _ in results)
+    assert sent_from == {threading.current_thread().name}
+    assert active[1] == 2
+    # Only the dispatcher thread was added, however many callers queued
+    assert threading.active_count() <= threads_before + 1
+    assert scheduler.stats()['active'] == 0 and scheduler.stats()['queued'] == 0
+
+
+def test_cancelled_async_waiter_gives_up_its_place():
+    scheduler = AdmissionScheduler(max_concurrency=1, max_wait=10)
+    release = None
+
+    async def slow():
+        await release.wait()
+        return Reply(200)
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.ensure_future(scheduler.run_async('a', slow))
+        queued = asyncio.ensure_future(scheduler.run_async('b', slow))
+        while scheduler.stats()['queued'] != 1:
+            await asyncio.sleep(0.01)
+        queued.cancel()
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()['queued'] == 0
+        release.set()
+        return await first
+
+    response, _ = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert scheduler.stats()['active'] == 0
+
+
+def test_queued_async_submissions_leave_wsgi_threads_free(monkeypatch):
+    fake = start_fake_vertex(latency=1.0)
+    use_fake_vertex(fake, monkeypatch)
+    monkeypatch.setattr(proxy, 'ADMISSION_SCHEDULER', True)
+    monkeypatch.setattr(proxy, 'admission', AdmissionScheduler(max_concurrency=2, max_wait=30))
+    base_url, loop, runner = start_server(async_app.create_app(async_proxy=True))
+    model_url = (f'{base_url}/projects/{proxy.PROJECT_ID}/locations/{proxy.LOCATION}'
+                 f'/publishers/google/models/veo-3.0-fast-generate-001:predictLongRunning')
+
+    def submit(i):
+        return requests.post(model_url, json={'instances': [{'prompt': f'queued {i}'}]},
+                             headers={'X-Forwarded-For': f'10.0.1.{i}'}, timeout=30)
+
+    try:
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            submissions = [pool.submit(submit, i) for i in range(12)]
+            wait_until(lambda: proxy.admission.stats()['queued'] >= 8)
+            started = time.monotonic()
+            assert requests.get(f'{base_url}/health', timeout=5).status_code == 200
+            # Served by a WSGI thread while ten submissions wait in the queue
+            assert time.monotonic() - started < 0.5
+            responses = [future.result() for future in submissions]
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        proxy.vertex.close()
+        fake.stop()
+
+    assert [response.status_code for response in responses] == [200] * 12
+    assert proxy.admission.stats()['admitted'] == 12
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'test-token')
+
+import requests
+from aiohttp import web
+
+import app as proxy
+import async_app
+from fake_vertex import start_fake_vertex
+from operation_watcher import OperationWatcher
+from upstream import AsyncVertexClient, VertexClient
+
+
+def start_server(application):
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(application)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f'http://127.0.0.1:{port}', loop, runner
+
+
+def read_events(url):
+    events = []
+    with requests.get(url, stream=True, timeout=10) as response:
+        assert response.headers['Content-Type'].startswith('text/event-stream')
+        event = {}
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('event: '):
+                event['event'] = line[len('event: '):]
+            elif line.startswith('data: '):
+                event['data'] = json.loads(line[len('data: '):])
+            elif line == '' and event:
+                events.append(event)
+                event = {}
+    return events
+
+
+def use_fake_vertex(fake, monkeypatch):
+    """Point the app's upstream clients and watcher at `fake` until the test ends."""
+    monkeypatch.setattr(proxy, 'vertex', VertexClient(proxy.PROJECT_ID, proxy.LOCATION, base_url=fake.base_url))
+    monkeypatch.setattr(async_app, 'vertex',
+                        AsyncVertexClient(proxy.PROJECT_ID, proxy.LOCATION, base_url=fake.base_url))
+    monkeypatch.setattr(proxy, 'operation_watcher', OperationWatcher(
+        lambda name: proxy.fetch_operation_status(proxy.model_for_operation(name), name),
+        min_interval=0.1, max_interval=0.2))
+
+
+def test_subscribers_share_one_watch_until_done(monkeypatch):
+    fake = start_fake_vertex(complete_after=0.6)
+    use_fake_vertex(fake, monkeypatch)
+    base_url, loop, runner = start_server(async_app.create_app(async_proxy=False))
+    try:
+        assert requests.get(f'{base_url}/health').json() == {'status': 'healthy api'}
+
+        operation = requests.post(f'{base_url}/generate-video', json={'prompt': 'a cat surfing'}).json()
+        events_url = f"{base_url}/operations/{operation['name']}/events"
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            streams = list(pool.map(read_events, [events_url] * 20))
+
+        for events in streams:
+            assert events[0]['event'] == 'status'
+            assert events[-1] == {'event': 'done', 'data': {'status_code': 200}}
+            assert events[-2]['data']['operation']['done'] is True
+        assert proxy.operation_watcher.stats()['watches_started'] == 1
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        proxy.vertex.close()
+        fake.stop()
+
+
+def test_async_proxy_routes_keep_json_contracts(monkeypatch):
+    fake = start_fake_vertex(complete_after=0.3)
+    use_fake_vertex(fake, monkeypatch)
+    base_url, loop, runner = start_server(async_app.create_app(async_proxy=True))
+    try:
+        assert requests.post(f'{base_url}/generate-video', json={}).status_code == 400
+        assert requests.post(f'{base_url}/check-operation', json={}).json() == {'error': 'operationName is required'}
+
+        model_url = (f'{base_url}/projects/{proxy.PROJECT_ID}/locations/{proxy.LOCATION}'
+                     f'/publishers/google/models/veo-3.0-fast-generate-001')
+        operation = requests.post(f'{model_url}:predictLongRunning', json={'instances': [{'prompt': 'x'}]}).json()
+        assert operation['name'].startswith('projects/')
+
+        pending = requests.post(f'{model_url}:fetchPredictOperation', json={'operationName': operation['name']})
+        assert pending.status_code == 200 and 'done' not in pending.json()
+
+        done = requests.post(f'{base_url}/check-operation', json={'operationName': operation['name'], 'wait': 5})
+        assert done.json()['done'] is True
+
+        missing = requests.post(f'{base_url}/check-operation', json={'operationName': 'operations/unknown'})
+        assert missing.status_code == 404
+        assert missing.json()['error'] == 'Failed to check operation status'
+
+        stats = requests.get(f'{base_url}/stats').json()
+        assert stats['upstream_async']['base_url'] == fake.base_url
+        assert stats['upstream_async']['hosts'][fake.base_url.split('//')[1]]['requests'] >= 3
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        proxy.vertex.close()
+        fake.stop()
+
+
+if __name__ == "__main__":
+    test_subscribers_share_one_watch_until_done()
+    test_async_proxy_routes_keep_json_contracts()
+    print("✓ Operation event stream working correctly!")
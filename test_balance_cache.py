@@ -0,0 +1,80 @@
+import uuid
+
+import app as proxy
+from balance_cache import BalanceCache
+from test_webhook_queue import renewal
+
+
+def test_get_credits_is_cached_and_conditional(db_engine, monkeypatch):
+    cache = BalanceCache()
+    monkeypatch.setattr(proxy, 'balance_cache', cache)
+    client = proxy.app.test_client()
+    user_id = str(uuid.uuid4())
+    client.post('/register-user', json={'app_user_id': user_id, 'credits': 5})
+
+    first = client.get(f'/get-credits/{user_id}')
+    assert first.status_code == 200
+    assert first.get_json()['credits'] == 5
+    etag = first.headers['ETag']
+
+    unchanged = client.get(f'/get-credits/{user_id}', headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304
+    assert unchanged.data == b''
+    assert cache.stats()['hits'] == 1
+
+
+def test_write_paths_invalidate_the_cached_balance(db_engine):
+    client = proxy.app.test_client()
+    user_id = str(uuid.uuid4())
+    client.post('/register-user', json={'app_user_id': user_id, 'credits': 5})
+
+    def balance():
+        response = client.get(f'/get-credits/{user_id}')
+        return response.get_json()['credits'], response.headers['ETag']
+
+    credits, etag = balance()
+    assert credits == 5
+
+    client.post('/use-credits', json={'app_user_id': user_id, 'credits': 2})
+    credits, after_use = balance()
+    assert credits == 3
+    assert after_use != etag
+
+    client.post('/add-credits', json={'app_user_id': user_id, 'credits': 4})
+    assert balance()[0] == 7
+
+    client.post('/PostBack', json=renewal(str(uuid.uuid4()), user_id))
+    assert balance()[0] == 17
+
+    stale = client.get(f'/get-credits/{user_id}', headers={'If-None-Match': after_use})
+    assert stale.status_code == 200
+
+
+def test_reads_racing_a_write_do_not_cache_the_old_balance():
+    cache = BalanceCache()
+    user = uuid.uuid4()
+    value, version = cache.get(user)
+    assert value is None
+
+    cache.invalidate(user)
+    cache.fill(user, (10, '2025-01-01T00:00:00'), version)
+    assert cache.get(user)[0] is None
+    assert cache.stats()['stale_fills'] == 1
+
+
+def test_writes_to_other_users_do_not_spoil_a_fill():
+    cache = BalanceCache(max_entries=2)
+    user, others = uuid.uuid4(), [uuid.uuid4() for _ in range(3)]
+    _, version = cache.get(user)
+    cache.invalidate(others[0])
+    cache.invalidate_many(others[1:2])
+    cache.fill(user, (10, '2025-01-01T00:00:00'), version)
+    assert cache.get(user)[0] == (10, '2025-01-01T00:00:00')
+
+    # A read that started before an invalidation whose record was pruned is refused
+    _, version = cache.get(others[2])
+    cache.invalidate(user)
+    cache.invalidate_many(others[:2])
+    cache.fill(user, (5, '2025-01-01T00:00:00'), version)
+    assert cache.get(user)[0] is None
+    assert cache.stats()['stale_fills'] == 1
@@ -0,0 +1,82 @@
+import json
+import uuid
+
+import app as proxy
+import bulk_credits
+from conftest import balance, register
+
+ADMIN = {'X-Admin-Key': 'secret'}
+
+
+def test_bulk_grants_and_adjustments(db_engine, monkeypatch):
+    monkeypatch.setattr(bulk_credits, 'BULK_CREDITS_CHUNK_SIZE', 2)
+    monkeypatch.setattr(proxy, 'ADMIN_API_KEY', 'secret')
+    client = proxy.app.test_client()
+    rich, poor, repeat = register(client, 10), register(client, 1), register(client, 0)
+    missing = str(uuid.uuid4())
+    assert balance(client, rich) == 10  # cached, must be invalidated by the bulk write
+
+    response = client.post('/bulk-credits', json={'grants': [
+        {'app_user_id': rich, 'delta': 5},
+        {'app_user_id': poor, 'delta': -3},
+        {'app_user_id': missing, 'delta': 1},
+        {'app_user_id': 'not-a-uuid', 'delta': 1},
+        {'app_user_id': repeat, 'delta': 2},
+        {'app_user_id': repeat, 'delta': 3},
+        {'app_user_id': rich, 'delta': 0},
+    ]}, headers=ADMIN)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [(r['row'], r['status']) for r in body['results']] == [
+        (1, 'applied'), (2, 'insufficient_credits'), (3, 'not_found'), (4, 'invalid'),
+        (5, 'applied'), (6, 'applied'), (7, 'invalid'),
+    ]
+    assert body['results'][0]['credits'] == 15
+    assert body['results'][1]['credits'] == 1
+    assert body['summary']['applied'] == 3
+    assert body['summary']['chunks'] == 3
+    assert (balance(client, rich), balance(client, poor), balance(client, repeat)) == (15, 1, 5)
+
+
+def test_bulk_credits_streamed_formats(db_engine, monkeypatch):
+    monkeypatch.setattr(proxy, 'ADMIN_API_KEY', 'secret')
+    client = proxy.app.test_client()
+    users = [register(client, 0) for _ in range(3)]
+
+    ndjson = '\n'.join(json.dumps({'app_user_id': user, 'delta': 4}) for user in users) + '\n'
+    response = client.post('/bulk-credits', data=ndjson, content_type='application/x-ndjson', headers=ADMIN)
+    assert response.get_json()['summary']['applied'] == 3
+
+    csv_body = 'app_user_id,delta\n' + ''.join(f'{user},-1\n' for user in users) + 'garbage\n'
+    response = client.post('/bulk-credits?results=failed', data=csv_body, content_type='text/csv', headers=ADMIN)
+    body = response.get_json()
+    assert body['summary']['applied'] == 3
+    assert [r['status'] for r in body['results']] == ['invalid']
+    assert [balance(client, user) for user in users] == [3, 3, 3]
+
+
+def test_bulk_credits_admin_key(db_engine, monkeypatch):
+    monkeypatch.setattr(proxy, 'ADMIN_API_KEY', 'secret')
+    client = proxy.app.test_client()
+    user = register(client, 0)
+    grants = {'grants': [{'app_user_id': user, 'delta': 1}]}
+
+    assert client.post('/bulk-credits', json=grants).status_code == 401
+    assert client.post('/bulk-credits', json=grants, headers={'X-Admin-Key': 'wrong'}).status_code == 401
+    assert client.post('/bulk-credits', json=grants, headers=ADMIN).status_code == 200
+    assert balance(client, user) == 1
+
+
+def test_bulk_credits_refused_without_an_admin_key_configured(db_engine, monkeypatch):
+    monkeypatch.setattr(proxy, 'ADMIN_API_KEY', '')
+    client = proxy.app.test_client()
+    user = register(client, 0)
+    grants = {'grants': [{'app_user_id': user, 'delta': 1}]}
+
+    assert client.post('/bulk-credits', json=grants).status_code == 503
+    assert client.post('/bulk-credits', json=grants, headers={'X-Admin-Key': ''}).status_code == 503
+    assert balance(client, user) == 0
+
+    monkeypatch.setattr(proxy, 'ADMIN_API_INSECURE', True)
+    assert client.post('/bulk-credits', json=grants).status_code == 200
+    assert balance(client, user) == 1
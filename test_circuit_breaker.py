@@ -0,0 +1,100 @@
+import os
+import time
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'test-token')
+
+import pytest
+
+import app as proxy
+import metrics
+from circuit_breaker import CircuitBreaker, CircuitBreakers, CircuitOpen
+from fake_vertex import start_fake_vertex
+from upstream import HedgePolicy, VertexClient
+
+
+def test_breaker_opens_probes_and_recovers():
+    now = [0.0]
+    breaker = CircuitBreaker('model', 'verb', failure_threshold=3, reset_timeout=10, clock=lambda: now[0])
+    # A 429 is a quota answer and breaks the run of failures
+    for status in (500, 'timeout', 429, 503, 'error'):
+        breaker.allow()
+        breaker.record(status)
+    assert breaker.state == 'closed'
+    breaker.allow()
+    breaker.record(502)
+    assert breaker.state == 'open'
+
+    with pytest.raises(CircuitOpen) as rejected:
+        breaker.allow()
+    assert rejected.value.retry_after == 10
+
+    now[0] = 10
+    breaker.allow()
+    assert breaker.state == 'half_open'
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    breaker.record(504)
+    assert breaker.state == 'open'
+
+    now[0] = 20
+    breaker.allow()
+    breaker.record(200)
+    assert breaker.state == 'closed'
+    assert breaker.stats() == {'rejected': 2, 'opened': 2, 'state': 'closed', 'consecutive_failures': 0}
+
+
+def test_outage_fails_fast_and_shows_in_metrics(monkeypatch):
+    fake = start_fake_vertex()
+    breakers = CircuitBreakers(failure_threshold=2, reset_timeout=0.3)
+    monkeypatch.setattr(proxy, 'vertex', VertexClient(proxy.PROJECT_ID, proxy.LOCATION, base_url=fake.base_url,
+                                                      breakers=breakers))
+    monkeypatch.setattr(proxy, 'upstream_breakers', breakers)
+    client = proxy.app.test_client()
+    labels = {'model': 'veo-3.0-fast-generate-001', 'verb': 'fetchPredictOperation'}
+    try:
+        fake.outage = 503
+        for _ in range(2):
+            assert client.post('/check-operation', json={'operationName': 'operations/x'}).status_code == 503
+        assert fake.requests['fetchPredictOperation'] == 2
+
+        rejected = client.post('/check-operation', json={'operationName': 'operations/x'})
+        assert rejected.status_code == 503
+        assert 'failing fast' in rejected.get_json()['error']
+        assert rejected.headers['Retry-After'] == '1'
+        assert fake.requests['fetchPredictOperation'] == 2
+        assert metrics.REGISTRY.get_sample_value('vertex_upstream_circuit_state', labels) == 2
+        assert metrics.REGISTRY.get_sample_value('vertex_upstream_circuit_rejected_total', labels) >= 1
+
+        fake.outage = 0
+        time.sleep(0.35)
+        operation = client.post('/generate-video', json={'prompt': 'x'}).get_json()
+        assert client.post('/check-operation', json={'operationName': operation['name']}).status_code == 200
+        assert metrics.REGISTRY.get_sample_value('vertex_upstream_circuit_state', labels) == 0
+    finally:
+        proxy.vertex.close()
+        fake.stop()
+
+
+def test_slow_status_fetch_is_hedged():
+    fake = start_fake_vertex()
+    hedging = HedgePolicy(enabled=True, min_samples=5, budget=1.0)
+    vertex = VertexClient('p', 'l', base_url=fake.base_url, breakers=CircuitBreakers(), hedging=hedging)
+    try:
+        name = vertex.post('veo-2.0-generate-001', 'predictLongRunning', 'token', {'instances': [{}]}).json()['name']
+        for _ in range(10):
+            vertex.post_hedged('veo-2.0-generate-001', 'fetchPredictOperation', 'token', {'operationName': name})
+        assert hedging.stats()['hedged'] == 0
+
+        fake.slow_next = 1
+        started = time.perf_counter()
+        response = vertex.post_hedged('veo-2.0-generate-001', 'fetchPredictOperation', 'token',
+                                      {'operationName': name})
+        elapsed = time.perf_counter() - started
+    finally:
+        vertex.close()
+        fake.stop()
+
+    assert response.status_code == 200
+    assert elapsed < fake.slow_latency / 2
+    assert hedging.stats()['hedged'] == 1
+    assert hedging.stats()['hedge_won'] == 1
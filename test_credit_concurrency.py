@@ -0,0 +1,45 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import app as proxy
+from conftest import register
+
+
+def test_parallel_debits_never_overdraw(db_engine):
+    client = proxy.app.test_client()
+    user_id = register(client, 100)
+
+    def debit(_):
+        return proxy.app.test_client().post('/use-credits', json={'app_user_id': user_id, 'credits': 1})
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        responses = list(pool.map(debit, range(300)))
+
+    succeeded = [r for r in responses if r.status_code == 200]
+    rejected = [r for r in responses if r.status_code == 400]
+    assert len(succeeded) == 100
+    assert len(rejected) == 200
+    assert all(r.get_json()['error'] == 'Insufficient credits' for r in rejected)
+    assert sorted(r.get_json()['remaining_credits'] for r in succeeded) == list(range(100))
+    assert client.get(f'/get-credits/{user_id}').get_json()['credits'] == 0
+
+
+def test_parallel_grants_are_not_lost(db_engine):
+    client = proxy.app.test_client()
+    user_id = register(client, 0)
+
+    def grant(_):
+        return proxy.app.test_client().post('/add-credits', json={'app_user_id': user_id, 'credits': 2})
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        responses = list(pool.map(grant, range(200)))
+
+    assert all(r.status_code == 200 for r in responses)
+    assert client.get(f'/get-credits/{user_id}').get_json()['credits'] == 400
+
+
+def test_unknown_user(db_engine):
+    client = proxy.app.test_client()
+    missing = str(uuid.uuid4())
+    assert client.post('/use-credits', json={'app_user_id': missing, 'credits': 1}).status_code == 404
+    assert client.post('/add-credits', json={'app_user_id': missing, 'credits': 1}).status_code == 404
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'test-token')
+
+import pytest
+
+import app as proxy
+import async_app
+from conftest import register
+from fake_vertex import start_fake_vertex
+from credits import attach_hold, place_hold
+from hold_sweeper import HoldSweeper
+from models import SessionLocal, CreditHold
+from operation_watcher import OperationWatcher
+from test_async_app import read_events, start_server
+from upstream import VertexClient
+
+
+@pytest.fixture
+def fake_vertex(monkeypatch):
+    fake = start_fake_vertex(complete_after=0.3)
+    client = VertexClient(proxy.PROJECT_ID, proxy.LOCATION, base_url=fake.base_url)
+    monkeypatch.setattr(proxy, 'vertex', client)
+    monkeypatch.setattr(proxy, 'operation_watcher', OperationWatcher(
+        lambda name: proxy.fetch_operation_status(proxy.model_for_operation(name), name),
+        min_interval=0.1, max_interval=0.2, on_error=proxy.on_operation_lost))
+    yield fake
+    client.close()
+    fake.stop()
+
+
+def hold_status(hold_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        db = SessionLocal()
+        try:
+            status = db.get(CreditHold, hold_id).status
+        finally:
+            db.close()
+        if status != 'held' or time.monotonic() > deadline:
+            return status
+        time.sleep(0.05)
+
+
+def test_hold_is_settled_when_video_is_ready(db_engine, fake_vertex):
+    client = proxy.app.test_client()
+    user_id = register(client, 5)
+
+    response = client.post('/generate-video', json={'prompt': 'a cat surfing', 'app_user_id': user_id, 'cost': 2})
+    assert response.status_code == 200
+    credits = response.get_json()['credits']
+    assert credits['reserved'] == 2 and credits['remaining_credits'] == 3
+
+    # Nobody polls: the pinned watch still drives settlement
+    assert hold_status(credits['hold_id']) == 'settled'
+    assert client.get(f'/get-credits/{user_id}').get_json()['credits'] == 3
+
+
+def test_hold_is_released_when_operation_fails(db_engine, fake_vertex):
+    client = proxy.app.test_client()
+    user_id = register(client, 5)
+
+    response = client.post('/generate-video', json={'prompt': 'FAIL please', 'app_user_id': user_id, 'cost': 2})
+    hold_id = response.get_json()['credits']['hold_id']
+
+    assert hold_status(hold_id) == 'released'
+    assert client.get(f'/get-credits/{user_id}').get_json()['credits'] == 5
+
+
+def test_hold_is_released_when_submission_fails(db_engine, fake_vertex, monkeypatch):
+    client = proxy.app.test_client()
+    user_id = register(client, 5)
+    unreachable = VertexClient(proxy.PROJECT_ID, proxy.LOCATION, base_url='http://127.0.0.1:9')
+    monkeypatch.setattr(proxy, 'vertex', unreachable)
+
+    response = client.post('/generate-video', json={'prompt': 'a cat surfing', 'app_user_id': user_id, 'cost': 2})
+    assert response.status_code == 500
+    assert client.get(f'/get-credits/{user_id}').get_json()['credits'] == 5
+
+
+def test_insufficient_credits_never_reach_vertex(db_engine, fake_vertex):
+    client = proxy.app.test_client()
+    user_id = register(client, 1)
+
+    response = client.post('/generate-video', json={'prompt': 'a cat surfing', 'app_user_id': user_id, 'cost': 2})
+    assert response.status_code == 400
+    assert response.get_json()['available_credits'] == 1
+    assert fake_vertex.requests['predictLongRunning'] == 0
+
+
+def test_paid_operations_can_be_long_polled_and_streamed(db_engine, fake_vertex, monkeypatch):
+    # The pinned watch hasn't polled yet when the waiters arrive
+    monkeypatch.setattr(proxy, 'operation_watcher', OperationWatcher(
+        lambda name: proxy.fetch_operation_status(proxy.model_for_operation(name), name),
+        min_interval=0.5, max_interval=0.5))
+    client = proxy.app.test_client()
+    user_id = register(client, 5)
+
+    operation = client.post('/generate-video', json={'prompt': 'a cat surfing', 'app_user_id': user_id}).get_json()
+    response = client.post('/check-operation', json={'operationName': operation['name'], 'wait': 3})
+    assert response.status_code == 200
+    assert response.get_json()['done'] is True
+
+    operation = client.post('/generate-video', json={'prompt': 'a dog surfing', 'app_user_id': user_id}).get_json()
+    base_url, loop, runner = start_server(async_app.create_app(async_proxy=False))
+    try:
+        events = read_events(f"{base_url}/operations/{operation['name']}/events")
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+    assert events[-1] == {'event': 'done', 'data': {'status_code': 200}}
+    assert events[-2]['data']['operation']['done'] is True
+
+
+def open_hold(user_id, operation_name, age_seconds=0):
+    """A hold as a previous process would have left it."""
+    db = SessionLocal()
+    try:
+        hold_id, _ = place_hold(db, uuid.UUID(user_id), 1)
+        if operation_name is not None:
+            attach_hold(db, hold_id, operation_name)
+        hold = db.get(CreditHold, hold_id)
+        hold.created_at = datetime.utcnow() - timedelta(seconds=age_seconds)
+        db.commit()
+        return hold_id
+    finally:
+        db.close()
+
+
+def test_sweeper_settles_holds_a_restart_left_open(db_engine, fake_vertex):
+    client = proxy.app.test_client()
+    user_id = register(client, 10)
+    model_url = f'/projects/{proxy.PROJECT_ID}/locations/{proxy.LOCATION}/publishers/google/models/veo-3.0-fast-generate-001'
+    finished = client.post(f'{model_url}:predictLongRunning', json={'instances': [{'prompt': 'x'}]}).get_json()['name']
+    running = client.post(f'{model_url}:predictLongRunning', json={'instances': [{'prompt': 'y'}]}).get_json()['name']
+    time.sleep(0.4)
+    running_late = client.post(f'{model_url}:predictLongRunning', json={'instances': [{'prompt': 'z'}]}).get_json()['name']
+
+    holds = {
+        'finished': open_hold(user_id, finished, age_seconds=300),
+        'gone': open_hold(user_id, 'projects/p/locations/l/operations/unknown', age_seconds=300),
+        'orphaned': open_hold(user_id, None, age_seconds=3600),
+        'expired': open_hold(user_id, running, age_seconds=86400),
+        'running': open_hold(user_id, running_late, age_seconds=300),
+        'fresh': open_hold(user_id, None),
+    }
+    def fetch_status(name):
+        # Straight to the fake: through the operation cache, the terminal listener would race the sweep
+        response = proxy.vertex.post(proxy.model_for_operation(name), 'fetchPredictOperation', 'test-token',
+                                     {'operationName': name})
+        return response.status_code, response.json() if response.status_code == 200 else response.text
+
+    rewatched = []
+    sweeper = HoldSweeper(fetch_status, proxy.operation_succeeded, watch=rewatched.append)
+
+    counts = sweeper.sweep_once()
+    assert counts == {'settled': 1, 'released': 1, 'rewatched': 1, 'orphaned': 1, 'expired': 1}
+    assert rewatched == [running_late]
+    assert {name: hold_status(hold_id, timeout=0) for name, hold_id in holds.items()} == {
+        'finished': 'settled', 'gone': 'released', 'orphaned': 'released', 'expired': 'released',
+        'running': 'held', 'fresh': 'held',
+    }
+    # 10 - 6 holds + 3 refunds
+    assert client.get(f'/get-credits/{user_id}').get_json()['credits'] == 7
+    assert sweeper.sweep_once() == {'settled': 0, 'released': 0, 'rewatched': 1, 'orphaned': 0, 'expired': 0}
+
+
+def test_hold_is_released_when_the_operation_disappears(db_engine, fake_vertex):
+    client = proxy.app.test_client()
+    user_id = register(client, 5)
+    hold_id = open_hold(user_id, 'projects/p/locations/l/operations/vanished')
+
+    proxy.operation_watcher.watch_until_done('projects/p/locations/l/operations/vanished')
+    assert hold_status(hold_id) == 'released'
+    assert client.get(f'/get-credits/{user_id}').get_json()['credits'] == 5
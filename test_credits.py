@@ -1,5 +1,6 @@
 import requests
 import json
+from uuid import uuid4
 
 BASE_URL = "http://localhost:5000"
 
@@ -9,7 +10,10 @@ def test_credits_flow():
     # 1. Create a new user with 50 credits
     print("1. Creating new user with 50 credits...")
     try:
-        response = requests.post(f"{BASE_URL}/create-user", json={"credits": 50})
+        response = requests.post(f"{BASE_URL}/register-user", json={
+            "app_user_id": str(uuid4()),
+            "credits": 50
+        })
         if response.status_code == 201:
             user_data = response.json()
             user_id = user_data['user_id']
@@ -0,0 +1,70 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'test-token')
+
+import app as proxy
+from fake_vertex import start_fake_vertex
+from generation_dedupe import GenerationDeduper
+from test_async_app import use_fake_vertex
+
+
+def test_resubmitted_seeded_requests_reuse_the_operation(monkeypatch):
+    monkeypatch.setattr(proxy, 'generation_deduper', GenerationDeduper())
+    fake = start_fake_vertex(latency=0.2)
+    use_fake_vertex(fake, monkeypatch)
+    request = {'prompt': 'a fox in the snow', 'seed': 42}
+
+    def generate(body):
+        return proxy.app.test_client().post('/generate-video', json=body).get_json()
+
+    try:
+        # Double tap: the copies wait for the first submission instead of starting their own
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(generate, [request] * 8))
+        later = generate(request)
+        other_seed = generate({**request, 'seed': 7})
+        opted_out = generate({**request, 'dedupe': False})
+        unseeded = [generate({'prompt': 'a fox in the snow'}) for _ in range(2)]
+    finally:
+        proxy.vertex.close()
+        fake.stop()
+
+    names = {response['name'] for response in responses}
+    assert len(names) == 1
+    assert sum(1 for response in responses if response.get('deduplicated')) == 7
+    assert later == {'name': names.pop(), 'deduplicated': True}
+    assert other_seed['name'] != later['name']
+    assert opted_out['name'] != later['name']
+    assert unseeded[0]['name'] != unseeded[1]['name']
+    assert fake.requests['predictLongRunning'] == 5
+
+
+def test_failed_operations_are_not_reused(monkeypatch):
+    monkeypatch.setattr(proxy, 'generation_deduper', GenerationDeduper())
+    fake = start_fake_vertex()
+    use_fake_vertex(fake, monkeypatch)
+    request = {'prompt': 'FAIL please', 'seed': 1}
+    client = proxy.app.test_client()
+    try:
+        first = client.post('/generate-video', json=request).get_json()
+        status = client.post('/check-operation', json={'operationName': first['name']}).get_json()
+        assert 'error' in status
+        retry = client.post('/generate-video', json=request).get_json()
+    finally:
+        proxy.vertex.close()
+        fake.stop()
+
+    assert retry['name'] != first['name']
+    assert 'deduplicated' not in retry
+    assert proxy.generation_deduper.stats()['forgotten'] == 1
+
+
+def test_key_store_is_bounded():
+    deduper = GenerationDeduper(max_entries=2)
+    for key in ('a', 'b', 'c'):
+        deduper.submit(key, lambda key=key: (f'operations/{key}', None))
+
+    assert deduper.stats()['entries'] == 2
+    assert deduper.submit('c', lambda: ('operations/new', None))[:2] == ('operations/c', True)
+    assert deduper.submit('a', lambda: ('operations/new', None))[:2] == ('operations/new', False)
@@ -0,0 +1,81 @@
+import base64
+import io
+import os
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'test-token')
+
+from PIL import Image
+
+import app as proxy
+from blob_store import BlobStore
+from fake_vertex import start_fake_vertex
+from image_prep import ImagePreprocessor, target_size
+from test_async_app import use_fake_vertex
+
+
+def photo(size, orientation=1, fmt='JPEG'):
+    bands = [Image.linear_gradient('L'), Image.linear_gradient('L').rotate(90), Image.radial_gradient('L')]
+    image = Image.merge('RGB', [band.resize(size) for band in bands])
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    output = io.BytesIO()
+    image.save(output, format=fmt, exif=exif.tobytes(), quality=95)
+    return output.getvalue()
+
+
+def test_target_size_follows_the_aspect_ratio():
+    assert target_size('16:9') == (1280, 720)
+    assert target_size('9:16') == (720, 1280)
+    assert target_size('9:16', short_edge=1080) == (1080, 1920)
+
+
+def test_phone_photo_is_rotated_downscaled_and_cached(tmp_path):
+    store = BlobStore(str(tmp_path))
+    prep = ImagePreprocessor(store)
+    # Sensor-oriented landscape pixels, EXIF says rotate to portrait
+    source = store.put_bytes(photo((4032, 3024), orientation=6), 'image/jpeg')
+
+    prepared = prep.prepare(source, '9:16')
+    with Image.open(prepared.path) as image:
+        assert image.format == 'JPEG'
+        assert image.size[0] >= 720 and image.size[1] >= 1280
+        assert image.size[0] < 1000 and image.size[1] < 1400
+        assert image.size[0] < image.size[1]
+        assert 0x0112 not in image.getexif()
+    assert prepared.size < source.size
+
+    again = prep.prepare(store.put_bytes(photo((4032, 3024), orientation=6), 'image/jpeg'), '9:16')
+    assert again.digest == prepared.digest
+    assert prep.stats()['processed'] == 1
+    assert prep.stats()['cache_hits'] == 1
+
+    # A fresh processor (e.g. after a restart) still finds the derived blob
+    assert ImagePreprocessor(store).prepare(source, '9:16').digest == prepared.digest
+
+
+def test_small_images_pass_through(tmp_path):
+    store = BlobStore(str(tmp_path))
+    source = store.put_bytes(photo((640, 360), fmt='PNG'), 'image/png')
+    assert ImagePreprocessor(store).prepare(source, '16:9') is source
+
+
+def test_generate_video_sends_the_downscaled_image(tmp_path, monkeypatch):
+    monkeypatch.setattr(proxy, 'blob_store', BlobStore(str(tmp_path)))
+    monkeypatch.setattr(proxy, 'image_prep', ImagePreprocessor(proxy.blob_store))
+    fake = start_fake_vertex()
+    use_fake_vertex(fake, monkeypatch)
+    original = photo((3000, 2000))
+    try:
+        client = proxy.app.test_client()
+        response = client.post('/generate-video', json={'prompt': 'x', 'image': base64.b64encode(original).decode()})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        bad = client.post('/generate-video', json={'prompt': 'x', 'image': base64.b64encode(b'not an image').decode()})
+        assert bad.status_code == 400
+    finally:
+        proxy.vertex.close()
+        fake.stop()
+
+    sent = fake.last_predict['instances'][0]['image']
+    assert sent['mimeType'] == 'image/jpeg'
+    with Image.open(io.BytesIO(base64.b64decode(sent['bytesBase64Encoded']))) as image:
+        assert image.size == (1280, 853)
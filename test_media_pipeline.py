@@ -0,0 +1,164 @@
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'test-token')
+
+import app as proxy
+from blob_store import BlobStore
+from media_pipeline import MediaPipeline
+
+FAKE_FFMPEG = '''#!{python}
+import os, sys
+with open(os.path.join(os.path.dirname(sys.argv[0]), 'calls.log'), 'a') as log:
+    log.write(' '.join(sys.argv[1:]) + '\\n')
+with open(sys.argv[-1], 'wb') as out:
+    out.write(b'derived:' + os.path.basename(sys.argv[-1]).encode())
+'''
+
+
+def fake_ffmpeg(tmp_path):
+    path = tmp_path / 'ffmpeg'
+    path.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    path.chmod(0o755)
+    return str(path)
+
+
+def ffmpeg_calls(tmp_path):
+    log = tmp_path / 'calls.log'
+    return log.read_text().splitlines() if log.exists() else []
+
+
+def finished(digest):
+    return {'name': 'op', 'done': True,
+            'response': {'videos': [{'sha256': digest, 'url': f'/videos/{digest}', 'mimeType': 'video/mp4'}]}}
+
+
+def wait_for(pipeline, digest, timeout=30):
+    deadline = time.monotonic() + timeout
+    while pipeline.status(digest) not in ('ready', 'failed') and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return pipeline.status(digest)
+
+
+def test_jobs_are_idempotent_per_operation_and_video(tmp_path):
+    store = BlobStore(str(tmp_path / 'videos'))
+    digest = store.put_bytes(b'video', 'video/mp4').digest
+    pipeline = MediaPipeline(store, ffmpeg=fake_ffmpeg(tmp_path), hls=True,
+                             executor=ThreadPoolExecutor(max_workers=2))
+    assert pipeline.annotate(finished(digest))['response']['videos'][0]['media'] == {'status': 'pending'}
+
+    pipeline.submit('op-1', finished(digest))
+    pipeline.submit('op-1', finished(digest))
+    assert wait_for(pipeline, digest) == 'ready'
+    pipeline.submit('op-2', finished(digest))
+
+    assert len(ffmpeg_calls(tmp_path)) == 3
+    assert pipeline.stats()['duplicate_operations'] == 1
+    assert pipeline.stats()['already_processed'] == 1
+    media = pipeline.annotate(finished(digest))['response']['videos'][0]['media']
+    assert media == {'status': 'ready',
+                     'posterUrl': f'/videos/{digest}/poster.jpg',
+                     'faststartUrl': f'/videos/{digest}/faststart.mp4',
+                     'hlsUrl': f'/videos/{digest}/hls/index.m3u8'}
+
+    # A fresh process finds the outputs on disk
+    restarted = MediaPipeline(store, ffmpeg=fake_ffmpeg(tmp_path), executor=ThreadPoolExecutor(max_workers=1))
+    restarted.submit('op-3', finished(digest))
+    assert restarted.status(digest) == 'ready'
+    assert len(ffmpeg_calls(tmp_path)) == 3
+
+    assert open(pipeline.file_path(digest, 'poster.jpg'), 'rb').read() == b'derived:poster.jpg'
+    assert pipeline.file_path(digest, '../' + digest) is None
+    assert pipeline.file_path(digest, 'manifest.json') is None
+
+
+def test_failures_are_reported_and_leave_nothing_behind(tmp_path):
+    store = BlobStore(str(tmp_path / 'videos'))
+    digest = store.put_bytes(b'video', 'video/mp4').digest
+    pipeline = MediaPipeline(store, ffmpeg='/bin/false', executor=ThreadPoolExecutor(max_workers=1))
+    pipeline.submit('op', finished(digest))
+    assert wait_for(pipeline, digest) == 'failed'
+    assert pipeline.stats()['failed'] == 1
+    assert os.listdir(pipeline.root) == []
+
+
+def test_runs_on_a_process_pool(tmp_path):
+    store = BlobStore(str(tmp_path / 'videos'))
+    digest = store.put_bytes(b'video', 'video/mp4').digest
+    pipeline = MediaPipeline(store, workers=1, ffmpeg=fake_ffmpeg(tmp_path))
+    try:
+        pipeline.submit('op', finished(digest))
+        assert wait_for(pipeline, digest) == 'ready'
+    finally:
+        pipeline.shutdown()
+
+
+def test_derived_files_are_served_and_linked_from_check_operation(tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path / 'videos'))
+    digest = store.put_bytes(b'video', 'video/mp4').digest
+    pipeline = MediaPipeline(store, ffmpeg=fake_ffmpeg(tmp_path), executor=ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(proxy, 'media_pipeline', pipeline)
+    proxy.operation_cache.put('op-served', finished(digest))
+    client = proxy.app.test_client()
+
+    assert client.get(f'/videos/{digest}/poster.jpg').status_code == 404
+    pipeline.submit('op-served', finished(digest))
+    assert wait_for(pipeline, digest) == 'ready'
+
+    media = client.post('/check-operation', json={'operationName': 'op-served'}).get_json()
+    assert media['response']['videos'][0]['media']['posterUrl'] == f'/videos/{digest}/poster.jpg'
+    poster = client.get(f'/videos/{digest}/poster.jpg')
+    assert poster.status_code == 200
+    assert poster.mimetype == 'image/jpeg'
+    assert poster.data == b'derived:poster.jpg'
+    assert client.get(f'/videos/{digest}/faststart.mp4', headers={'Range': 'bytes=0-3'}).data == b'deri'
+
+
+def test_evicting_a_video_removes_its_media_outputs(tmp_path):
+    store = BlobStore(str(tmp_path / 'videos'), max_total_bytes=250, max_age=0, min_age=0,
+                      evict_interval=3600, sidecar_dirs=('media',))
+    old = store.put_bytes(b'a' * 100, 'video/mp4').digest
+    pipeline = MediaPipeline(store, ffmpeg=fake_ffmpeg(tmp_path), executor=ThreadPoolExecutor(max_workers=1))
+    pipeline.submit('op-old', finished(old))
+    assert wait_for(pipeline, old) == 'ready'
+    past = time.time() - 100
+    os.utime(store.path(old), (past, past))
+    new = store.put_bytes(b'b' * 100, 'video/mp4').digest
+
+    # 200 bytes of video are under the cap; the media outputs push it over
+    assert store.evict() == 1
+    assert not os.path.exists(store.path(old)) and not os.path.exists(pipeline.media_dir(old))
+    assert pipeline.status(old) is None and pipeline.file_path(old, 'poster.jpg') is None
+    assert os.path.exists(store.path(new))
+
+    orphan = pipeline.media_dir('c' * 64)
+    os.makedirs(orphan)
+    os.utime(orphan, (past, past))
+    store.evict()
+    assert not os.path.exists(orphan)
+    assert store.stats()['bytes'] == 100
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_real_ffmpeg_moves_moov_to_the_front(tmp_path):
+    source = tmp_path / 'source.mp4'
+    subprocess.run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc=size=320x180:rate=24',
+                    '-t', '2', '-pix_fmt', 'yuv420p', str(source)], check=True)
+    store = BlobStore(str(tmp_path / 'videos'))
+    with open(source, 'rb') as f:
+        digest = store.put_stream(f, 'video/mp4').digest
+    pipeline = MediaPipeline(store, hls=True, executor=ThreadPoolExecutor(max_workers=1))
+    pipeline.submit('op', finished(digest))
+    assert wait_for(pipeline, digest, timeout=120) == 'ready'
+
+    with open(pipeline.file_path(digest, 'faststart.mp4'), 'rb') as f:
+        head = f.read(4096)
+    assert b'moov' in head and (b'mdat' not in head or head.index(b'moov') < head.index(b'mdat'))
+    assert open(pipeline.file_path(digest, 'poster.jpg'), 'rb').read(2) == b'\xff\xd8'
+    assert '#EXTM3U' in open(pipeline.file_path(digest, 'hls/index.m3u8')).read()
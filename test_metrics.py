@@ -0,0 +1,57 @@
+import uuid
+
+from prometheus_client import REGISTRY
+
+import app as proxy
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_metrics_cover_routes_db_and_webhooks(db_engine):
+    client = proxy.app.test_client()
+    user_id = str(uuid.uuid4())
+    route = {'route': '/get-credits/<app_user_id>', 'method': 'GET'}
+    before = sample('http_requests_total', status='200', **route)
+    queries_before = sample('db_query_duration_seconds_count', endpoint='register_user')
+    ignored_before = sample('webhook_events_total', outcome='ignored')
+
+    client.post('/register-user', json={'app_user_id': user_id, 'credits': 1})
+    client.get(f'/get-credits/{user_id}')
+    client.post('/PostBack', json={'event': {'id': str(uuid.uuid4()), 'type': 'CANCELLATION'}})
+
+    assert sample('http_requests_total', status='200', **route) == before + 1
+    assert sample('http_request_duration_seconds_count', **route) >= 1
+    assert sample('db_query_duration_seconds_count', endpoint='register_user') > queries_before
+    assert sample('webhook_events_total', outcome='ignored') == ignored_before + 1
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_bucket' in body
+    assert 'db_pool_checked_out' in body
+
+
+def test_upstream_calls_are_labelled_by_model_and_verb():
+    from fake_vertex import start_fake_vertex
+    from upstream import VertexClient
+
+    fake = start_fake_vertex()
+    client = VertexClient('test-project', 'us-central1', base_url=fake.base_url)
+    labels = {'model': 'veo-2.0-generate-001', 'verb': 'fetchPredictOperation'}
+    before_ok = sample('vertex_upstream_requests_total', status='200', **labels)
+    before_missing = sample('vertex_upstream_requests_total', status='404', **labels)
+    try:
+        operation = client.post('veo-2.0-generate-001', 'predictLongRunning', 'token', {'instances': [{}]}).json()
+        client.post('veo-2.0-generate-001', 'fetchPredictOperation', 'token', {'operationName': operation['name']})
+        client.post('veo-2.0-generate-001', 'fetchPredictOperation', 'token', {'operationName': 'missing'})
+    finally:
+        client.close()
+        fake.stop()
+
+    assert sample('vertex_upstream_requests_total', status='200', **labels) == before_ok + 1
+    assert sample('vertex_upstream_requests_total', status='404', **labels) == before_missing + 1
+    assert sample('vertex_upstream_duration_seconds_count', model='veo-2.0-generate-001',
+                  verb='predictLongRunning') >= 1
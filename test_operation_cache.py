@@ -0,0 +1,83 @@
+import threading
+import time
+
+from operation_cache import OperationStatusCache
+
+
+def test_concurrent_polls_share_one_upstream_call():
+    cache = OperationStatusCache(pending_ttl=0.5)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        return 200, {'name': 'op-1'}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('op-1', fetch))) for _ in range(100)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [(200, {'name': 'op-1'})] * 100
+    assert cache.stats()['coalesced'] == 99
+
+
+def test_pending_status_expires_after_ttl():
+    cache = OperationStatusCache(pending_ttl=0.1)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return 200, {'name': 'op-1'}
+
+    cache.get('op-1', fetch)
+    cache.get('op-1', fetch)
+    assert len(calls) == 1
+    time.sleep(0.15)
+    cache.get('op-1', fetch)
+    assert len(calls) == 2
+
+
+def test_terminal_status_is_never_refetched():
+    cache = OperationStatusCache(pending_ttl=0, terminal_max_entries=2)
+    calls = []
+
+    def fetch_done(name):
+        def fetch():
+            calls.append(name)
+            return 200, {'name': name, 'done': True}
+        return fetch
+
+    for _ in range(5):
+        cache.get('op-1', fetch_done('op-1'))
+    assert calls == ['op-1']
+
+    cache.get('op-2', fetch_done('op-2'))
+    cache.get('op-3', fetch_done('op-3'))
+    assert cache.stats()['terminal_entries'] == 2
+    cache.get('op-1', fetch_done('op-1'))
+    assert calls == ['op-1', 'op-2', 'op-3', 'op-1']
+
+
+def test_upstream_errors_are_not_cached():
+    cache = OperationStatusCache()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return 503, 'unavailable'
+
+    assert cache.get('op-1', fetch) == (503, 'unavailable')
+    assert cache.get('op-1', fetch) == (503, 'unavailable')
+    assert len(calls) == 2
+
+
+if __name__ == "__main__":
+    test_concurrent_polls_share_one_upstream_call()
+    test_pending_status_expires_after_ttl()
+    test_terminal_status_is_never_refetched()
+    test_upstream_errors_are_not_cached()
+    print("✓ Operation status cache working correctly!")
@@ -0,0 +1,128 @@
+import os
+import time
+import uuid
+from datetime import datetime
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'test-token')
+
+import pytest
+from sqlalchemy import text
+
+import app as proxy
+from fake_vertex import start_fake_vertex
+from models import SessionLocal, Operation, User
+from operation_history import list_operations
+from operation_watcher import OperationWatcher
+from upstream import VertexClient
+
+
+@pytest.fixture
+def fake_vertex(monkeypatch):
+    fake = start_fake_vertex(complete_after=0.2)
+    monkeypatch.setattr(proxy, 'vertex', VertexClient(proxy.PROJECT_ID, proxy.LOCATION, base_url=fake.base_url))
+    monkeypatch.setattr(proxy, 'operation_watcher', OperationWatcher(
+        lambda name: proxy.fetch_operation_status(proxy.model_for_operation(name), name),
+        min_interval=0.05, max_interval=0.1))
+    yield fake
+    proxy.vertex.close()
+    fake.stop()
+
+
+def operation_statuses(user_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        db = SessionLocal()
+        try:
+            statuses = [row.status for row in db.query(Operation).filter_by(app_user_id=uuid.UUID(user_id))]
+        finally:
+            db.close()
+        if 'running' not in statuses or time.monotonic() > deadline:
+            return statuses
+        time.sleep(0.05)
+
+
+def test_history_is_recorded_and_listed_without_upstream_calls(db_engine, fake_vertex):
+    client = proxy.app.test_client()
+    user_id = str(uuid.uuid4())
+    client.post('/register-user', json={'app_user_id': user_id, 'credits': 10})
+
+    names = []
+    for prompt in ('a cat surfing', 'FAIL please', 'a dog skating'):
+        response = client.post('/generate-video', json={'prompt': prompt, 'app_user_id': user_id})
+        names.append(response.get_json()['name'])
+    assert sorted(operation_statuses(user_id)) == ['failed', 'succeeded', 'succeeded']
+
+    upstream_calls = dict(fake_vertex.requests)
+    first = client.get(f'/users/{user_id}/operations?limit=2').get_json()
+    second = client.get(f"/users/{user_id}/operations?limit=2&cursor={first['next_cursor']}").get_json()
+    assert fake_vertex.requests == upstream_calls
+
+    listed = first['operations'] + second['operations']
+    assert [operation['name'] for operation in listed] == names[::-1]
+    assert second['next_cursor'] is None
+    assert listed[0]['result_uri'].startswith('gs://fake-bucket/')
+    assert listed[1]['status'] == 'failed'
+    assert listed[1]['error'] == 'The prompt could not be processed.'
+    assert listed[0]['params_hash'] != listed[2]['params_hash']
+    assert listed[0]['model'] == 'veo-3.0-fast-generate-001'
+
+
+def test_generations_without_a_user_are_recorded(db_engine, fake_vertex):
+    client = proxy.app.test_client()
+    name = client.post('/generate-video', json={'prompt': 'a cat surfing'}).get_json()['name']
+    assert 'credits' not in client.post('/check-operation', json={'operationName': name, 'wait': 5}).get_json()
+
+    deadline = time.monotonic() + 5
+    while True:
+        db = SessionLocal()
+        try:
+            operation = db.query(Operation).filter_by(name=name).one()
+        finally:
+            db.close()
+        if operation.status != 'running' or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    assert operation.app_user_id is None
+    assert operation.status == 'succeeded'
+
+
+def test_keyset_pages_are_stable_across_equal_timestamps(db_engine):
+    user_uuid = uuid.uuid4()
+    created_at = datetime(2026, 1, 1)
+    db = SessionLocal()
+    try:
+        db.add(User(id=user_uuid, credits=0))
+        for i in range(5):
+            db.add(Operation(name=f'operations/{i}', app_user_id=user_uuid, model='m', params_hash='h',
+                             status='running', created_at=created_at))
+        db.add(Operation(name='operations/other', app_user_id=uuid.uuid4(), model='m', params_hash='h',
+                         status='running', created_at=created_at))
+        db.commit()
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = list_operations(db, user_uuid, 2, cursor)
+            seen.extend(operation.name for operation in page)
+            if cursor is None:
+                break
+        assert seen == [f'operations/{i}' for i in range(4, -1, -1)]
+    finally:
+        db.close()
+
+    client = proxy.app.test_client()
+    assert client.get(f'/users/{user_uuid}/operations?cursor=nope').status_code == 400
+    assert client.get('/users/not-a-uuid/operations').status_code == 400
+    assert client.get(f'/users/{uuid.uuid4()}/operations').get_json() == {'operations': [], 'next_cursor': None}
+
+
+def test_listing_is_an_index_range_scan(db_engine):
+    if db_engine.dialect.name != 'sqlite':
+        pytest.skip('query plan check is SQLite-specific')
+    with db_engine.connect() as connection:
+        plan = connection.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM operations WHERE app_user_id = :user "
+            "AND (created_at, id) < (:created_at, :id) ORDER BY created_at DESC, id DESC LIMIT 21"
+        ), {'user': uuid.uuid4().hex, 'created_at': '2026-01-01', 'id': 1}).all()
+    details = ' '.join(row[-1] for row in plan)
+    assert 'ix_operations_app_user_id_created_at' in details
+    assert 'TEMP B-TREE' not in details
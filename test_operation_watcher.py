@@ -0,0 +1,61 @@
+import threading
+import time
+
+from operation_watcher import OperationWatcher
+
+
+def make_fetch(done_after):
+    started = time.monotonic()
+    calls = []
+
+    def fetch_status(operation_name):
+        calls.append(operation_name)
+        if time.monotonic() - started >= done_after:
+            return 200, {'name': operation_name, 'done': True}
+        return 200, {'name': operation_name}
+
+    return fetch_status, calls
+
+
+def test_waiters_share_one_watch_and_wake_on_completion():
+    fetch_status, calls = make_fetch(done_after=0.5)
+    watcher = OperationWatcher(fetch_status, min_interval=0.05, max_interval=0.2)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(watcher.wait_for_change('op-1', timeout=5)))
+               for _ in range(50)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert time.monotonic() - started < 2
+    assert all(result == (200, {'name': 'op-1', 'done': True}) for result in results)
+    assert watcher.stats()['watches_started'] == 1
+    # 50 initial reads plus the watch thread's own polls
+    assert len(calls) < 50 + 20
+
+
+def test_wait_times_out_with_pending_status():
+    fetch_status, _ = make_fetch(done_after=60)
+    watcher = OperationWatcher(fetch_status, min_interval=0.05, max_interval=0.1)
+
+    started = time.monotonic()
+    assert watcher.wait_for_change('op-1', timeout=0.3) == (200, {'name': 'op-1'})
+    assert 0.3 <= time.monotonic() - started < 1
+
+
+def test_terminal_operation_returns_immediately():
+    fetch_status, _ = make_fetch(done_after=0)
+    watcher = OperationWatcher(fetch_status)
+
+    assert watcher.wait_for_change('op-1', timeout=30) == (200, {'name': 'op-1', 'done': True})
+    assert watcher.stats()['watches_started'] == 0
+
+
+if __name__ == "__main__":
+    test_waiters_share_one_watch_and_wake_on_completion()
+    test_wait_times_out_with_pending_status()
+    test_terminal_operation_returns_immediately()
+    print("✓ Operation watcher working correctly!")
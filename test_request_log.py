@@ -0,0 +1,53 @@
+import base64
+import hashlib
+import io
+import json
+import threading
+
+import request_log
+
+
+def test_binary_fields_are_replaced_by_size_and_hash():
+    image = base64.b64encode(b'\x89PNG' + bytes(300_000)).decode()
+    summary = request_log.summarize({
+        'instances': [{'prompt': 'a cat', 'image': {'bytesBase64Encoded': image, 'mimeType': 'image/png'}}],
+        'note': 'x' * 1000,
+    }, max_chars=16)
+
+    redacted = summary['instances'][0]['image']['bytesBase64Encoded']
+    assert redacted == {'redacted': True, 'size': len(image),
+                        'sha256': hashlib.sha256(image.encode()).hexdigest()[:16]}
+    assert summary['instances'][0]['prompt'] == 'a cat'
+    assert summary['note'] == {'truncated': 'x' * 16, 'size': 1000}
+
+
+def test_events_are_written_as_one_json_line_off_the_request_thread():
+    stream = io.StringIO()
+    writers = set()
+
+    class Recorder(io.StringIO):
+        def write(self, text):
+            writers.add(threading.current_thread().name)
+            return stream.write(text)
+
+    request_log.configure(stream=Recorder())
+    try:
+        request_log.log_event('vertex_request', model='veo', body={'bytesBase64Encoded': 'QUJD' * 10})
+    finally:
+        # Stopping the listener flushes the queue
+        request_log.configure()
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1
+    event = json.loads(lines[0])
+    assert event['event'] == 'vertex_request'
+    assert event['body']['bytesBase64Encoded']['size'] == 40
+    assert threading.current_thread().name not in writers
+
+
+def test_a_full_queue_drops_instead_of_blocking():
+    handler = request_log.NonBlockingQueueHandler(request_log.queue.Queue(1))
+    record = request_log.events.makeRecord('x', 20, __file__, 1, 'event', None, None)
+    handler.handle(record)
+    handler.handle(record)
+    assert handler.dropped == 1
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from token_cache import TokenCache
+
+
+def test_concurrent_callers_mint_once():
+    calls = []
+
+    def slow_minter():
+        calls.append(1)
+        time.sleep(0.2)
+        return f'token-{len(calls)}', time.time() + 3600
+
+    cache = TokenCache(minter=slow_minter)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get())) for _ in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert set(results) == {'token-1'}
+
+    cache.get()
+    assert cache.stats()['hits'] >= 1
+    assert cache.stats()['refreshes'] == 1
+
+
+def test_refreshes_in_background_before_expiry():
+    calls = []
+
+    def short_lived_minter():
+        calls.append(1)
+        return f'token-{len(calls)}', time.time() + 1.5
+
+    cache = TokenCache(minter=short_lived_minter, refresh_margin=1.0)
+    assert cache.get() == 'token-1'
+    time.sleep(1.3)
+    assert cache.get() == 'token-2'
+    assert cache.stats()['misses'] == 1
+
+
+def test_failed_refresh_is_counted():
+    def broken_minter():
+        raise ValueError('no credentials')
+
+    cache = TokenCache(minter=broken_minter, retry_interval=60)
+    try:
+        cache.get()
+        assert False, 'expected RuntimeError'
+    except RuntimeError as e:
+        assert 'no credentials' in str(e)
+    assert cache.stats()['refresh_failures'] == 1
+
+
+if __name__ == "__main__":
+    test_concurrent_callers_mint_once()
+    test_refreshes_in_background_before_expiry()
+    test_failed_refresh_is_counted()
+    print("✓ Token cache working correctly!")
@@ -0,0 +1,94 @@
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import time
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'test-token')
+
+import requests
+
+import app as proxy
+import async_app
+from blob_store import BlobStore
+from fake_vertex import start_fake_vertex
+from test_async_app import start_server, use_fake_vertex
+
+
+def sent_image(fake):
+    return fake.last_predict['instances'][0]['image']
+
+
+def test_multipart_upload_streams_through_the_async_front(tmp_path, monkeypatch):
+    monkeypatch.setattr(proxy, 'IMAGE_PREP', False)
+    monkeypatch.setattr(proxy, 'blob_store', BlobStore(str(tmp_path)))
+    fake = start_fake_vertex()
+    use_fake_vertex(fake, monkeypatch)
+    base_url, loop, runner = start_server(async_app.create_app(async_proxy=True))
+    image = os.urandom(3 * 1024 * 1024 + 1)
+    try:
+        response = requests.post(f'{base_url}/generate-video',
+                                 data={'prompt': 'a cat surfing', 'durationSeconds': '6'},
+                                 files={'image': ('cat.png', io.BytesIO(image), 'image/png')})
+        assert response.status_code == 200, response.text
+        assert response.json()['name'].startswith('projects/')
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        proxy.vertex.close()
+        fake.stop()
+
+    sent = sent_image(fake)
+    assert sent['mimeType'] == 'image/png'
+    assert base64.b64decode(sent['bytesBase64Encoded']) == image
+    assert fake.last_predict['parameters']['durationSeconds'] == 6
+    digest = hashlib.sha256(image).hexdigest()
+    assert os.path.getsize(tmp_path / digest[:2] / digest) == len(image)
+
+
+def test_raw_upload_is_forwarded_as_a_gcs_reference(tmp_path, monkeypatch):
+    monkeypatch.setattr(proxy, 'IMAGE_PREP', False)
+    monkeypatch.setattr(proxy, 'blob_store', BlobStore(str(tmp_path), gcs_prefix='gs://uploads/images/'))
+    fake = start_fake_vertex()
+    use_fake_vertex(fake, monkeypatch)
+    image = os.urandom(4096)
+    try:
+        response = proxy.app.test_client().post('/generate-video?prompt=hello&enhancePrompt=false', data=image,
+                                                content_type='image/jpeg')
+        assert response.status_code == 200, response.get_data(as_text=True)
+    finally:
+        proxy.vertex.close()
+        fake.stop()
+
+    digest = hashlib.sha256(image).hexdigest()
+    assert sent_image(fake) == {'gcsUri': f'gs://uploads/images/{digest[:2]}/{digest}', 'mimeType': 'image/jpeg'}
+    assert fake.last_predict['parameters']['enhancePrompt'] is False
+
+
+def test_oversized_upload_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(proxy, 'blob_store', BlobStore(str(tmp_path), max_bytes=1024))
+    response = proxy.app.test_client().post('/generate-video', data=os.urandom(2048), content_type='image/png')
+    assert response.status_code == 413
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('.upload-')]
+
+
+def test_store_evicts_expired_then_least_recently_used_blobs(tmp_path):
+    store = BlobStore(str(tmp_path), max_total_bytes=250, max_age=3600, min_age=60, evict_interval=3600)
+    now = time.time()
+    blobs = {name: store.put_bytes(name.encode() * 100, 'image/jpeg') for name in 'abcd'}
+    ages = {'a': 7200, 'b': 600, 'c': 300, 'd': 0}
+    for name, age in ages.items():
+        os.utime(store.path(blobs[name].digest), (now - age, now - age))
+    store.touch(blobs['b'].digest)
+
+    # Over the limit, so this write evicts: 'a' has expired, 'c' is the least recently
+    # used of the rest, and 'd' is too new to evict at all
+    store.put_derived(blobs['b'].digest, '720p', b'x' * 10, 'image/jpeg')
+    assert [os.path.exists(store.path(blobs[name].digest)) for name in 'abcd'] == [False, True, False, True]
+    assert store.get_derived(blobs['b'].digest, '720p') is not None
+    assert store.stats()['bytes'] == 210 and store.stats()['evictions'] == 2
+
+    os.unlink(store.get_derived(blobs['b'].digest, '720p').path)
+    store.evict()
+    assert not os.listdir(os.path.join(str(tmp_path), 'derived'))
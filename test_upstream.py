@@ -0,0 +1,53 @@
+import os
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'test-token')
+
+from fake_vertex import start_fake_vertex
+from upstream import VertexClient
+
+
+def test_connections_are_reused():
+    fake = start_fake_vertex()
+    client = VertexClient('test-project', 'us-central1', base_url=fake.base_url)
+    try:
+        operation = client.post('veo-3.0-fast-generate-001', 'predictLongRunning', 'token', {'instances': [{}]}).json()
+        for _ in range(20):
+            response = client.post('veo-3.0-fast-generate-001', 'fetchPredictOperation', 'token',
+                                   {'operationName': operation['name']})
+            assert response.status_code == 200
+            assert response.json()['done'] is True
+
+        assert fake.connections == 1
+        assert fake.requests == {'predictLongRunning': 1, 'fetchPredictOperation': 20}
+
+        host = client.stats()['hosts'][fake.base_url.split('//')[1]]
+        assert host['requests'] == 21
+        assert host['connections_opened'] == 1
+        assert host['in_flight'] == 0
+    finally:
+        client.close()
+        fake.stop()
+
+
+def test_check_operation_route_uses_shared_client(monkeypatch):
+    import app as proxy
+
+    fake = start_fake_vertex()
+    monkeypatch.setattr(proxy, 'vertex', VertexClient(proxy.PROJECT_ID, proxy.LOCATION, base_url=fake.base_url))
+    try:
+        client = proxy.app.test_client()
+        operation = client.post('/generate-video', json={'prompt': 'a cat surfing'}).get_json()
+        for _ in range(5):
+            response = client.post('/check-operation', json={'operationName': operation['name']})
+            assert response.status_code == 200
+        assert fake.connections == 1
+        assert client.get('/stats').get_json()['upstream']['base_url'] == fake.base_url
+    finally:
+        proxy.vertex.close()
+        fake.stop()
+
+
+if __name__ == "__main__":
+    test_connections_are_reused()
+    test_check_operation_route_uses_shared_client()
+    print("✓ Upstream client reuses pooled connections")
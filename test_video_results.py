@@ -0,0 +1,100 @@
+import asyncio
+import hashlib
+import os
+import threading
+
+os.environ.setdefault('VERTEX_ACCESS_TOKEN', 'test-token')
+
+import requests
+
+import app as proxy
+import async_app
+from blob_store import BlobStore
+from fake_vertex import fake_video, start_fake_vertex
+from operation_cache import OperationStatusCache
+from test_async_app import start_server, use_fake_vertex
+
+
+def use_fresh_stores(monkeypatch, tmp_path):
+    cache = OperationStatusCache()
+    cache.add_transform(lambda name, payload: proxy.extract_videos(proxy.video_store, payload))
+    monkeypatch.setattr(proxy, 'operation_cache', cache)
+    monkeypatch.setattr(proxy, 'video_store', BlobStore(str(tmp_path)))
+
+
+def test_inline_video_is_extracted_once_and_served_with_ranges(tmp_path, monkeypatch):
+    use_fresh_stores(monkeypatch, tmp_path)
+    fake = start_fake_vertex(inline_video_bytes=300_000)
+    use_fake_vertex(fake, monkeypatch)
+    client = proxy.app.test_client()
+    try:
+        name = client.post('/generate-video', json={'prompt': 'x'}).get_json()['name']
+        first = client.post('/check-operation', json={'operationName': name})
+        again = client.post('/check-operation', json={'operationName': name})
+    finally:
+        proxy.vertex.close()
+        fake.stop()
+
+    video = fake_video(name, 300_000)
+    digest = hashlib.sha256(video).hexdigest()
+    entry = first.get_json()['response']['videos'][0]
+    assert entry.pop('media')['status'] in ('pending', 'processing', 'ready')
+    assert entry == {'mimeType': 'video/mp4', 'sha256': digest, 'size': len(video), 'url': f'/videos/{digest}'}
+    assert again.get_json() == first.get_json()
+    assert len(again.data) < 1000
+
+    full = client.get(entry['url'])
+    assert full.status_code == 200
+    assert full.data == video
+    assert full.headers['Content-Length'] == str(len(video))
+    assert full.headers['Accept-Ranges'] == 'bytes'
+
+    partial = client.get(entry['url'], headers={'Range': 'bytes=1000-1999'})
+    assert partial.status_code == 206
+    assert partial.data == video[1000:2000]
+    assert partial.headers['Content-Range'] == f'bytes 1000-1999/{len(video)}'
+
+    assert client.get(entry['url'], headers={'If-None-Match': full.headers['ETag']}).status_code == 304
+    assert client.get('/videos/' + '0' * 64).status_code == 404
+    assert client.get('/videos/..%2Fetc').status_code == 404
+
+
+def test_async_front_serves_videos_natively(tmp_path, monkeypatch):
+    use_fresh_stores(monkeypatch, tmp_path)
+    video = os.urandom(100_000)
+    digest = proxy.video_store.put_bytes(video, 'video/mp4').digest
+    base_url, loop, runner = start_server(async_app.create_app(async_proxy=False))
+    try:
+        response = requests.get(f'{base_url}/videos/{digest}', headers={'Range': 'bytes=-500'})
+        assert response.status_code == 206
+        assert response.content == video[-500:]
+        etag = requests.get(f'{base_url}/videos/{digest}').headers['ETag']
+        assert requests.get(f'{base_url}/videos/{digest}', headers={'If-None-Match': etag}).status_code == 304
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def test_async_status_polls_annotate_media_off_the_event_loop(tmp_path, monkeypatch):
+    use_fresh_stores(monkeypatch, tmp_path)
+    fake = start_fake_vertex(inline_video_bytes=10_000)
+    use_fake_vertex(fake, monkeypatch)
+    threads = []
+    annotate = proxy.media_pipeline.annotate
+
+    def recording_annotate(payload):
+        threads.append(threading.current_thread().name)
+        return annotate(payload)
+
+    monkeypatch.setattr(proxy.media_pipeline, 'annotate', recording_annotate)
+    base_url, loop, runner = start_server(async_app.create_app(async_proxy=True))
+    try:
+        name = requests.post(f'{base_url}/generate-video', json={'prompt': 'x'}).json()['name']
+        result = requests.post(f'{base_url}/check-operation', json={'operationName': name}).json()
+        assert result['response']['videos'][0]['media']['status'] in ('pending', 'processing', 'ready')
+        assert threads and all(thread.startswith('wsgi') for thread in threads)
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        proxy.vertex.close()
+        fake.stop()
@@ -0,0 +1,44 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import app as proxy
+import webhook_handler
+from test_webhook_queue import renewal
+
+
+def test_concurrent_retries_grant_credits_once(db_engine, monkeypatch):
+    monkeypatch.setattr(webhook_handler, 'recent_events', webhook_handler.RecentEvents())
+    client = proxy.app.test_client()
+    user_id = str(uuid.uuid4())
+    client.post('/register-user', json={'app_user_id': user_id, 'credits': 0})
+    event = renewal(str(uuid.uuid4()), user_id)
+
+    def deliver(_):
+        return proxy.app.test_client().post('/PostBack', json=event).get_json()['status']
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        statuses = list(pool.map(deliver, range(40)))
+
+    assert statuses.count('processed') == 1
+    assert statuses.count('already_processed') == 39
+    assert client.get(f'/get-credits/{user_id}').get_json()['credits'] == 10
+
+
+def test_recent_events_answer_retries_without_the_database(db_engine, monkeypatch):
+    recent = webhook_handler.RecentEvents(max_entries=2)
+    monkeypatch.setattr(webhook_handler, 'recent_events', recent)
+    client = proxy.app.test_client()
+    user_id = str(uuid.uuid4())
+    client.post('/register-user', json={'app_user_id': user_id, 'credits': 0})
+    events = [renewal(str(uuid.uuid4()), user_id) for _ in range(3)]
+
+    for event in events:
+        assert client.post('/PostBack', json=event).get_json()['status'] == 'processed'
+    assert recent.stats()['entries'] == 2
+
+    # The newest ids are in memory; the evicted one falls through to ON CONFLICT
+    assert client.post('/PostBack', json=events[2]).get_json()['status'] == 'already_processed'
+    assert recent.stats()['hits'] == 1
+    assert client.post('/PostBack', json=events[0]).get_json()['status'] == 'already_processed'
+    assert recent.stats()['hits'] == 1
+    assert client.get(f'/get-credits/{user_id}').get_json()['credits'] == 30
@@ -0,0 +1,122 @@
+import time
+import uuid
+
+from sqlalchemy import event
+
+import app as proxy
+from webhook_queue import WebhookQueueWorker
+
+
+def renewal(event_id, user_id, product_id='com.vemix.weekly'):
+    return {
+        'api_version': '1.0',
+        'event': {
+            'id': event_id,
+            'type': 'RENEWAL',
+            'app_user_id': user_id,
+            'product_id': product_id,
+            'environment': 'PRODUCTION',
+            'event_timestamp_ms': 1754692278482,
+        }
+    }
+
+
+def test_postback_acks_immediately_and_worker_applies_in_batches(db_engine, monkeypatch):
+    worker = WebhookQueueWorker(batch_size=25, poll_interval=0.05)
+    monkeypatch.setattr(proxy, 'WEBHOOK_ASYNC', True)
+    monkeypatch.setattr(proxy, 'webhook_worker', worker)
+    client = proxy.app.test_client()
+
+    user_id = str(uuid.uuid4())
+    client.post('/register-user', json={'app_user_id': user_id, 'credits': 0})
+
+    events = [renewal(str(uuid.uuid4()), user_id) for _ in range(60)]
+    # RevenueCat retries: the same event delivered again, inside and across batches
+    events += events[:5]
+    events.append({'event': {'id': str(uuid.uuid4()), 'type': 'CANCELLATION', 'app_user_id': user_id}})
+
+    for event in events:
+        response = client.post('/PostBack', json=event)
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'queued'
+
+    deadline = time.monotonic() + 10
+    while worker.stats()['depth'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    worker.stop()
+
+    stats = worker.stats()
+    assert stats['depth'] == 0
+    assert stats['lag_seconds'] == 0.0
+    assert stats['outcomes'] == {'processed': 60, 'already_processed': 5, 'ignored': 1}
+    assert stats['batches'] >= 3
+    assert client.get(f'/get-credits/{user_id}').get_json()['credits'] == 600
+
+
+def test_bad_payload_does_not_block_the_batch(db_engine):
+    worker = WebhookQueueWorker(batch_size=10, max_attempts=2)
+    user_id = str(uuid.uuid4())
+    proxy.app.test_client().post('/register-user', json={'app_user_id': user_id, 'credits': 0})
+
+    from models import SessionLocal
+    from webhook_queue import enqueue_webhook
+    db = SessionLocal()
+    try:
+        enqueue_webhook(db, renewal(str(uuid.uuid4()), user_id))
+        enqueue_webhook(db, {'event': 'not-an-object'})
+        enqueue_webhook(db, renewal(str(uuid.uuid4()), user_id, 'com.vemix.yearly'))
+    finally:
+        db.close()
+
+    worker.drain_once()
+    worker.drain_once()
+    stats = worker.stats()
+    assert stats['outcomes']['processed'] == 2
+    assert stats['outcomes']['failed'] == 2
+    assert stats['dead_letters'] == 1
+    assert stats['depth'] == 0
+    assert proxy.app.test_client().get(f'/get-credits/{user_id}').get_json()['credits'] == 70
+
+
+def test_batch_is_applied_with_set_based_statements(db_engine):
+    client = proxy.app.test_client()
+    users = [str(uuid.uuid4()) for _ in range(3)]
+    for user_id in users:
+        client.post('/register-user', json={'app_user_id': user_id, 'credits': 0})
+    missing = str(uuid.uuid4())
+
+    from models import SessionLocal, WebhookEvent
+    from webhook_queue import enqueue_webhook
+    events = [renewal(str(uuid.uuid4()), user_id) for user_id in users * 10]
+    events += [renewal(str(uuid.uuid4()), missing), events[0]]
+    db = SessionLocal()
+    try:
+        for payload in events:
+            enqueue_webhook(db, payload)
+    finally:
+        db.close()
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split()[0:3])
+
+    event.listen(db_engine, 'before_cursor_execute', record)
+    try:
+        worker = WebhookQueueWorker(batch_size=100)
+        assert worker.drain_once() == 32
+    finally:
+        event.remove(db_engine, 'before_cursor_execute', record)
+
+    assert statements.count(['INSERT', 'INTO', 'webhook_events']) == 1
+    assert sum(1 for statement in statements if statement[0] in ('UPDATE', 'WITH')) == 2
+    assert worker.stats()['outcomes'] == {'processed': 31, 'already_processed': 1}
+    assert [client.get(f'/get-credits/{user_id}').get_json()['credits'] for user_id in users] == [100] * 3
+
+    # The event for a user that didn't exist granted nothing, so a replay can still grant it
+    db = SessionLocal()
+    try:
+        granted = db.query(WebhookEvent.credits_granted).filter_by(app_user_id=missing).scalar()
+    finally:
+        db.close()
+    assert granted == 0
@@ -0,0 +1,96 @@
+import time
+import uuid
+
+import app as proxy
+import webhook_handler
+from conftest import balance, register
+from test_webhook_queue import renewal
+from webhook_replay import WebhookReplay
+
+
+def test_replay_applies_rule_changes_and_late_users_once(db_engine, monkeypatch):
+    monkeypatch.setattr(webhook_handler, 'recent_events', webhook_handler.RecentEvents())
+    client = proxy.app.test_client()
+    early = register(client)
+    late = str(uuid.uuid4())
+    for _ in range(3):
+        client.post('/PostBack', json=renewal(str(uuid.uuid4()), early))
+    # Arrives before the user registers: stored, but nothing granted
+    client.post('/PostBack', json=renewal(str(uuid.uuid4()), late))
+    client.post('/register-user', json={'app_user_id': late, 'credits': 0})
+    assert (balance(client, early), balance(client, late)) == (30, 0)
+
+    monkeypatch.setitem(webhook_handler.RENEWAL_CREDITS, 'com.vemix.weekly', 15)
+    progress = []
+    dry = WebhookReplay(dry_run=True, batch_size=2, workers=2, progress=progress.append).run()
+    assert dry['scanned'] == 4 and dry['changed'] == 4 and dry['credits_delta'] == 30
+    assert dry['batches'] == 2 and len(progress) == 2
+    assert (balance(client, early), balance(client, late)) == (30, 0)
+
+    stats = WebhookReplay(batch_size=2, workers=2).run()
+    assert stats['state'] == 'finished'
+    assert stats['changed'] == 4 and stats['credits_delta'] == 30
+    assert (balance(client, early), balance(client, late)) == (45, 15)
+
+    again = WebhookReplay(batch_size=2, workers=2).run()
+    assert again['unchanged'] == 4 and 'changed' not in again
+    assert (balance(client, early), balance(client, late)) == (45, 15)
+
+
+def test_replay_filters_and_clawback(db_engine, monkeypatch):
+    monkeypatch.setattr(webhook_handler, 'recent_events', webhook_handler.RecentEvents())
+    client = proxy.app.test_client()
+    spender, other = register(client), register(client)
+    client.post('/PostBack', json=renewal(str(uuid.uuid4()), spender, product_id='com.vemix.yearly'))
+    client.post('/PostBack', json=renewal(str(uuid.uuid4()), other, product_id='com.vemix.yearly'))
+    client.post('/use-credits', json={'app_user_id': spender, 'credits': 55})
+
+    monkeypatch.setitem(webhook_handler.RENEWAL_CREDITS, 'com.vemix.yearly', 50)
+    skipped = WebhookReplay(app_user_id=spender).run()
+    assert skipped['scanned'] == 1 and skipped['clawback_skipped'] == 1
+
+    clawed = WebhookReplay(app_user_id=spender, clawback=True).run()
+    assert clawed['changed'] == 1 and clawed['credits_delta'] == -10
+    # Only 5 credits were left to take back
+    assert (balance(client, spender), balance(client, other)) == (0, 60)
+
+
+def test_admin_replay_endpoint(db_engine, monkeypatch):
+    monkeypatch.setattr(webhook_handler, 'recent_events', webhook_handler.RecentEvents())
+    monkeypatch.setattr(proxy, 'ADMIN_API_KEY', 'secret')
+    client = proxy.app.test_client()
+    user = register(client)
+    client.post('/PostBack', json=renewal(str(uuid.uuid4()), user))
+    monkeypatch.setitem(webhook_handler.RENEWAL_CREDITS, 'com.vemix.weekly', 12)
+    headers = {'X-Admin-Key': 'secret'}
+
+    assert client.post('/admin/webhook-replays', json={}).status_code == 401
+    assert client.post('/admin/webhook-replays', json={'since': 'yesterday'}, headers=headers).status_code == 400
+    response = client.post('/admin/webhook-replays', json={'event_type': 'RENEWAL', 'since': '2020-01-01T00:00:00Z'},
+                           headers=headers)
+    assert response.status_code == 202
+    status_url = response.get_json()['status_url']
+
+    deadline = time.time() + 10
+    while (status := client.get(status_url, headers=headers).get_json())['state'] != 'finished':
+        assert time.time() < deadline, status
+        time.sleep(0.05)
+    assert status['changed'] == 1 and status['filters']['event_type'] == 'RENEWAL'
+    assert balance(client, user) == 12
+
+
+def test_admin_replay_refused_without_an_admin_key_configured(db_engine, monkeypatch):
+    monkeypatch.setattr(webhook_handler, 'recent_events', webhook_handler.RecentEvents())
+    monkeypatch.setattr(proxy, 'ADMIN_API_KEY', '')
+    client = proxy.app.test_client()
+    user = register(client)
+    client.post('/PostBack', json=renewal(str(uuid.uuid4()), user))
+    monkeypatch.setitem(webhook_handler.RENEWAL_CREDITS, 'com.vemix.weekly', 12)
+    jobs = proxy.replay_jobs.stats()
+
+    assert client.post('/admin/webhook-replays', json={'event_type': 'RENEWAL'}).status_code == 503
+    assert client.post('/admin/webhook-replays', json={}, headers={'X-Admin-Key': ''}).status_code == 503
+    assert client.get('/admin/webhook-replays/1').status_code == 503
+    assert client.delete('/admin/webhook-replays/1').status_code == 503
+    assert proxy.replay_jobs.stats() == jobs
+    assert balance(client, user) == 10
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import timezone
+
+logger = logging.getLogger(__name__)
+
+TOKEN_REFRESH_MARGIN = float(os.getenv('TOKEN_REFRESH_MARGIN', 300))
+TOKEN_RETRY_INTERVAL = float(os.getenv('TOKEN_RETRY_INTERVAL', 10))
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+
+def mint_google_token():
+    """Mint an OAuth access token for Vertex AI.
+
+    VERTEX_ACCESS_TOKEN short-circuits minting (local runs against fake_vertex.py),
+    SERVICE_ACCOUNT_JSON is used when set, otherwise Application Default Credentials.
+    Returns (token, expires_at) where expires_at is a unix timestamp or None.
+    """
+    static_token = os.getenv('VERTEX_ACCESS_TOKEN')
+    if static_token:
+        return static_token, None
+
+    import google.auth
+    import google.auth.transport.requests
+    from google.oauth2 import service_account
+
+    service_account_json = os.getenv('SERVICE_ACCOUNT_JSON')
+    if service_account_json:
+        credentials = service_account.Credentials.from_service_account_info(
+            json.loads(service_account_json), scopes=SCOPES)
+    else:
+        credentials, _ = google.auth.default(scopes=SCOPES)
+
+    credentials.refresh(google.auth.transport.requests.Request())
+    expires_at = None
+    if credentials.expiry is not None:
+        expires_at = credentials.expiry.replace(tzinfo=timezone.utc).timestamp()
+    return credentials.token, expires_at
+
+
+class TokenCache:
+    """Process-wide access token holder.
+
+    Requests read the token from memory; a daemon thread re-mints it
+    `refresh_margin` seconds before expiry. Minting is single-flight: when the
+    cache is cold or expired, one caller mints while the others wait for it.
+    """
+
+    def __init__(self, minter=mint_google_token, refresh_margin=TOKEN_REFRESH_MARGIN,
+                 retry_interval=TOKEN_RETRY_INTERVAL):
+        self.minter = minter
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+
+        self._cond = threading.Condition()
+        self._token = None
+        self._expires_at = None
+        self._minting = False
+        self._last_error = None
+        self._refresher = None
+        self._counters = {'hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_failures': 0}
+
+    def get(self):
+        with self._cond:
+            if self._token is not None and not self._expired():
+                self._counters['hits'] += 1
+                return self._token
+            self._counters['misses'] += 1
+
+            while self._minting:
+                self._cond.wait()
+            if self._token is not None and not self._expired():
+                return self._token
+            self._minting = True
+
+        try:
+            self._mint()
+        finally:
+            with self._cond:
+                self._minting = False
+                self._cond.notify_all()
+            self._ensure_refresher()
+
+        with self._cond:
+            if self._token is None or self._expired():
+                raise RuntimeError(f'Unable to obtain access token: {self._last_error}')
+            return self._token
+
+    def peek(self):
+        """Return the cached token without ever blocking, or None if it must be minted."""
+        with self._cond:
+            if self._token is not None and not self._expired():
+                self._counters['hits'] += 1
+                return self._token
+        return None
+
+    def _expired(self):
+        return self._expires_at is not None and time.time() >= self._expires_at
+
+    def _mint(self):
+        try:
+            token, expires_at = self.minter()
+        except Exception as e:
+            logger.error(f"Access token refresh failed: {str(e)}")
+            with self._cond:
+                self._counters['refresh_failures'] += 1
+                self._last_error = str(e)
+            return False
+
+        with self._cond:
+            self._token = token
+            self._expires_at = expires_at
+            self._last_error = None
+            self._counters['refreshes'] += 1
+        return True
+
+    def _ensure_refresher(self):
+        with self._cond:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name='token-refresher', daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            with self._cond:
+                if self._expires_at is None and self._token is not None:
+                    # Static token, nothing to refresh
+                    return
+                if self._expires_at is None or self._last_error:
+                    delay = self.retry_interval
+                else:
+                    delay = max(self._expires_at - self.refresh_margin - time.time(), 1.0)
+            time.sleep(delay)
+
+            with self._cond:
+                if self._minting:
+                    continue
+                self._minting = True
+            try:
+                self._mint()
+            finally:
+                with self._cond:
+                    self._minting = False
+                    self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats['has_token'] = self._token is not None
+            stats['expires_in'] = round(self._expires_at - time.time(), 1) if self._expires_at else None
+            stats['last_error'] = self._last_error
+        return stats
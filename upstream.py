@@ -0,0 +1,374 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import upstream_breakers
+from metrics import observe_hedge, observe_upstream
+
+VERTEX_POOL_CONNECTIONS = int(os.getenv('VERTEX_POOL_CONNECTIONS', 4))
+VERTEX_POOL_MAXSIZE = int(os.getenv('VERTEX_POOL_MAXSIZE', 16))
+VERTEX_CONNECT_TIMEOUT = float(os.getenv('VERTEX_CONNECT_TIMEOUT', 5))
+VERTEX_READ_TIMEOUT = float(os.getenv('VERTEX_READ_TIMEOUT', 60))
+VERTEX_ASYNC_POOL_LIMIT = int(os.getenv('VERTEX_ASYNC_POOL_LIMIT', 200))
+VERTEX_HEDGE = os.getenv('VERTEX_HEDGE', '0') == '1'
+VERTEX_HEDGE_PERCENTILE = float(os.getenv('VERTEX_HEDGE_PERCENTILE', 95))
+VERTEX_HEDGE_MIN_DELAY = float(os.getenv('VERTEX_HEDGE_MIN_DELAY', 0.05))
+VERTEX_HEDGE_MIN_SAMPLES = int(os.getenv('VERTEX_HEDGE_MIN_SAMPLES', 20))
+# Hedges allowed as a fraction of hedgeable calls, so a slow upstream isn't hit with double load
+VERTEX_HEDGE_BUDGET = float(os.getenv('VERTEX_HEDGE_BUDGET', 0.1))
+VERTEX_HEDGE_THREADS = int(os.getenv('VERTEX_HEDGE_THREADS', 32))
+
+
+def vertex_base_url(location, base_url=None):
+    return (base_url or os.getenv('VERTEX_API_BASE')
+            or f"https://{location}-aiplatform.googleapis.com").rstrip('/')
+
+
+def new_host_stats():
+    return {'requests': 0, 'in_flight': 0, 'errors': 0, 'timeouts': 0, 'total_seconds': 0.0}
+
+
+def finish_host_stats(hosts):
+    for entry in hosts.values():
+        completed = entry['requests'] - entry['in_flight']
+        entry['avg_latency_ms'] = round(entry['total_seconds'] * 1000 / completed, 2) if completed else 0.0
+        del entry['total_seconds']
+    return hosts
+
+
+class HedgePolicy:
+    """When to send a second copy of an idempotent call.
+
+    Keeps the last `window` successful latencies per (model, verb); a
+    hedge goes out once the first request has taken longer than their
+    `percentile`, as long as the breaker is closed and hedges stay
+    within `budget` of calls.
+    """
+
+    def __init__(self, enabled=VERTEX_HEDGE, percentile=VERTEX_HEDGE_PERCENTILE,
+                 min_delay=VERTEX_HEDGE_MIN_DELAY, min_samples=VERTEX_HEDGE_MIN_SAMPLES,
+                 budget=VERTEX_HEDGE_BUDGET, window=200):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget = budget
+        self.window = window
+
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._counters = {'calls': 0, 'hedged': 0, 'hedge_won': 0, 'over_budget': 0}
+
+    def record(self, model_id, verb, seconds):
+        with self._lock:
+            latencies = self._latencies.get((model_id, verb))
+            if latencies is None:
+                latencies = self._latencies[(model_id, verb)] = deque(maxlen=self.window)
+            latencies.append(seconds)
+
+    def delay(self, model_id, verb, breaker):
+        """Seconds to wait before hedging this call, or None to not hedge it."""
+        if not self.enabled or breaker.state != 'closed':
+            return None
+        with self._lock:
+            self._counters['calls'] += 1
+            latencies = self._latencies.get((model_id, verb))
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            if self._counters['hedged'] >= self.budget * self._counters['calls']:
+                self._counters['over_budget'] += 1
+                return None
+            ordered = sorted(latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+    def sent(self, model_id, verb):
+        with self._lock:
+            self._counters['hedged'] += 1
+        observe_hedge(model_id, verb, 'sent')
+
+    def won(self, model_id, verb):
+        with self._lock:
+            self._counters['hedge_won'] += 1
+        observe_hedge(model_id, verb, 'won')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['enabled'] = self.enabled
+        return stats
+
+
+class VertexClient:
+    """Shared keep-alive HTTP client for the Vertex AI publisher model endpoints.
+
+    One requests.Session is reused by every handler thread, so TCP+TLS
+    connections to the regional endpoint are pooled instead of re-opened
+    on every proxy call.
+    """
+
+    def __init__(self, project_id, location, base_url=None,
+                 pool_connections=VERTEX_POOL_CONNECTIONS,
+                 pool_maxsize=VERTEX_POOL_MAXSIZE,
+                 connect_timeout=VERTEX_CONNECT_TIMEOUT,
+                 read_timeout=VERTEX_READ_TIMEOUT,
+                 breakers=upstream_breakers, hedging=None):
+        self.project_id = project_id
+        self.location = location
+        self.base_url = vertex_base_url(location, base_url)
+        self.timeout = (connect_timeout, read_timeout)
+        self.breakers = breakers
+        self.hedging = hedging or HedgePolicy()
+        self._hedge_executor = None
+
+        self.adapter = HTTPAdapter(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=False)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        self._lock = threading.Lock()
+        self._host_stats = {}
+
+    def model_url(self, model_id, verb):
+        return (f"{self.base_url}/v1/projects/{self.project_id}/locations/{self.location}"
+                f"/publishers/google/models/{model_id}:{verb}")
+
+    def post(self, model_id, verb, access_token, payload):
+        url = self.model_url(model_id, verb)
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json',
+        }
+        return self._send(url, headers, model_id, verb, json=payload)
+
+    def post_body(self, model_id, verb, access_token, body):
+        """Like post(), but `body` is already-encoded JSON: bytes or a file-like object with len()."""
+        url = self.model_url(model_id, verb)
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json',
+        }
+        return self._send(url, headers, model_id, verb, data=body)
+
+    def post_hedged(self, model_id, verb, access_token, payload):
+        """post() for idempotent calls: sends a second copy if the first is slower than usual.
+
+        Whichever completes first is returned; the other finishes in the
+        background and is discarded.
+        """
+        delay = self.hedging.delay(model_id, verb, self.breakers.get(model_id, verb))
+        if delay is None:
+            return self.post(model_id, verb, access_token, payload)
+
+        executor = self._executor()
+        primary = executor.submit(self.post, model_id, verb, access_token, payload)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        self.hedging.sent(model_id, verb)
+        hedge = executor.submit(self.post, model_id, verb, access_token, payload)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.hedging.won(model_id, verb)
+                    return future.result()
+        return primary.result()
+
+    def _executor(self):
+        with self._lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=VERTEX_HEDGE_THREADS,
+                                                          thread_name_prefix='vertex-hedge')
+            return self._hedge_executor
+
+    def _send(self, url, headers, model_id, verb, **body):
+        breaker = self.breakers.get(model_id, verb)
+        breaker.allow()
+        host = urlsplit(url).netloc
+        stats = self._stats_for(host)
+        with self._lock:
+            stats['requests'] += 1
+            stats['in_flight'] += 1
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.post(url, headers=headers, timeout=self.timeout, **body)
+            status = response.status_code
+        except requests.exceptions.Timeout:
+            status = 'timeout'
+            with self._lock:
+                stats['timeouts'] += 1
+            raise
+        except requests.exceptions.RequestException:
+            with self._lock:
+                stats['errors'] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats['in_flight'] -= 1
+                stats['total_seconds'] += elapsed
+            breaker.record(status)
+            if status == 200:
+                self.hedging.record(model_id, verb, elapsed)
+            observe_upstream(model_id, verb, status, elapsed)
+        return response
+
+    def _stats_for(self, host):
+        with self._lock:
+            stats = self._host_stats.get(host)
+            if stats is None:
+                stats = new_host_stats()
+                self._host_stats[host] = stats
+            return stats
+
+    def stats(self):
+        """Per-host request counters merged with urllib3 connection pool state."""
+        with self._lock:
+            hosts = {host: dict(stats) for host, stats in self._host_stats.items()}
+
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+            entry = hosts.setdefault(host, new_host_stats())
+            entry['connections_opened'] = entry.get('connections_opened', 0) + pool.num_connections
+            entry['idle_connections'] = entry.get('idle_connections', 0) + (pool.pool.qsize() if pool.pool else 0)
+            entry['pool_maxsize'] = pool.pool.maxsize if pool.pool else 0
+
+        return {
+            'base_url': self.base_url,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'hosts': finish_host_stats(hosts),
+            'hedging': self.hedging.stats(),
+        }
+
+    def close(self):
+        self.session.close()
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+
+
+class AsyncVertexClient:
+    """asyncio counterpart of VertexClient used by async_app.py.
+
+    A single aiohttp.ClientSession multiplexes up to `pool_limit` concurrent
+    keep-alive connections on the event loop. Must be started and closed
+    from inside the running loop.
+    """
+
+    def __init__(self, project_id, location, base_url=None,
+                 pool_limit=VERTEX_ASYNC_POOL_LIMIT,
+                 connect_timeout=VERTEX_CONNECT_TIMEOUT,
+                 read_timeout=VERTEX_READ_TIMEOUT,
+                 breakers=upstream_breakers, hedging=None):
+        self.project_id = project_id
+        self.location = location
+        self.base_url = vertex_base_url(location, base_url)
+        self.pool_limit = pool_limit
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.breakers = breakers
+        self.hedging = hedging or HedgePolicy()
+        self.session = None
+        self._host_stats = {}
+
+    model_url = VertexClient.model_url
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_limit, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def post_hedged(self, model_id, verb, access_token, payload):
+        """post() for idempotent calls; see VertexClient.post_hedged(). The slower copy is cancelled."""
+        delay = self.hedging.delay(model_id, verb, self.breakers.get(model_id, verb))
+        if delay is None:
+            return await self.post(model_id, verb, access_token, payload)
+
+        primary = asyncio.ensure_future(self.post(model_id, verb, access_token, payload))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        self.hedging.sent(model_id, verb)
+        hedge = asyncio.ensure_future(self.post(model_id, verb, access_token, payload))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedging.won(model_id, verb)
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def post(self, model_id, verb, access_token, payload):
+        """Return (status_code, body_text)."""
+        breaker = self.breakers.get(model_id, verb)
+        breaker.allow()
+        url = self.model_url(model_id, verb)
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json',
+        }
+        stats = self._host_stats.setdefault(urlsplit(url).netloc, new_host_stats())
+        stats['requests'] += 1
+        stats['in_flight'] += 1
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            async with self.session.post(url, headers=headers, json=payload) as response:
+                status = response.status
+                return response.status, await response.text()
+        except TimeoutError:
+            status = 'timeout'
+            stats['timeouts'] += 1
+            raise
+        except aiohttp.ClientError:
+            stats['errors'] += 1
+            raise
+        except asyncio.CancelledError:
+            # e.g. the losing copy of a hedged call; says nothing about upstream health
+            status = None
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stats['in_flight'] -= 1
+            stats['total_seconds'] += elapsed
+            breaker.record(status)
+            if status == 200:
+                self.hedging.record(model_id, verb, elapsed)
+            observe_upstream(model_id, verb, status or 'cancelled', elapsed)
+
+    def stats(self):
+        hosts = {host: dict(stats) for host, stats in self._host_stats.items()}
+        return {
+            'base_url': self.base_url,
+            'pool_limit': self.pool_limit,
+            'hosts': finish_host_stats(hosts),
+            'hedging': self.hedging.stats(),
+        }
@@ -0,0 +1,69 @@
+"""Moves finished videos out of operation payloads and into a blob store.
+
+Veo returns generated videos either as gs:// URIs or inline as
+`bytesBase64Encoded`. Inline videos are decoded once, in chunks, into a
+content-addressed store and replaced in the cached payload by a
+reference to /videos/<sha256>, which serves them with Range and ETag
+support. Status polls then stay a few hundred bytes. The store is
+capped (VIDEO_STORE_MAX_BYTES, VIDEO_STORE_MAX_AGE); an evicted video
+answers 404 like any unknown digest.
+"""
+import base64
+import binascii
+import os
+import re
+import tempfile
+
+VIDEO_STORE_DIR = os.getenv('VIDEO_STORE_DIR', os.path.join(tempfile.gettempdir(), 'veo-proxy-videos'))
+VIDEO_MAX_BYTES = int(os.getenv('VIDEO_MAX_BYTES', 500 * 1024 * 1024))
+# Whole store, media pipeline outputs included; LRU-evicted beyond this (0 = no limit)
+VIDEO_STORE_MAX_BYTES = int(os.getenv('VIDEO_STORE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+VIDEO_STORE_MAX_AGE = float(os.getenv('VIDEO_STORE_MAX_AGE', 24 * 3600))
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class Base64Reader:
+    """File-like view of the bytes behind a base64 string, decoded slice by slice."""
+
+    def __init__(self, text):
+        self.text = text
+        self.offset = 0
+
+    def read(self, size=-1):
+        remaining = len(self.text) - self.offset
+        if remaining <= 0:
+            return b''
+        # Whole 4-character groups, so every slice decodes on its own
+        take = remaining if size is None or size < 0 else min(remaining, max(4, size * 4 // 3 // 4 * 4))
+        chunk = self.text[self.offset:self.offset + take]
+        self.offset += take
+        return base64.b64decode(chunk, validate=True)
+
+
+def video_url(digest):
+    return f'/videos/{digest}'
+
+
+def extract_videos(store, payload):
+    """Return `payload` with inline videos stored and replaced by /videos/ references."""
+    videos = ((payload.get('response') or {}).get('videos') or []) if isinstance(payload, dict) else []
+    if not any(isinstance(video.get('bytesBase64Encoded'), str) for video in videos):
+        return payload
+
+    extracted = []
+    for video in videos:
+        encoded = video.get('bytesBase64Encoded')
+        if not isinstance(encoded, str):
+            extracted.append(video)
+            continue
+        try:
+            blob = store.put_stream(Base64Reader(encoded), video.get('mimeType', 'video/mp4'))
+        except binascii.Error:
+            extracted.append(video)
+            continue
+        entry = {key: value for key, value in video.items() if key != 'bytesBase64Encoded'}
+        entry.update({'sha256': blob.digest, 'size': blob.size, 'url': video_url(blob.digest)})
+        extracted.append(entry)
+
+    return {**payload, 'response': {**payload['response'], 'videos': extracted}}
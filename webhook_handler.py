@@ -1,32 +1,102 @@
 import hashlib
 import hmac
+import os
+import threading
+import uuid
+from collections import OrderedDict
 from datetime import datetime
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
+from balance_cache import balance_cache
+from credits import apply_credit_deltas
 from models import WebhookEvent, User
 import logging
 
 logger = logging.getLogger(__name__)
 
-def process_webhook_event(event_data: dict, db: Session):
-    # Extract event data from RevenueCat webhook format
+WEBHOOK_RECENT_EVENTS = int(os.getenv('WEBHOOK_RECENT_EVENTS', 10000))
+
+RENEWAL_CREDITS = {
+    "com.vemix.weekly": 10,
+    "com.vemix.yearly": 60,
+}
+
+
+class RecentEvents:
+    """Bounded LRU of event ids known to be committed to webhook_events.
+
+    RevenueCat retries aggressively; ids in here are answered without a
+    database round trip. Only add ids after their transaction commits.
+    """
+
+    def __init__(self, max_entries=WEBHOOK_RECENT_EVENTS):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._ids = OrderedDict()
+        self._counters = {'hits': 0, 'misses': 0}
+
+    def seen(self, event_id):
+        with self._lock:
+            if event_id in self._ids:
+                self._ids.move_to_end(event_id)
+                self._counters['hits'] += 1
+                return True
+            self._counters['misses'] += 1
+            return False
+
+    def add(self, event_id):
+        if event_id is None:
+            return
+        with self._lock:
+            self._ids[event_id] = True
+            self._ids.move_to_end(event_id)
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._ids)
+        return stats
+
+
+recent_events = RecentEvents()
+
+
+def _insert(db: Session, model):
+    dialect = postgresql if db.get_bind().dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model)
+
+
+def insert_event(db: Session, values: dict):
+    """INSERT ... ON CONFLICT (event_id) DO NOTHING RETURNING id.
+
+    Returns the new row id, or None if the event was already stored. The
+    unique index decides, so concurrent retries cannot both get through.
+    """
+    stmt = (
+        _insert(db, WebhookEvent)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=[WebhookEvent.event_id])
+        .returning(WebhookEvent.id)
+    )
+    return db.execute(stmt).scalar_one_or_none()
+
+
+def credits_for_event(event: dict):
+    """Credits an event is worth under the current rules (RENEWAL_CREDITS)."""
+    if event.get('type') != "RENEWAL":
+        return 0
+    return RENEWAL_CREDITS.get(event.get('product_id'), 0)
+
+
+def event_row(event_data: dict):
+    """webhook_events values for a RENEWAL payload and the user UUID its credits go to (or None)."""
     event = event_data.get('event', {})
-    event_type = event.get('type')
-    event_id = event.get('id')
     app_user_id = event.get('app_user_id')
     product_id = event.get('product_id')
-    
-    # Only process RENEWAL events
-    if event_type != "RENEWAL":
-        logger.info(f"Ignoring non-renewal event type: {event_type}")
-        return {"status": "ignored", "event_type": event_type}
-    
-    # Check if event already processed
-    existing_event = db.query(WebhookEvent).filter_by(event_id=event_id).first()
-    if existing_event:
-        logger.info(f"Event {event_id} already processed")
-        return {"status": "already_processed"}
-    
-    # Store webhook event
+
     # Handle event_timestamp_ms - RevenueCat sends milliseconds as integer
     event_timestamp_ms = event.get('event_timestamp_ms')
     if event_timestamp_ms:
@@ -41,42 +111,150 @@ def process_webhook_event(event_data: dict, db: Session):
                 event_timestamp = datetime.utcnow()
     else:
         event_timestamp = datetime.utcnow()
-    
-    webhook_event = WebhookEvent(
-        event_id=event_id,
-        event_type=event_type,
-        app_user_id=app_user_id,
-        product_id=product_id,
-        environment=event.get('environment', 'production'),
-        event_timestamp=event_timestamp,
-        payload=event_data
-    )
-    db.add(webhook_event)
-    
-    # Process credits for renewal
+
+    # Parse app_user_id as UUID up front so the row records what is actually granted
+    user_uuid = None
     if app_user_id and product_id:
         try:
-            # Try to parse app_user_id as UUID
-            import uuid
             user_uuid = uuid.UUID(app_user_id)
-            user = db.query(User).filter(User.id == user_uuid).first()
-            
-            if user:
-                # Add credits based on product_id
-                if product_id == "com.vemix.weekly":
-                    user.credits += 10
-                    logger.info(f"Added 10 credits to user {app_user_id} for weekly subscription renewal")
-                elif product_id == "com.vemix.yearly":
-                    user.credits += 60
-                    logger.info(f"Added 60 credits to user {app_user_id} for yearly subscription renewal")
-                else:
-                    logger.warning(f"Unknown product_id: {product_id}")
-            else:
-                logger.error(f"User not found: {app_user_id}")
         except ValueError:
             logger.error(f"Invalid UUID format for app_user_id: {app_user_id}")
+
+    return {
+        'event_id': event.get('id'),
+        'event_type': event.get('type'),
+        'app_user_id': app_user_id,
+        'product_id': product_id,
+        'environment': event.get('environment', 'production'),
+        'event_timestamp': event_timestamp,
+        'payload': event_data,
+        'processed': True,
+        'credits_granted': credits_for_event(event) if user_uuid is not None else 0,
+    }, user_uuid
+
+
+def process_webhook_event(event_data: dict, db: Session, commit: bool = True):
+    # Extract event data from RevenueCat webhook format
+    event = event_data.get('event', {})
+    event_type = event.get('type')
+    event_id = event.get('id')
+    app_user_id = event.get('app_user_id')
+    product_id = event.get('product_id')
     
-    webhook_event.processed = True
-    db.commit()
+    # Only process RENEWAL events
+    if event_type != "RENEWAL":
+        logger.info(f"Ignoring non-renewal event type: {event_type}")
+        return {"status": "ignored", "event_type": event_type}
     
-    return {"status": "processed", "event_id": event_id}
\ No newline at end of file
+    # Retry storms are answered from memory
+    if event_id is not None and recent_events.seen(event_id):
+        logger.info(f"Event {event_id} already processed")
+        return {"status": "already_processed", "event_id": event_id}
+    
+    values, user_uuid = event_row(event_data)
+    amount = values['credits_granted']
+    inserted = insert_event(db, values)
+    if inserted is None:
+        logger.info(f"Event {event_id} already processed")
+        if commit:
+            db.commit()
+            recent_events.add(event_id)
+        return {"status": "already_processed", "event_id": event_id}
+    
+    # Process credits for renewal
+    granted_to = None
+    if user_uuid is not None:
+        if amount == 0:
+            logger.warning(f"Unknown product_id: {product_id}")
+        else:
+            total = db.execute(
+                update(User)
+                .where(User.id == user_uuid)
+                .values(credits=User.credits + amount)
+                .returning(User.credits)
+                .execution_options(synchronize_session=False)
+            ).scalar_one_or_none()
+            if total is None:
+                logger.error(f"User not found: {app_user_id}")
+                # Nothing was granted; a replay once the user exists can still grant it
+                db.execute(
+                    update(WebhookEvent)
+                    .where(WebhookEvent.id == inserted)
+                    .values(credits_granted=0)
+                    .execution_options(synchronize_session=False)
+                )
+            else:
+                granted_to = user_uuid
+                logger.info(f"Added {amount} credits to user {app_user_id} for {product_id} renewal")
+    
+    if commit:
+        db.commit()
+        recent_events.add(event_id)
+        if granted_to is not None:
+            balance_cache.invalidate(granted_to)
+    
+    return {"status": "processed", "event_id": event_id}
+
+
+def process_webhook_batch(payloads: list, db: Session):
+    """Apply a batch of payloads with one multi-row INSERT and one set-based UPDATE. Does not commit.
+
+    Returns one result per payload, as process_webhook_event(commit=False)
+    would. The INSERT ... ON CONFLICT (event_id) DO NOTHING RETURNING
+    event_id tells which events are new; only those grant credits, summed
+    per user (credits.apply_credit_deltas). Events for users that don't
+    exist are left with credits_granted = 0 so a replay can grant them.
+    """
+    results = [None] * len(payloads)
+    rows = {}
+    for index, event_data in enumerate(payloads):
+        event = event_data.get('event', {})
+        event_type, event_id = event.get('type'), event.get('id')
+        if event_type != "RENEWAL":
+            logger.info(f"Ignoring non-renewal event type: {event_type}")
+            results[index] = {"status": "ignored", "event_type": event_type}
+        elif event_id is None:
+            # Can't be matched to RETURNING event_id; rare enough to insert on its own
+            results[index] = process_webhook_event(event_data, db, commit=False)
+        elif event_id in rows or recent_events.seen(event_id):
+            results[index] = {"status": "already_processed", "event_id": event_id}
+        else:
+            rows[event_id] = (index, *event_row(event_data))
+    if not rows:
+        return results
+
+    inserted = set(db.execute(
+        _insert(db, WebhookEvent)
+        .values([values for _, values, _ in rows.values()])
+        .on_conflict_do_nothing(index_elements=[WebhookEvent.event_id])
+        .returning(WebhookEvent.event_id)
+    ).scalars())
+
+    deltas = {}
+    for event_id, (index, values, user_uuid) in rows.items():
+        if event_id not in inserted:
+            logger.info(f"Event {event_id} already processed")
+            results[index] = {"status": "already_processed", "event_id": event_id}
+            continue
+        results[index] = {"status": "processed", "event_id": event_id}
+        if user_uuid is None:
+            continue
+        if values['credits_granted'] == 0:
+            logger.warning(f"Unknown product_id: {values['product_id']}")
+        else:
+            deltas[user_uuid] = deltas.get(user_uuid, 0) + values['credits_granted']
+
+    granted = apply_credit_deltas(db, deltas)
+    not_found = [event_id for event_id, (_, values, user_uuid) in rows.items()
+                 if event_id in inserted and user_uuid in granted and granted[user_uuid][0] == 'not_found']
+    if not_found:
+        for event_id in not_found:
+            logger.error(f"User not found: {rows[event_id][1]['app_user_id']}")
+        # Nothing was granted; a replay once the user exists can still grant it
+        db.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.event_id.in_(not_found))
+            .values(credits_granted=0)
+            .execution_options(synchronize_session=False)
+        )
+    return results
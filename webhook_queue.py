@@ -0,0 +1,180 @@
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from sqlalchemy import delete, func, select, update
+
+from models import SessionLocal, WebhookQueueItem
+from balance_cache import balance_cache
+from metrics import observe_webhook
+from webhook_handler import process_webhook_batch, recent_events
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', 200))
+WEBHOOK_POLL_INTERVAL = float(os.getenv('WEBHOOK_POLL_INTERVAL', 1))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 5))
+
+
+def enqueue_webhook(db, event_data):
+    """Durably store a raw RevenueCat payload for the background worker."""
+    item = WebhookQueueItem(payload=event_data, received_at=datetime.utcnow())
+    db.add(item)
+    db.flush()
+    item_id = item.id
+    db.commit()
+    return item_id
+
+
+class WebhookQueueWorker:
+    """Drains webhook_queue in batches: one transaction, a few statements and one commit per batch.
+
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED so several
+    workers (or processes) can drain the same table. If a batch fails it is
+    retried row by row so one bad payload cannot block the rest; rows that
+    fail `max_attempts` times stay in the table for inspection.
+    """
+
+    def __init__(self, batch_size=WEBHOOK_BATCH_SIZE, poll_interval=WEBHOOK_POLL_INTERVAL,
+                 max_attempts=WEBHOOK_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._counters = {'batches': 0, 'processed': 0, 'failed': 0}
+        self._outcomes = {}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='webhook-queue', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                drained = self.drain_once()
+            except Exception as e:
+                logger.error(f"Webhook queue worker error: {str(e)}")
+                drained = 0
+            if drained < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def drain_once(self):
+        """Process one batch. Returns the number of queue rows consumed."""
+        db = SessionLocal()
+        try:
+            items = db.execute(
+                select(WebhookQueueItem.id, WebhookQueueItem.payload)
+                .where(WebhookQueueItem.attempts < self.max_attempts)
+                .order_by(WebhookQueueItem.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if not items:
+                db.rollback()
+                return 0
+
+            try:
+                payloads = [payload for _, payload in items]
+                results = self._apply(db, payloads)
+                db.execute(delete(WebhookQueueItem).where(WebhookQueueItem.id.in_([item_id for item_id, _ in items])))
+                db.commit()
+                outcomes = self._committed(payloads, results)
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Webhook batch of {len(items)} failed, retrying row by row: {str(e)}")
+                outcomes = self._apply_individually(db, items)
+
+            self._record(outcomes)
+            return len(items)
+        finally:
+            db.close()
+
+    def _apply(self, db, payloads):
+        # One multi-row INSERT ... ON CONFLICT DO NOTHING and one set-based
+        # credit UPDATE for the whole batch; repeats inside it count once
+        return process_webhook_batch(payloads, db)
+
+    def _committed(self, payloads, results):
+        granted = set()
+        for payload, result in zip(payloads, results):
+            if result['status'] in ('processed', 'already_processed'):
+                recent_events.add(result.get('event_id'))
+            if result['status'] == 'processed':
+                try:
+                    granted.add(uuid.UUID(payload['event'].get('app_user_id')))
+                except (TypeError, ValueError):
+                    pass
+        balance_cache.invalidate_many(granted)
+        return [result['status'] for result in results]
+
+    def _apply_individually(self, db, items):
+        outcomes = []
+        for item_id, payload in items:
+            try:
+                results = self._apply(db, [payload])
+                db.execute(delete(WebhookQueueItem).where(WebhookQueueItem.id == item_id))
+                db.commit()
+                outcome = self._committed([payload], results)[0]
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Webhook queue item {item_id} failed: {str(e)}")
+                db.execute(
+                    update(WebhookQueueItem)
+                    .where(WebhookQueueItem.id == item_id)
+                    .values(attempts=WebhookQueueItem.attempts + 1, last_error=str(e)[:500])
+                )
+                db.commit()
+                outcome = 'failed'
+            outcomes.append(outcome)
+        return outcomes
+
+    def _record(self, outcomes):
+        with self._lock:
+            self._counters['batches'] += 1
+            for outcome in outcomes:
+                observe_webhook(outcome)
+                self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+                self._counters['failed' if outcome == 'failed' else 'processed'] += 1
+
+    def stats(self):
+        """Worker counters plus queue depth and lag read from the table."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['outcomes'] = dict(self._outcomes)
+            stats['running'] = self._thread is not None and self._thread.is_alive()
+
+        db = SessionLocal()
+        try:
+            depth, oldest = db.execute(
+                select(func.count(WebhookQueueItem.id), func.min(WebhookQueueItem.received_at))
+                .where(WebhookQueueItem.attempts < self.max_attempts)
+            ).one()
+            dead = db.execute(
+                select(func.count(WebhookQueueItem.id))
+                .where(WebhookQueueItem.attempts >= self.max_attempts)
+            ).scalar_one()
+        finally:
+            db.close()
+
+        stats['depth'] = depth
+        stats['dead_letters'] = dead
+        stats['lag_seconds'] = round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else 0.0
+        return stats
@@ -0,0 +1,288 @@
+"""Replay stored RevenueCat webhooks against the current credit rules.
+
+Every event in webhook_events records how many credits it has granted
+(credits_granted). A replay re-evaluates the stored payload with
+credits_for_event() and applies only the difference, so running it twice,
+or while webhooks keep arriving, never grants the same credits twice.
+Typical uses: RENEWAL_CREDITS changed, or users registered after their
+renewal webhook arrived.
+
+Events are read in id order through a server-side cursor (yield_per) and
+handed to a bounded worker pool in batches; each batch is one
+transaction. Memory use depends on the batch size, not the table size.
+
+    python webhook_replay.py --since 2026-10-01 --type RENEWAL --dry-run
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from sqlalchemy import case, select, update
+
+from balance_cache import balance_cache
+from models import db_session, User, WebhookEvent
+from webhook_handler import credits_for_event
+
+logger = logging.getLogger(__name__)
+
+REPLAY_BATCH_SIZE = int(os.getenv('REPLAY_BATCH_SIZE', 500))
+REPLAY_WORKERS = int(os.getenv('REPLAY_WORKERS', 4))
+
+
+def parse_time(value):
+    """ISO 8601 timestamp as the naive UTC datetime webhook_events stores, or None."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def replay_query(since=None, until=None, event_type=None, app_user_id=None):
+    query = select(WebhookEvent.id, WebhookEvent.app_user_id, WebhookEvent.payload, WebhookEvent.credits_granted)
+    if since is not None:
+        query = query.where(WebhookEvent.event_timestamp >= since)
+    if until is not None:
+        query = query.where(WebhookEvent.event_timestamp < until)
+    if event_type:
+        query = query.where(WebhookEvent.event_type == event_type)
+    if app_user_id:
+        query = query.where(WebhookEvent.app_user_id == app_user_id)
+    return query.order_by(WebhookEvent.id)
+
+
+def stream_events(db, query, batch_size):
+    """Yield lists of at most `batch_size` rows."""
+    if db.get_bind().dialect.name == 'sqlite':
+        # An open SQLite read cursor blocks the workers' commits, so page by id instead
+        last_id = 0
+        while True:
+            rows = db.execute(query.where(WebhookEvent.id > last_id).limit(batch_size)).all()
+            db.commit()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield rows
+    else:
+        for rows in db.execute(query.execution_options(yield_per=batch_size)).partitions():
+            yield rows
+
+
+def replay_batch(rows, dry_run=False, clawback=False):
+    """Apply the credit difference of each (id, app_user_id, payload, credits_granted) row in one transaction."""
+    counts = Counter()
+    granted = set()
+    with db_session() as db:
+        try:
+            for event_pk, app_user_id, payload, previous in rows:
+                event = (payload or {}).get('event') or {}
+                try:
+                    user_uuid = uuid.UUID(str(app_user_id))
+                    desired = credits_for_event(event)
+                except ValueError:
+                    user_uuid, desired = None, 0
+                delta = desired - (previous or 0)
+                if delta == 0:
+                    counts['unchanged'] += 1
+                    continue
+                if delta < 0 and not clawback:
+                    counts['clawback_skipped'] += 1
+                    continue
+                if dry_run:
+                    counts['changed'] += 1
+                    counts['credits_delta'] += delta
+                    continue
+
+                # Claim the change first: a concurrent replay of the same row finds
+                # credits_granted already moved and leaves it alone
+                claimed = db.execute(
+                    update(WebhookEvent)
+                    .where(WebhookEvent.id == event_pk, WebhookEvent.credits_granted == previous)
+                    .values(credits_granted=desired)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                if not claimed:
+                    counts['conflict'] += 1
+                    continue
+                if user_uuid is not None:
+                    credits = User.credits + delta
+                    if delta < 0:
+                        # Credits already spent can't be taken back
+                        credits = case((credits >= 0, credits), else_=0)
+                    total = db.execute(
+                        update(User)
+                        .where(User.id == user_uuid)
+                        .values(credits=credits)
+                        .returning(User.credits)
+                        .execution_options(synchronize_session=False)
+                    ).scalar_one_or_none()
+                    if total is None:
+                        db.execute(
+                            update(WebhookEvent)
+                            .where(WebhookEvent.id == event_pk)
+                            .values(credits_granted=previous)
+                            .execution_options(synchronize_session=False)
+                        )
+                        counts['user_not_found'] += 1
+                        continue
+                    granted.add(user_uuid)
+                counts['changed'] += 1
+                counts['credits_delta'] += delta
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Webhook replay batch of {len(rows)} events failed: {str(e)}")
+            return Counter(failed=len(rows))
+    balance_cache.invalidate_many(granted)
+    return counts
+
+
+class WebhookReplay:
+    """One replay run. run() blocks; stats() is safe to call from other threads meanwhile."""
+
+    def __init__(self, since=None, until=None, event_type=None, app_user_id=None, dry_run=False,
+                 clawback=False, batch_size=REPLAY_BATCH_SIZE, workers=REPLAY_WORKERS, progress=None):
+        self.filters = {'since': since, 'until': until, 'event_type': event_type, 'app_user_id': app_user_id}
+        self.dry_run = dry_run
+        self.clawback = clawback
+        self.batch_size = batch_size
+        self.workers = workers
+        self.progress = progress
+
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._counts = Counter()
+        self.state = 'pending'
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def run(self):
+        self.state = 'running'
+        self.started_at = time.time()
+        in_flight = set()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='webhook-replay') as pool:
+                with db_session() as db:
+                    for rows in stream_events(db, replay_query(**self.filters), self.batch_size):
+                        if self._cancelled.is_set():
+                            break
+                        # Bounded read-ahead: don't read faster than the workers apply
+                        while len(in_flight) >= self.workers * 2:
+                            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                            self._collect(done)
+                        self._add(scanned=len(rows))
+                        in_flight.add(pool.submit(replay_batch, [tuple(row) for row in rows],
+                                                  self.dry_run, self.clawback))
+                done, in_flight = wait(in_flight)
+                self._collect(done)
+            self.state = 'cancelled' if self._cancelled.is_set() else 'finished'
+        except Exception as e:
+            logger.error(f"Webhook replay failed: {str(e)}")
+            self.state = 'failed'
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+        return self.stats()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _add(self, **counts):
+        with self._lock:
+            self._counts.update(counts)
+
+    def _collect(self, futures):
+        for future in futures:
+            with self._lock:
+                self._counts.update(future.result())
+                self._counts['batches'] += 1
+            if self.progress is not None:
+                self.progress(self.stats())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+        stats['state'] = self.state
+        stats['dry_run'] = self.dry_run
+        stats['filters'] = {key: value.isoformat() if isinstance(value, datetime) else value
+                            for key, value in self.filters.items() if value is not None}
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            stats['elapsed_seconds'] = round(elapsed, 1)
+            stats['events_per_second'] = round(stats.get('scanned', 0) / elapsed, 1) if elapsed else None
+        if self.error:
+            stats['error'] = self.error
+        return stats
+
+
+class ReplayJobs:
+    """Replays started from the admin endpoint, run one at a time on a background thread."""
+
+    def __init__(self, max_finished=20):
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._ids = itertools.count(1)
+
+    def start(self, replay):
+        """Return the job id, or None while another replay is running."""
+        with self._lock:
+            if any(job.state in ('pending', 'running') for job in self._jobs.values()):
+                return None
+            job_id = next(self._ids)
+            self._jobs[job_id] = replay
+            for old_id in sorted(self._jobs)[:-self.max_finished - 1]:
+                del self._jobs[old_id]
+        threading.Thread(target=replay.run, name=f'webhook-replay-{job_id}', daemon=True).start()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            jobs = dict(self._jobs)
+        return {str(job_id): job.stats()['state'] for job_id, job in jobs.items()}
+
+
+replay_jobs = ReplayJobs()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--since', type=parse_time, help='event_timestamp >= this (ISO 8601)')
+    parser.add_argument('--until', type=parse_time, help='event_timestamp < this (ISO 8601)')
+    parser.add_argument('--type', dest='event_type')
+    parser.add_argument('--user', dest='app_user_id')
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without writing')
+    parser.add_argument('--clawback', action='store_true', help='also take back credits the current rules no longer grant')
+    parser.add_argument('--batch-size', type=int, default=REPLAY_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=REPLAY_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    def progress(stats):
+        print(json.dumps(stats), file=sys.stderr, flush=True)
+
+    replay = WebhookReplay(since=args.since, until=args.until, event_type=args.event_type,
+                           app_user_id=args.app_user_id, dry_run=args.dry_run, clawback=args.clawback,
+                           batch_size=args.batch_size, workers=args.workers, progress=progress)
+    stats = replay.run()
+    print(json.dumps(stats, indent=2))
+    sys.exit(0 if stats['state'] == 'finished' and not stats.get('failed') else 1)
+
+
+if __name__ == '__main__':
+    main()